@@ -108,26 +108,27 @@ class Database:
             
             months_ago = (datetime.now() - timedelta(days=months * 30)).strftime('%Y-%m-%d')
             
+            # Per-device daily rollups maintained by flask_app (history filled by migration 003); averages are sum / count
             query = """
             SELECT 
-                DATE(timestamp) as date,
-                AVG(temperature) as avg_temp,
-                MIN(temperature) as min_temp,
-                MAX(temperature) as max_temp,
-                AVG(humidity) as avg_humidity,
-                MIN(humidity) as min_humidity,
-                MAX(humidity) as max_humidity,
-                AVG(brightness) as avg_brightness,
-                MIN(brightness) as min_brightness,
-                MAX(brightness) as max_brightness,
-                AVG(electric) as avg_electric,
-                MIN(electric) as min_electric,
-                MAX(electric) as max_electric,
-                SUM(electric) as total_electric,
-                COUNT(*) as reading_count
-            FROM power_readings
-            WHERE timestamp >= %s
-            GROUP BY DATE(timestamp)
+                bucket as date,
+                SUM(temperature_sum) / NULLIF(SUM(temperature_count), 0) as avg_temp,
+                MIN(temperature_min) as min_temp,
+                MAX(temperature_max) as max_temp,
+                SUM(humidity_sum) / NULLIF(SUM(humidity_count), 0) as avg_humidity,
+                MIN(humidity_min) as min_humidity,
+                MAX(humidity_max) as max_humidity,
+                SUM(brightness_sum) / NULLIF(SUM(brightness_count), 0) as avg_brightness,
+                MIN(brightness_min) as min_brightness,
+                MAX(brightness_max) as max_brightness,
+                SUM(electric_sum) / NULLIF(SUM(electric_count), 0) as avg_electric,
+                MIN(electric_min) as min_electric,
+                MAX(electric_max) as max_electric,
+                SUM(electric_sum) as total_electric,
+                SUM(readings) as reading_count
+            FROM power_rollup_daily
+            WHERE bucket >= %s
+            GROUP BY bucket
             ORDER BY date ASC
             """
             
@@ -164,20 +165,20 @@ class Database:
             
             query = """
             SELECT 
-                YEAR(timestamp) as year,
-                MONTH(timestamp) as month,
-                AVG(temperature) as avg_temp,
-                AVG(humidity) as avg_humidity,
-                AVG(brightness) as avg_brightness,
-                AVG(electric) as avg_electric,
-                SUM(electric) as total_electric,
-                COUNT(*) as reading_count,
-                MIN(timestamp) as period_start,
-                MAX(timestamp) as period_end
-            FROM power_readings
-            WHERE timestamp >= %s
-            GROUP BY YEAR(timestamp), MONTH(timestamp)
-            ORDER BY YEAR(timestamp), MONTH(timestamp)
+                YEAR(bucket) as year,
+                MONTH(bucket) as month,
+                SUM(temperature_sum) / NULLIF(SUM(temperature_count), 0) as avg_temp,
+                SUM(humidity_sum) / NULLIF(SUM(humidity_count), 0) as avg_humidity,
+                SUM(brightness_sum) / NULLIF(SUM(brightness_count), 0) as avg_brightness,
+                SUM(electric_sum) / NULLIF(SUM(electric_count), 0) as avg_electric,
+                SUM(electric_sum) as total_electric,
+                SUM(readings) as reading_count,
+                MIN(first_timestamp) as period_start,
+                MAX(last_timestamp) as period_end
+            FROM power_rollup_daily
+            WHERE bucket >= %s
+            GROUP BY YEAR(bucket), MONTH(bucket)
+            ORDER BY YEAR(bucket), MONTH(bucket)
             """
             
             cursor.execute(query, (months_ago,))
@@ -252,14 +253,14 @@ class Database:
             query = """
             SELECT 
                 device_code,
-                COUNT(*) as total_readings,
-                AVG(electric) as avg_power,
-                SUM(electric) as total_power,
-                MIN(timestamp) as first_reading,
-                MAX(timestamp) as last_reading,
-                DATEDIFF(MAX(timestamp), MIN(timestamp)) + 1 as active_days
-            FROM power_readings
-            WHERE timestamp >= %s
+                SUM(readings) as total_readings,
+                SUM(electric_sum) / NULLIF(SUM(electric_count), 0) as avg_power,
+                SUM(electric_sum) as total_power,
+                MIN(first_timestamp) as first_reading,
+                MAX(last_timestamp) as last_reading,
+                DATEDIFF(MAX(last_timestamp), MIN(first_timestamp)) + 1 as active_days
+            FROM power_rollup_daily
+            WHERE bucket >= %s
             GROUP BY device_code
             ORDER BY total_power DESC
             """
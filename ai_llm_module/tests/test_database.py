@@ -162,11 +162,11 @@ class TestDatabase:
         assert 'total_electric' in result.columns
         assert 'reading_count' in result.columns
         
-        # Verify SQL query includes aggregation
+        # Verify SQL query reads the daily rollup instead of raw readings
         query = mock_cursor.execute.call_args[0][0]
-        assert 'AVG(' in query
-        assert 'SUM(' in query
-        assert 'GROUP BY DATE(timestamp)' in query
+        assert 'FROM power_rollup_daily' in query
+        assert 'SUM(temperature_sum) / NULLIF(SUM(temperature_count), 0)' in query
+        assert 'GROUP BY bucket' in query
     
     @patch('modules.database.mysql.connector.connect')
     def test_get_monthly_summaries(self, mock_connect):
@@ -205,11 +205,10 @@ class TestDatabase:
         assert 'year_month' in result.columns
         assert 'total_electric' in result.columns
         
-        # Verify SQL query includes monthly grouping
+        # Verify SQL query groups the daily rollup by month
         query = mock_cursor.execute.call_args[0][0]
-        assert 'YEAR(timestamp)' in query
-        assert 'MONTH(timestamp)' in query
-        assert 'GROUP BY YEAR(timestamp), MONTH(timestamp)' in query
+        assert 'FROM power_rollup_daily' in query
+        assert 'GROUP BY YEAR(bucket), MONTH(bucket)' in query
     
     @patch('modules.database.mysql.connector.connect')
     def test_save_esg_report(self, mock_connect):
@@ -268,11 +267,11 @@ class TestDatabase:
         assert 'device_code' in result.columns
         assert 'total_power' in result.columns
         
-        # Verify SQL query includes device grouping
+        # Verify SQL query groups the daily rollup by device
         query = mock_cursor.execute.call_args[0][0]
+        assert 'FROM power_rollup_daily' in query
         assert 'GROUP BY device_code' in query
-        assert 'COUNT(*)' in query
-        assert 'AVG(electric)' in query
+        assert 'SUM(readings)' in query
     
     @patch('modules.database.mysql.connector.connect')
     def test_test_connection_success(self, mock_connect):
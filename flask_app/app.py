@@ -1,15 +1,39 @@
-from flask import Flask, request
+import os
+
+# Multi-worker mode: workers share Socket.IO emits and rooms through this message queue, e.g. redis://redis:6379/0.
+# The queue client needs cooperative sockets under eventlet, so patch before anything else is imported.
+message_queue = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+if message_queue:
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
-import os
 import json
+import time
+import atexit
+import signal
+import threading
 import logging
+from functools import partial
 from flask_socketio import SocketIO
 import datetime
 from flask_socketio import join_room, leave_room
 
 from modules.mqtt_client import MQTTClient
-from modules.database import Database
+from modules.database import Database, BatchWriter, BlockingExecutor
+from modules.ingest import IngestPipeline
+from modules.spool import Spool, SpoolReplayer
+from modules.capture import CaptureWriter
+from modules.codecs import CodecRegistry
+from modules.metrics import RollingStats
+from modules.recent import RecentReadings
+from modules.broadcast import (CoalescingBroadcaster, Subscriptions, ALL_DEVICES, device_room, parse_device_groups,
+                               transport_backlog)
+from modules.socket_format import encode_event, encode_batch
+from modules.relay import create_relay
+from modules.readings import Reading
 from modules.api import setup_routes
 
 # Load environment variables from .env file
@@ -22,34 +46,92 @@ logging.basicConfig(level=logging.INFO,
 
 # Flask & SocketIO initialization
 app = Flask(__name__)
-CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True)
+CORS(app, expose_headers=["X-Next-Cursor"])
+socketio_channel = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio')
+socketio = SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True,
+                    message_queue=message_queue, channel=socketio_channel)
 
 # Connected clients tracking
 connected_clients = set()
+# Device subscriptions per client; groups come from DEVICE_GROUPS, e.g. "floor1=dev-1|dev-2,floor2=dev-3"
+subscriptions = Subscriptions(parse_device_groups(os.environ.get('DEVICE_GROUPS', '')))
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
 
 # --- Socket.IO Event Handlers ---------------------------------------------
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     """Handle client connection"""
     client_id = request.sid
     connected_clients.add(client_id)
-    logging.info(f"Client {client_id} connected. Total clients: {len(connected_clients)}")
+    # Clients connecting with auth {"batch": true} get coalesced 'readings_batch' frames,
+    # auth {"format": "msgpack"} gets binary MessagePack frames instead of JSON,
+    # and auth {"devices": [...], "groups": [...]} limits updates to those devices
+    auth = auth if isinstance(auth, dict) else {}
+    wants_batches = bool(auth.get('batch'))
+    try:
+        rooms = subscriptions.connect(client_id, batch=wants_batches,
+                                      devices=_as_list(auth.get('devices')), groups=_as_list(auth.get('groups')),
+                                      fmt=auth.get('format', 'json'))
+    except ValueError as e:
+        logging.warning(f"Client {client_id} requested {e}; using JSON updates for all devices instead.")
+        rooms = subscriptions.connect(client_id, batch=wants_batches)
+    for room in rooms:
+        join_room(room)
+    logging.info(f"Client {client_id} connected ({'batched' if wants_batches else 'per-reading'} "
+                 f"{subscriptions.format(client_id)} updates). Total clients: {len(connected_clients)}")
     
-    # Send connection confirmation with server status
-    socketio.emit('connection_status', {
+    # Send connection confirmation with server status; stream/seq is the cursor to resume from
+    socketio.emit('connection_status', encode_event({
         'status': 'connected',
         'client_id': client_id,
         'server_time': datetime.datetime.now().isoformat(),
         'mqtt_connected': mqtt_client.client.is_connected() if mqtt_client else False,
-        'db_available': db is not None
-    }, room=client_id)
+        'db_available': db is not None,
+        'stream': recent_readings.stream,
+        'seq': recent_readings.written
+    }, subscriptions.format(client_id)), room=client_id)
+
+    # Reconnecting clients send auth {"stream", "since_seq"} and/or {"since": timestamp}
+    if auth.get('since_seq') is not None or auth.get('since') is not None:
+        _send_resume(client_id, auth)
+
+def _send_resume(client_id, auth):
+    """Push what a reconnecting client missed in one 'resume' frame, without touching MySQL.
+
+    Readings after the client's cursor are replayed from the recent readings
+    store (mode "replay"). If the store no longer covers the gap, or it holds
+    more than SOCKETIO_REPLAY_MAX readings, the latest reading of each
+    followed device is sent instead (mode "snapshot").
+    """
+    devices = subscriptions.devices_for(client_id)
+    events = None
+    try:
+        # Sequence numbers restart with the process, so they only count on the same stream
+        if auth.get('since_seq') is not None and auth.get('stream') == recent_readings.stream:
+            events = recent_readings.since_seq(int(auth['since_seq']), devices, limit=replay_limit)
+    except (TypeError, ValueError):
+        pass
+    if events is None and auth.get('since') is not None:
+        events = recent_readings.since(auth['since'], devices, limit=replay_limit)
+
+    mode = 'replay' if events is not None else 'snapshot'
+    if events is None:
+        events = recent_readings.snapshot(devices)
+    socketio.emit('resume', encode_batch(events, subscriptions.format(client_id), mode=mode,
+                                         stream=recent_readings.stream, seq=recent_readings.written),
+                  room=client_id)
+    logging.info(f"Client {client_id} resumed with a {mode} of {len(events)} readings.")
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
     client_id = request.sid
     connected_clients.discard(client_id)
+    subscriptions.disconnect(client_id)
     logging.info(f"Client {client_id} disconnected. Total clients: {len(connected_clients)}")
 
 @socketio.on('ping')
@@ -63,11 +145,13 @@ def handle_ping():
     }, room=client_id)
 
 @socketio.on('get_latest_data')
-def handle_get_latest_data():
-    """Handle client request for latest data"""
+def handle_get_latest_data(options=None):
+    """Handle client request for latest data, optionally {"device_code": ...} for one device"""
     client_id = request.sid
-    
-    if not db:
+    device_code = options.get('device_code') if isinstance(options, dict) else None
+    db = current_database()
+
+    if device_code is None and not len(recent_readings) and not db:
         socketio.emit('error', {
             'type': 'database_error',
             'message': 'Database not available'
@@ -75,18 +159,23 @@ def handle_get_latest_data():
         return
     
     try:
-        # Get latest reading from database
-        latest_data = db.fetch_power_data(limit=1)
-        if latest_data:
-            data = latest_data[0]
-            socketio.emit('latest_data', {
+        # Served from the in-memory store; MySQL is only asked before anything was received
+        if device_code is not None:
+            data = recent_readings.latest_for(device_code)
+        elif len(recent_readings):
+            data = recent_readings.latest(1)[0]
+        else:
+            latest_data = db.fetch_power_data(limit=1)
+            data = latest_data[0] if latest_data else None
+        if data:
+            socketio.emit('latest_data', encode_event({
                 'device_code': data.get('device_code'),
                 'timestamp': data.get('timestamp').isoformat() if data.get('timestamp') else None,
                 'temperature': float(data.get('temperature')) if data.get('temperature') else None,
                 'humidity': float(data.get('humidity')) if data.get('humidity') else None,
                 'brightness': data.get('brightness'),
                 'electric': float(data.get('electric')) if data.get('electric') else None
-            }, room=client_id)
+            }, subscriptions.format(client_id)), room=client_id)
         else:
             socketio.emit('error', {
                 'type': 'no_data',
@@ -118,92 +207,337 @@ def handle_leave_room(data):
     logging.info(f"Client {client_id} left room: {room}")
     socketio.emit('room_left', {'room': room}, room=client_id)
 
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Follow devices or device groups: {"devices": [...], "groups": [...], "all": bool}.
+
+    Naming devices or groups stops the default all-devices subscription unless "all" is true.
+    """
+    data = data or {}
+    _update_subscription(subscriptions.subscribe, data, data.get('all'))
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data):
+    """Stop following devices or groups; {"all": true} leaves the all-devices room."""
+    data = data or {}
+    _update_subscription(subscriptions.unsubscribe, data, bool(data.get('all')))
+
+def _update_subscription(update, data, all_devices):
+    client_id = request.sid
+    try:
+        joined, left = update(client_id, devices=_as_list(data.get('devices')),
+                              groups=_as_list(data.get('groups')), all_devices=all_devices)
+    except ValueError as e:
+        socketio.emit('error', {'type': 'subscription_error', 'message': str(e)}, room=client_id)
+        return
+    for room in left:
+        leave_room(room)
+    for room in joined:
+        join_room(room)
+    socketio.emit('subscribed', subscriptions.describe(client_id), room=client_id)
+
 # --- Initializations ---------------------------------------------------
+# Under eventlet, queries from request and Socket.IO handlers run on this many real threads instead of the hub
+db_threads = int(os.environ.get('DB_THREADPOOL_SIZE', 4))
+db_executor = BlockingExecutor(db_threads) if socketio.async_mode == 'eventlet' and db_threads > 0 else None
+
+_db_lock = threading.Lock()
+# While MySQL is down, requests retry the connection at most this often
+db_reconnect_interval = float(os.environ.get('DB_RECONNECT_INTERVAL', 5.0))
+_db_retry_at = 0.0
+
+def connect_database():
+    """Create the worker's Database (queries go through db_executor) unless one exists already.
+
+    Used at startup, by the spool replayer and by current_database(), so all of them share one pool.
+    """
+    global db
+    with _db_lock:
+        if db is None:
+            db = Database(executor=db_executor)
+            logging.info("Database pool initialized successfully.")
+        return db
+
+def current_database():
+    """The worker's Database, or None while MySQL is unreachable; reconnects lazily."""
+    global _db_retry_at
+    if db is None and time.monotonic() >= _db_retry_at:
+        _db_retry_at = time.monotonic() + db_reconnect_interval
+        try:
+            connect_database()
+        except Exception as e:
+            logging.warning(f"Database still unavailable: {e}")
+    return db
+
+db = None
 try:
-    db = Database()
-    logging.info("Database pool initialized successfully.")
+    connect_database()
 except Exception as e:
     logging.critical(f"Failed to initialize database: {e}", exc_info=True)
-    db = None
+    _db_retry_at = time.monotonic() + db_reconnect_interval
+
+# Latest reading per device and the last N readings, so live endpoints skip MySQL
+recent_readings = RecentReadings(capacity=int(os.environ.get('RECENT_READINGS_SIZE', 1000)))
+# Reconnecting clients missing more readings than this get a per-device snapshot instead
+replay_limit = int(os.environ.get('SOCKETIO_REPLAY_MAX', 1000))
+if db:
+    try:
+        recent_readings.warm(db)
+    except Exception as e:
+        logging.error(f"Failed to warm recent readings store: {e}", exc_info=True)
+
+# Multi-worker mode: MQTT_INGEST=false workers only serve REST and Socket.IO clients and get
+# readings from the ingesting worker(s) through the relay
+ingest_enabled = os.environ.get('MQTT_INGEST', 'true').lower() not in ('0', 'false', 'no')
+
+# Optional on-disk spool that keeps readings while MySQL is down or too slow
+spool_dir = os.environ.get('INGEST_SPOOL_DIR') if ingest_enabled else None
+spool = Spool(spool_dir) if spool_dir else None
+
+# Readings are buffered and group-committed instead of one INSERT/commit per message
+if ingest_enabled and (db or spool):
+    latency_budget = os.environ.get('INGEST_LATENCY_BUDGET_MS')
+    ingest_writer = BatchWriter(
+        db,
+        max_batch_size=int(os.environ.get('INGEST_BATCH_SIZE', 500)),
+        max_batch_age=float(os.environ.get('INGEST_BATCH_MAX_AGE', 1.0)),
+        spool=spool,
+        latency_budget_ms=float(latency_budget) if latency_budget else None,
+    )
+else:
+    ingest_writer = None
+
+if spool:
+    # Drains the spool at full batch speed (and connects, if MySQL was down at startup)
+    spool_replayer = SpoolReplayer(spool, ingest_writer, connect=connect_database,
+                                   interval=float(os.environ.get('INGEST_SPOOL_REPLAY_INTERVAL', 5.0)))
+else:
+    spool_replayer = None
+
+# Live readings are fanned out by a background task, coalesced into one frame per client per window
+broadcaster = CoalescingBroadcaster(
+    socketio,
+    window=float(os.environ.get('SOCKETIO_BATCH_WINDOW_MS', 250)) / 1000,
+    subscriptions=subscriptions,
+    # Batch clients that stop acknowledging frames buffer at most this many readings each
+    client_queue_size=int(os.environ.get('SOCKETIO_CLIENT_QUEUE_SIZE', 1000)),
+    client_policy=os.environ.get('SOCKETIO_SLOW_CLIENT_POLICY', 'conflate'),
+    ack_timeout=float(os.environ.get('SOCKETIO_ACK_TIMEOUT', 10.0)),
+    # Per-reading clients do not ack; they are held back while their transport is still sending
+    backlog=partial(transport_backlog, socketio),
+)
+
+# Every worker gets every ingested reading through the relay (in-process without a message queue)
+reading_relay = create_relay(message_queue, channel=f'{socketio_channel}-readings')
+
+def on_relayed_readings(events):
+    """Remember readings from any ingesting worker and queue them for this worker's clients."""
+    for event in events:
+        # Redelivered readings are not broadcast again
+        seq = recent_readings.add(*Reading(**event))
+        if seq is not None:
+            broadcaster.publish(dict(event, seq=seq), rooms=(ALL_DEVICES, device_room(event['device_code'])))
+
+reading_relay.subscribe(on_relayed_readings)
 
 # --- MQTT Message Handling ---------------------------------------------
-def on_message_callback(payload):
+# Gateways publish buffered samples as one envelope on this topic
+batch_topic = os.environ.get('MQTT_BATCH_TOPIC', 'power/measurement/batch')
+# Extra topics carrying binary payloads, e.g. "power/measurement/msgpack=msgpack,power/measurement/bin=struct"
+payload_codecs = CodecRegistry.from_env(os.environ.get('MQTT_CODEC_TOPICS', ''))
+# Publish-to-commit latency of messages that carry a 'sentAt' send time (load generator)
+end_to_end_latency = RollingStats(window=10000)
+
+def _on_reading_committed(sent_at, ack):
+    end_to_end_latency.add(time.time() * 1000 - sent_at)
+    if ack:
+        ack()
+
+def on_message_callback(payload, topic=None, ack=None):
     """
     Callback function to process incoming MQTT messages.
-    Parses the JSON payload and inserts it into the database.
+    Decodes the payload with the topic's codec (JSON unless configured
+    otherwise) and hands the readings to the batch writer.
+
+    Messages on ``batch_topic`` carry several readings (see
+    ``modules.readings.readings_from_batch``), which are buffered together so
+    they are written in one round trip.
+
+    ``ack`` (at-least-once delivery only) is run after the readings are committed.
+    Malformed messages are acknowledged right away so they are not redelivered forever.
     """
-    if not db:
+    if not ingest_writer:
         logging.warning("Database not available. Skipping message processing.")
         return
 
     try:
-        data = json.loads(payload)
-        
-        # Extract data from payload
-        device_code = data.get('deviceCode')
-        timestamp = data.get('timestamp')
-        temp = data.get('temp')
-        humidity = data.get('humidity')
-        brightness = data.get('brightness')
-        electric = data.get('electric')
+        readings, sent_at = payload_codecs.decode_message(topic, payload, batch=topic == batch_topic)
 
         # Basic validation
-        if device_code is None or timestamp is None:
-            logging.warning(f"Skipping message due to missing deviceCode or timestamp: {data}")
+        if not readings:
+            logging.warning(f"Skipping message due to missing deviceCode or timestamp: {payload!r}")
+            if ack:
+                ack()
             return
 
-        # Insert into database
-        db.insert_reading(device_code, timestamp, temp, humidity, brightness, electric)
-        logging.info(f"Successfully inserted reading for device {device_code}")
+        on_commit = ack if sent_at is None else partial(_on_reading_committed, sent_at, ack)
+
+        # Buffer for the next batched insert; a batch stays together in one round trip
+        if len(readings) == 1:
+            ingest_writer.add(*readings[0], on_commit=on_commit)
+        else:
+            ingest_writer.add_many(readings, on_commit=on_commit)
+        logging.debug(f"Queued {len(readings)} reading(s) from topic {topic}")
 
-        # Emit data to connected WebSocket clients
+        # Live endpoints, resume and WebSocket clients of every worker
         try:
-            socketio.emit('reading', {
-                'device_code': device_code,
-                'timestamp': timestamp,
-                'temperature': temp,
-                'humidity': humidity,
-                'brightness': brightness,
-                'electric': electric
-            })
+            reading_relay.publish([reading.to_event() for reading in readings])
         except Exception as e:
             logging.error(f"SocketIO emit failed: {e}")
 
     except json.JSONDecodeError:
         logging.error(f"Error decoding JSON from payload: {payload}", exc_info=True)
+        if ack:
+            ack()
+    except ValueError as e:
+        logging.error(f"Rejected malformed payload on topic {topic}: {e}")
+        if ack:
+            ack()
     except Exception as e:
         logging.error(f"Error processing message: {e}", exc_info=True)
+        # Left unacknowledged; the broker only redelivers it on a new connection
+        if ack and mqtt_client:
+            mqtt_client.request_redelivery()
 
-# Initialize MQTT client if the database is available
-if db:
+# Initialize MQTT client if readings can be stored (database or spool)
+mqtt_tap = None
+if ingest_writer:
     try:
         main_topic = os.environ.get('MQTT_TOPIC', 'power/measurement')
         test_topic = os.environ.get('MQTT_TEST_TOPIC', 'power/test')
+        topics = [main_topic, test_topic, batch_topic]
         
+        # Parsing, DB writes and emits run on pipeline workers, not the paho network thread
+        ingest_pipeline = IngestPipeline(
+            on_message_callback,
+            maxsize=int(os.environ.get('INGEST_QUEUE_SIZE', 10000)),
+            workers=int(os.environ.get('INGEST_WORKERS', 2)),
+            policy=os.environ.get('INGEST_BACKPRESSURE', 'block'),
+            spill_path=os.environ.get('INGEST_SPILL_PATH'),
+        )
+
+        # Tap mode: record raw traffic for scripts/replay_capture.py
+        tap_path = os.environ.get('MQTT_TAP_PATH')
+        mqtt_tap = CaptureWriter(tap_path) if tap_path else None
+        if mqtt_tap:
+            logging.info(f"Recording MQTT traffic to {tap_path}")
+
         mqtt_client = MQTTClient(
             on_message_callback=on_message_callback,
-            topics=[main_topic, test_topic]
+            topics=topics,
+            pipeline=ingest_pipeline,
+            codecs=payload_codecs,
+            tap=mqtt_tap
         )
-        logging.info("MQTT Client initialized for topics: " + str([main_topic, test_topic]))
+        # Batches lost without a spool are redelivered instead of filling the broker's in-flight window
+        ingest_writer.on_flush_failure = mqtt_client.request_redelivery
+        logging.info("MQTT Client initialized for topics: " + str(mqtt_client.subscribed_topics())
+                     + (f" in shared group '{mqtt_client.shared_group}'" if mqtt_client.shared_group else "")
+                     + f" with {mqtt_client.delivery} delivery")
     except Exception as e:
         logging.error(f"Failed to initialize MQTT client: {e}", exc_info=True)
+        ingest_pipeline = None
         mqtt_client = None
 else:
+    ingest_pipeline = None
     mqtt_client = None
-    logging.warning("MQTT client not initialized because database is unavailable.")
+    if ingest_enabled:
+        logging.warning("MQTT client not initialized because database and spool are unavailable.")
+    else:
+        logging.info("MQTT ingest disabled for this worker (MQTT_INGEST=false).")
 
 
 # --- API Routes --------------------------------------------------------
-if db:
-    api_blueprint = setup_routes(db)
-    app.register_blueprint(api_blueprint)
-    logging.info("API routes registered.")
-else:
-    logging.warning("API routes not registered because database is unavailable.")
+# Registered even without MySQL: routes answer "Database not available" until it can be reached
+api_blueprint = setup_routes(db, store=recent_readings, resolve_db=current_database)
+app.register_blueprint(api_blueprint)
+logging.info("API routes registered.")
+if not db:
+    logging.warning("Database is unavailable; API routes will connect once MySQL is reachable.")
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Expose ingest pipeline statistics for tuning."""
+    return jsonify({
+        'ingest_pipeline': ingest_pipeline.stats() if ingest_pipeline else None,
+        'ingest_writer': ingest_writer.stats() if ingest_writer else None,
+        'spool': spool.stats() if spool else None,
+        'end_to_end_latency_ms': end_to_end_latency.snapshot(),
+        'broadcaster': broadcaster.stats(),
+        'socket_clients': broadcaster.client_stats(),
+        'recent_readings': recent_readings.stats(),
+        'reading_relay': reading_relay.stats(),
+        'db_executor': db_executor.stats() if db_executor else None,
+    })
+
+
+# --- Shutdown ----------------------------------------------------------
+_shut_down = threading.Event()
+
+def shutdown():
+    """Stop ingesting and write out everything already received.
+
+    MQTT delivery stops first, then the pipeline drains its queue into the
+    writer, and only then is the writer's last batch flushed. Safe to call
+    more than once (SIGTERM handler and atexit).
+    """
+    if _shut_down.is_set():
+        return
+    _shut_down.set()
+    steps = [
+        ('MQTT client', mqtt_client and mqtt_client.stop),
+        ('ingest pipeline', ingest_pipeline and ingest_pipeline.stop),
+        ('spool replayer', spool_replayer and spool_replayer.stop),
+        ('batch writer', ingest_writer and ingest_writer.close),
+        ('MQTT tap', mqtt_tap and mqtt_tap.close),
+        ('reading relay', reading_relay.stop),
+    ]
+    for name, step in steps:
+        if not step:
+            continue
+        try:
+            step()
+        except Exception as e:
+            logging.error(f"Failed to stop {name}: {e}", exc_info=True)
+
+atexit.register(shutdown)
+
+def handle_sigterm(signum, frame):
+    """``docker stop`` sends SIGTERM to PID 1, which by default dies without running atexit."""
+    logging.info("SIGTERM received, shutting down.")
+    shutdown()
+    logging.shutdown()
+    # The server loop and its threads are not unwound; everything worth keeping was flushed above
+    os._exit(0)
 
 
 # --- Main Execution ----------------------------------------------------
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    if ingest_writer:
+        ingest_writer.start()
+
+    if spool_replayer:
+        spool_replayer.start()
+
+    if ingest_pipeline:
+        ingest_pipeline.start()
+
+    broadcaster.start()
+    reading_relay.start(socketio.start_background_task)
+
     if mqtt_client:
         # Start MQTT client in a background thread
         mqtt_client.start()
@@ -1,51 +1,176 @@
-from flask import Blueprint, jsonify, request
-from decimal import Decimal
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+import base64
+import binascii
 import datetime
+import json
+import time
 
-# Helper to serialize Decimal and Datetime objects
-def json_serializer(obj):
-    if isinstance(obj, (datetime.datetime, datetime.date)):
-        return obj.isoformat()
-    if isinstance(obj, Decimal):
-        return float(obj)
-    # Let jsonify handle other basic types like int, str, float, bool
-    if isinstance(obj, (int, float, str, type(None))):
-        return obj
-    raise TypeError(f"Type {type(obj)} not serializable")
-
-def setup_routes(db):
-    """Creates and configures the Flask Blueprint for the API."""
+from modules.database import EXPORT_COLUMNS, TIME_RANGES, TREND_FIELDS, parse_timestamp
+from modules.downsample import MIN_POINTS, downsample_rows
+from modules.encoder import as_tuples, columns, json_response, row_objects
+from modules.export import FORMATS as EXPORT_FORMATS, check_format as check_export_format, export_chunks
+from modules.rollups import TREND_BUCKETS
+
+def encode_cursor(row: tuple) -> str:
+    """Opaque power_data page cursor pointing after ``row`` (in ``POWER_DATA_FIELDS`` order)."""
+    row_id, timestamp, device_code = row[:3]
+    key = [timestamp.isoformat(), row_id, device_code]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    """``(timestamp, id, device_code)`` of an ``encode_cursor`` value; ValueError if malformed."""
+    try:
+        timestamp, row_id, device_code = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if row_id is not None and not isinstance(row_id, int):
+            raise ValueError(cursor)
+        return datetime.datetime.fromisoformat(timestamp), row_id, device_code
+    except (TypeError, binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(cursor) from e
+
+# Response shapes of the power_data and trend endpoints: a list of row objects or one array per field
+RESPONSE_FORMATS = ('rows', 'columnar')
+# Fields of a power_data row, in order
+POWER_DATA_FIELDS = EXPORT_COLUMNS
+# Positions of the downsampling axes in a power_data row
+_TIMESTAMP = POWER_DATA_FIELDS.index('timestamp')
+_ELECTRIC = POWER_DATA_FIELDS.index('electric')
+# Period after which aggregates over windows ending now are recomputed even without new readings
+ROLLING_VERSION_SECONDS = 60
+# Largest power_data limit accepted when the rows are downsampled
+MAX_DOWNSAMPLED_ROWS = 10000
+
+def setup_routes(db, store=None, resolve_db=None):
+    """Creates and configures the Flask Blueprint for the API.
+
+    ``store`` (a ``RecentReadings``) answers recent-data requests from memory when it holds enough rows.
+    ``resolve_db`` is called per request instead of using ``db``, for workers that start while
+    MySQL is down and connect later; it returns the current Database or None.
+    """
     # Flask Blueprint를 생성합니다. 
     # 'api'라는 이름으로 Blueprint를 만들고 모든 라우트에 '/api' 접두사를 추가합니다.
     # 예: '/api/power_data', '/api/summary' 등의 엔드포인트가 생성됩니다.
     api_blueprint = Blueprint('api', __name__, url_prefix='/api')
 
+    def _db():
+        return resolve_db() if resolve_db is not None else db
+
+    def _max_points_arg():
+        # (max_points or None, error response or None)
+        if not request.args.get('max_points'):
+            return None, None
+        try:
+            max_points = int(request.args['max_points'])
+        except ValueError:
+            max_points = 0
+        if max_points < MIN_POINTS:
+            return None, (jsonify({"error": f"max_points must be an integer >= {MIN_POINTS}"}), 400)
+        return max_points, None
+
+    def _conditional(version, rolling: bool, build):
+        """Answer a conditional GET with 304 when the client's copy is current, else ``build()``.
+
+        ``version`` is ``(token, last change)`` from the database; anything else
+        (None when the version query failed) skips validation. Aggregates over windows ending now also change as readings
+        age out, so for ``rolling`` ones the token moves every
+        ``ROLLING_VERSION_SECONDS`` as well.
+        """
+        try:
+            token, changed = version
+        except (TypeError, ValueError):
+            return build()
+        if token is None:
+            return build()
+        if not isinstance(changed, datetime.datetime):
+            changed = None
+        if rolling:
+            slot = int(time.time()) // ROLLING_VERSION_SECONDS
+            token = f"{token}.{slot}"
+            slot_start = datetime.datetime.utcfromtimestamp(slot * ROLLING_VERSION_SECONDS)
+            changed = max(changed, slot_start) if changed else slot_start
+        etag = str(token)
+        last_modified = changed.replace(microsecond=0, tzinfo=datetime.timezone.utc) if changed else None
+
+        if request.if_none_match:
+            current = request.if_none_match.contains(etag)
+        else:
+            current = bool(request.if_modified_since and last_modified
+                           and last_modified <= request.if_modified_since)
+        response = Response(status=304) if current else build()
+        if isinstance(response, Response) and response.status_code in (200, 304):
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            # Cache, but revalidate on every use
+            response.cache_control.no_cache = True
+        return response
+
+    def _format_arg():
+        # (format, error response or None)
+        fmt = request.args.get('format', 'rows')
+        if fmt not in RESPONSE_FORMATS:
+            return fmt, (jsonify({"error": "Invalid format", "valid_formats": list(RESPONSE_FORMATS)}), 400)
+        return fmt, None
+
     @api_blueprint.route('/power_data', methods=['GET'])
     def get_power_data():
         """
-        Fetches power data from the database.
-        Accepts a 'limit' query parameter.
+        Fetches power data from the database, newest first.
+        Accepts a 'limit' query parameter and an optional 'max_points', which
+        downsamples the rows (by electric) for charts and allows larger limits.
+        'device_code', 'start' and 'end' (ISO 8601) filter the rows; a full page
+        sets the X-Next-Cursor header, passed back as 'cursor' for the next page.
+        'format=columnar' returns one array per field instead of a list of rows.
         """
+        db = _db()
+        max_points, error = _max_points_arg()
+        if error:
+            return error
+        fmt, error = _format_arg()
+        if error:
+            return error
+        filters = {}
+        try:
+            if request.args.get('device_code'):
+                filters['device_code'] = request.args['device_code']
+            for name in ('start', 'end'):
+                if request.args.get(name):
+                    filters[name] = parse_timestamp(request.args[name])
+            if request.args.get('cursor'):
+                filters['before'] = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return jsonify({"error": "Invalid start, end or cursor"}), 400
+        max_limit = MAX_DOWNSAMPLED_ROWS if max_points else 1000
         try:
             limit = int(request.args.get('limit', 100))
-            if limit <= 0 or limit > 1000:
+            if limit <= 0 or limit > max_limit:
                 limit = 100
         except (ValueError, TypeError):
             limit = 100
 
-        data = db.fetch_power_data(limit=limit)
+        # The recent readings store already holds what MySQL would return for the newest page
+        if not filters and store is not None and store.covers(limit):
+            data = store.latest(limit)
+        elif not db:
+            return jsonify({"error": "Database not available"}), 500
+        else:
+            data = db.fetch_power_data(limit=limit, raw=True, **filters)
+        data = as_tuples(data, POWER_DATA_FIELDS)
+        next_cursor = encode_cursor(data[-1]) if len(data) == limit else None
+        if max_points:
+            data = downsample_rows(data, max_points, x_key=_TIMESTAMP, y_key=_ELECTRIC)
         
-        # Manually serialize to handle Decimal and Datetime
-        serialized_data = []
-        for row in data:
-            serialized_row = {k: json_serializer(v) for k, v in row.items()}
-            serialized_data.append(serialized_row)
-
-        return jsonify(serialized_data)
+        if fmt == 'columnar':
+            response = json_response(columns(POWER_DATA_FIELDS, data))
+        else:
+            response = json_response(row_objects(POWER_DATA_FIELDS, data))
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
 
     @api_blueprint.route('/summary', methods=['GET'])
     def get_summary():
         """Get summary statistics for the specified time range."""
+        db = _db()
         time_range = request.args.get('timeRange', '24h')
         
         # 유효한 시간 범위인지 확인
@@ -56,70 +181,144 @@ def setup_routes(db):
                 "valid_ranges": valid_ranges
             }), 400
         
-        try:
-            if not db:
-                return jsonify({"error": "Database not available"}), 500
+        if not db:
+            return jsonify({"error": "Database not available"}), 500
+
+        def build():
+            try:
+                summary_data = db.get_summary_data(time_range)
                 
-            summary_data = db.get_summary_data(time_range)
-            
-            # 데이터 직렬화 (이미 database.py에서 처리했지만 안전을 위해)
-            serialized_data = {k: json_serializer(v) for k, v in summary_data.items()}
-            
-            return jsonify(serialized_data)
-            
-        except Exception as e:
-            return jsonify({
-                "error": "Failed to fetch summary data",
-                "details": str(e)
-            }), 500
+                return json_response(summary_data)
+                
+            except Exception as e:
+                return jsonify({
+                    "error": "Failed to fetch summary data",
+                    "details": str(e)
+                }), 500
+
+        return _conditional(db.get_data_version(), True, build)
 
     @api_blueprint.route('/trend', methods=['GET'])
     def get_trend():
-        """Get hourly trend data for the specified time range."""
+        """Get bucketed trend data.
+
+        Either ``timeRange`` (ending now) or ``start``/``end`` (ISO 8601, ``end`` defaults
+        to now) selects the range; ``bucket`` is one of 1m, 5m, 15m, 1h (default) or 1d
+        and ``device_code`` narrows it to one device. ``max_points`` downsamples the
+        buckets (by average electric). 'format=columnar' returns ``data`` as one
+        array per field.
+        """
+        db = _db()
+        max_points, error = _max_points_arg()
+        if error:
+            return error
+        fmt, error = _format_arg()
+        if error:
+            return error
         time_range = request.args.get('timeRange', '24h')
+        bucket = request.args.get('bucket', '1h')
+        device_code = request.args.get('device_code') or None
         
-        # 유효한 시간 범위인지 확인
-        valid_ranges = ['24h', '7d', '30d']
-        if time_range not in valid_ranges:
+        if bucket not in TREND_BUCKETS:
             return jsonify({
-                "error": "Invalid time range for trend data", 
-                "valid_ranges": valid_ranges
+                "error": "Invalid bucket",
+                "valid_buckets": list(TREND_BUCKETS)
             }), 400
         
         try:
-            if not db:
-                return jsonify({"error": "Database not available"}), 500
-                
-            trend_data = db.get_hourly_trend(time_range)
-            
-            # 데이터 직렬화
-            serialized_data = []
-            for row in trend_data:
-                serialized_row = {k: json_serializer(v) for k, v in row.items()}
-                serialized_data.append(serialized_row)
-            
-            return jsonify({
-                "time_range": time_range,
-                "data": serialized_data,
-                "total_hours": len(serialized_data)
-            })
-            
+            end = parse_timestamp(request.args['end']) if request.args.get('end') else datetime.datetime.utcnow()
+            if request.args.get('start'):
+                start = parse_timestamp(request.args['start'])
+                time_range = None
+            elif time_range in TIME_RANGES:
+                start = end - TIME_RANGES[time_range]
+            else:
+                # 유효한 시간 범위인지 확인
+                return jsonify({
+                    "error": "Invalid time range for trend data", 
+                    "valid_ranges": list(TIME_RANGES)
+                }), 400
+        except ValueError:
+            return jsonify({"error": "start and end must be ISO 8601 timestamps"}), 400
+        
+        if not db:
+            return jsonify({"error": "Database not available"}), 500
+        # Only a timeRange ending now drops old readings as it moves; other windows change with new rows
+        rolling = not request.args.get('start') and not request.args.get('end')
+        return _conditional(db.get_data_version(), rolling,
+                            lambda: _trend_response(db, start, end, bucket, device_code, time_range, max_points, fmt))
+
+    def _trend_response(db, start, end, bucket, device_code, time_range, max_points, fmt):
+        try:
+            trend_data = db.get_trend(start, end, bucket, device_code=device_code)
+            if max_points:
+                trend_data = downsample_rows(trend_data, max_points, y_key='electric_avg')
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({
                 "error": "Failed to fetch trend data",
                 "details": str(e)
             }), 500
+            
+        # 데이터 직렬화
+        if fmt == 'columnar':
+            serialized_data = columns(TREND_FIELDS, as_tuples(trend_data, TREND_FIELDS))
+        else:
+            serialized_data = trend_data
+        
+        return json_response({
+            "time_range": time_range,
+            "start": start,
+            "end": end,
+            "bucket": bucket,
+            "device_code": device_code,
+            "data": serialized_data,
+            "total_hours": len(trend_data)
+        })
+
+    @api_blueprint.route('/export', methods=['GET'])
+    def export_readings():
+        """Stream readings as NDJSON (default), CSV or Parquet, oldest first.
+
+        'device_code' and 'start'/'end' (ISO 8601) select the rows; they are
+        read and encoded chunk by chunk, so memory use does not grow with the range.
+        """
+        db = _db()
+        fmt = request.args.get('format', 'ndjson')
+        filters = {}
+        try:
+            check_export_format(fmt)
+            if request.args.get('device_code'):
+                filters['device_code'] = request.args['device_code']
+            for name in ('start', 'end'):
+                if request.args.get(name):
+                    filters[name] = parse_timestamp(request.args[name])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not db:
+            return jsonify({"error": "Database not available"}), 500
+
+        body = export_chunks(fmt, db.iter_readings(**filters))
+        filename = f"power_readings_{datetime.datetime.utcnow():%Y%m%dT%H%M%SZ}.{fmt}"
+        return Response(stream_with_context(body), mimetype=EXPORT_FORMATS[fmt], headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            # Let nginx pass chunks through instead of buffering the whole export
+            'X-Accel-Buffering': 'no',
+        })
 
     @api_blueprint.route('/esg_reports', methods=['GET'])
     def list_esg_reports():
         """Returns list of available ESG reports."""
-        data = db.fetch_esg_reports() if db else []
-        serialized = [{k: json_serializer(v) for k, v in row.items()} for row in data]
-        return jsonify(serialized)
+        db = _db()
+        if not db:
+            return json_response([])
+        return _conditional(db.get_report_version(), False, lambda: json_response(db.fetch_esg_reports()))
 
     @api_blueprint.route('/generate_esg_report', methods=['POST'])
     def generate_esg():
         """Generates a dummy ESG report and returns its info."""
+        db = _db()
         if not db:
             return jsonify({"message": "Database not available"}), 500
         report_id, url = db.create_esg_report()
@@ -0,0 +1,474 @@
+import threading
+import time
+import logging
+from collections import Counter
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Union
+
+from modules.metrics import RollingStats
+from modules.socket_format import FORMATS, check_format, encode_batch, encode_event
+
+# Overview pages follow every device through this room
+ALL_DEVICES = 'devices:all'
+
+
+def device_room(device_code) -> str:
+    return f'device:{device_code}'
+
+
+def delivery_room(room: str, batch: bool, fmt: str = 'json') -> str:
+    """Room a client actually joins: each delivery mode and format gets its own copy of a room.
+
+    Clients that did not opt into batches keep receiving one 'reading' event per
+    reading in ``room``; clients that connected with auth {"batch": true}
+    receive coalesced 'readings_batch' frames in ``room#batch``. Clients that
+    asked for auth {"format": "msgpack"} get binary frames in ``...#msgpack``.
+    """
+    if batch:
+        room += '#batch'
+    if fmt != 'json':
+        room += f'#{fmt}'
+    return room
+
+
+def parse_device_groups(value: str) -> Dict[str, Set[str]]:
+    """Parse ``group=code|code,...`` pairs, e.g. ``floor1=dev-1|dev-2,floor2=dev-3``."""
+    groups = {}
+    for pair in filter(None, (p.strip() for p in (value or '').split(','))):
+        name, _, codes = pair.partition('=')
+        groups[name.strip()] = {c.strip() for c in codes.split('|') if c.strip()}
+    return groups
+
+
+# What a client's outbound buffer does with readings while the client is behind
+CLIENT_POLICIES = ('conflate', 'drop')
+
+
+def transport_backlog(socketio, sid: str) -> int:
+    """Packets queued on the Engine.IO transport of client ``sid`` and not yet written to it."""
+    try:
+        server = socketio.server
+        return server.eio._get_socket(server.manager.eio_sid_from_sid(sid, '/')).queue.qsize()
+    except Exception:
+        # Gone or not connected to this worker
+        return 0
+
+
+class ClientChannel:
+    """Bounded outbound buffer of one client, with flow control.
+
+    Batch clients acknowledge frames: a frame counts as in flight until the
+    client acknowledges it, and while ``max_inflight`` frames are
+    unacknowledged the client is behind. Per-reading clients (``batch=False``)
+    send no acks; they are behind while their transport still holds packets
+    from earlier flushes (``backlog``). Readings for a client that is behind
+    wait in the buffer, and with the ``conflate`` policy only the newest
+    reading per device is kept. Either way the buffer holds at most
+    ``maxsize`` readings and the oldest are dropped beyond that.
+    """
+
+    def __init__(self, sid: str, fmt: str = 'json', maxsize: int = 1000, policy: str = 'conflate',
+                 max_inflight: int = 1, batch: bool = True):
+        if policy not in CLIENT_POLICIES:
+            raise ValueError(f"Unknown client policy '{policy}', expected one of {list(CLIENT_POLICIES)}")
+        self.sid = sid
+        self.format = fmt
+        self.batch = batch
+        self.devices = None
+        # Transport packets still queued for a per-reading client, set before each take()
+        self.backlog = 0
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_inflight = max_inflight
+        self._pending = []
+        self._oldest = None
+        self._inflight = {}
+        self._next_frame = 0
+        self._lock = threading.Lock()
+
+        self.sent = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.ack_timeouts = 0
+        self.ack_latency = RollingStats(window=256)
+
+    @property
+    def behind(self) -> bool:
+        return len(self._inflight) >= self.max_inflight or self.backlog > 0
+
+    def push(self, events: List[dict]):
+        if not events:
+            return
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._pending.extend(events)
+            if self.behind and self.policy == 'conflate':
+                latest = {}
+                for event in self._pending:
+                    # A device keeps its first position in the buffer but with its newest reading
+                    latest[event.get('device_code')] = event
+                self.conflated += len(self._pending) - len(latest)
+                self._pending = list(latest.values())
+            overflow = len(self._pending) - self.maxsize
+            if overflow > 0:
+                del self._pending[:overflow]
+                self.dropped += overflow
+
+    def take(self) -> Tuple[Union[int, None], List[dict]]:
+        """Pending readings for the next frame and its id, or ``(None, [])`` while behind or idle.
+
+        Frames of per-reading clients are not acknowledged and have no id.
+        """
+        with self._lock:
+            if not self._pending or self.behind:
+                return None, []
+            events, self._pending, self._oldest = self._pending, [], None
+            self.sent += len(events)
+            if not self.batch:
+                return None, events
+            frame_id = self._next_frame
+            self._next_frame += 1
+            self._inflight[frame_id] = time.monotonic()
+            return frame_id, events
+
+    def acked(self, frame_id: int, *args):
+        with self._lock:
+            sent_at = self._inflight.pop(frame_id, None)
+        if sent_at is not None:
+            self.ack_latency.add((time.monotonic() - sent_at) * 1000)
+
+    def expire(self, timeout: float):
+        """Forget frames unacknowledged for ``timeout`` seconds so a lost ack cannot stall the client."""
+        deadline = time.monotonic() - timeout
+        with self._lock:
+            expired = [frame_id for frame_id, sent_at in self._inflight.items() if sent_at < deadline]
+            for frame_id in expired:
+                del self._inflight[frame_id]
+            self.ack_timeouts += len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending, oldest, inflight = len(self._pending), self._oldest, len(self._inflight)
+        return {
+            'mode': 'batch' if self.batch else 'reading',
+            'format': self.format,
+            'pending': pending,
+            'backlog': self.backlog,
+            'lag_ms': (time.monotonic() - oldest) * 1000 if oldest is not None else 0.0,
+            'inflight': inflight,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'conflated': self.conflated,
+            'ack_timeouts': self.ack_timeouts,
+            'ack_ms': self.ack_latency.snapshot(),
+        }
+
+
+class CoalescingBroadcaster:
+    """Fans live readings out to Socket.IO clients from its own background task.
+
+    ``publish()`` is called from the ingest workers and only appends to an
+    inbox, so a slow client can never hold up ingestion. Every ``window``
+    seconds the background task drains the inbox:
+
+    - each client gets the readings it follows through its own bounded
+      ``ClientChannel``: batch clients as one 'readings_batch' frame
+      ``{"count", "readings"}``, sent only once the client acknowledged the
+      previous frame; per-reading clients as one 'reading' event per
+      reading, held back while ``backlog(sid)`` (see ``transport_backlog``)
+      reports packets still queued on their transport;
+    - without ``subscriptions`` clients are unknown, and every reading is
+      emitted to its rooms instead.
+
+    Events and batch frames with the same content and format are encoded
+    once however many clients receive them.
+
+    Every worker runs its own broadcaster for the clients connected to it, so
+    emits skip the Socket.IO message queue (``ignore_queue``).
+    """
+
+    def __init__(self, socketio, window: float = 0.25, subscriptions=None, client_queue_size: int = 1000,
+                 client_policy: str = 'conflate', max_inflight: int = 1, ack_timeout: float = 10.0,
+                 backlog: Union[Callable[[str], int], None] = None):
+        if client_policy not in CLIENT_POLICIES:
+            raise ValueError(f"Unknown client policy '{client_policy}', expected one of {list(CLIENT_POLICIES)}")
+        self.socketio = socketio
+        self.window = window
+        self.subscriptions = subscriptions
+        self.client_queue_size = client_queue_size
+        self.client_policy = client_policy
+        self.max_inflight = max_inflight
+        self.ack_timeout = ack_timeout
+        self.backlog = backlog
+        self.channels: Dict[str, ClientChannel] = {}
+        self._inbox = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._running = False
+
+        self.batch_sizes = RollingStats()
+        self.emit_latency = RollingStats()
+        self.coalesce_delay = RollingStats()
+        self.frames = 0
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.socketio.start_background_task(self._run)
+        logging.info(f"Coalescing broadcaster started ({self.window * 1000:.0f} ms window, "
+                     f"{self.client_policy} policy for slow clients).")
+
+    def stop(self):
+        self._running = False
+
+    def publish(self, event: dict, rooms: Iterable[str] = (ALL_DEVICES,)):
+        """Queue ``event`` for the clients of ``rooms``; it is sent by the next ``flush()``."""
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._inbox.append((event, tuple(rooms)))
+
+    def flush(self) -> int:
+        """Deliver everything published since the last flush. Returns batch frames sent."""
+        with self._lock:
+            inbox, self._inbox = self._inbox, []
+            oldest, self._oldest = self._oldest, None
+        if oldest is not None:
+            self.coalesce_delay.add((time.monotonic() - oldest) * 1000)
+
+        if self.subscriptions is None:
+            for event, rooms in inbox:
+                self._emit_to_rooms(event, rooms)
+
+        self._sync_channels()
+        events = [event for event, _ in inbox]
+        encoded = {}
+        sent = 0
+        for channel in list(self.channels.values()):
+            devices = channel.devices
+            channel.push(events if devices is None else [e for e in events if str(e.get('device_code')) in devices])
+            if not channel.batch:
+                channel.backlog = self.backlog(channel.sid) if self.backlog is not None else 0
+                self._emit_single(channel, encoded)
+                continue
+            channel.expire(self.ack_timeout)
+            frame_id, frame = channel.take()
+            if not frame:
+                continue
+            key = (channel.format, tuple(map(id, frame)))
+            started = time.monotonic()
+            try:
+                if key not in encoded:
+                    encoded[key] = encode_batch(frame, channel.format)
+                self.socketio.emit('readings_batch', encoded[key], room=channel.sid,
+                                   callback=partial(channel.acked, frame_id), ignore_queue=True)
+            except Exception as e:
+                logging.error(f"SocketIO batch emit failed for client {channel.sid}: {e}")
+                channel.acked(frame_id)
+                continue
+            self.emit_latency.add((time.monotonic() - started) * 1000)
+            self.batch_sizes.add(len(frame))
+            sent += 1
+        self.frames += sent
+        return sent
+
+    def stats(self) -> dict:
+        """Batch sizes, emit latency (including encoding), coalescing delay (ms) and slow-client counters."""
+        channels = list(self.channels.values())
+        return {
+            'window_ms': self.window * 1000,
+            'frames': self.frames,
+            'batch_size': self.batch_sizes.snapshot(),
+            'emit_ms': self.emit_latency.snapshot(),
+            'coalesce_delay_ms': self.coalesce_delay.snapshot(),
+            'client_policy': self.client_policy,
+            'clients_behind': sum(1 for c in channels if c.behind),
+            'dropped': sum(c.dropped for c in channels),
+            'conflated': sum(c.conflated for c in channels),
+        }
+
+    def client_stats(self) -> Dict[str, dict]:
+        """Per-client lag, in-flight frames and drop counters, keyed by Socket.IO sid."""
+        return {sid: channel.stats() for sid, channel in list(self.channels.items())}
+
+    def _emit_single(self, channel: ClientChannel, encoded: dict):
+        _, events = channel.take()
+        for event in events:
+            key = (channel.format, id(event))
+            try:
+                if key not in encoded:
+                    # Encoded once per format, whatever the number of clients
+                    encoded[key] = encode_event(event, channel.format)
+                self.socketio.emit('reading', encoded[key], room=channel.sid, ignore_queue=True)
+            except Exception as e:
+                logging.error(f"SocketIO emit failed for client {channel.sid}: {e}")
+
+    def _emit_to_rooms(self, event: dict, rooms: Tuple[str, ...]):
+        encoded = {}
+        for room in rooms:
+            for fmt in FORMATS:
+                target = delivery_room(room, False, fmt)
+                if not self._active(target):
+                    continue
+                try:
+                    if fmt not in encoded:
+                        # Encoded once per format, whatever the number of rooms
+                        encoded[fmt] = encode_event(event, fmt)
+                    self.socketio.emit('reading', encoded[fmt], room=target, ignore_queue=True)
+                except Exception as e:
+                    logging.error(f"SocketIO emit failed for room {target}: {e}")
+
+    def _sync_channels(self):
+        if self.subscriptions is None:
+            return
+        clients = self.subscriptions.clients()
+        for sid in set(self.channels) - set(clients):
+            del self.channels[sid]
+        for sid, (batch, fmt, devices) in clients.items():
+            channel = self.channels.get(sid)
+            if channel is None or channel.batch != batch or channel.format != fmt:
+                channel = self.channels[sid] = ClientChannel(sid, fmt, self.client_queue_size,
+                                                             self.client_policy, self.max_inflight, batch)
+            channel.devices = devices
+
+    def _active(self, room: str) -> bool:
+        return self.subscriptions is None or self.subscriptions.has_members(room)
+
+    def _run(self):
+        while self._running:
+            self.socketio.sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Broadcaster flush failed: {e}", exc_info=True)
+
+
+class Subscriptions:
+    """Tracks which devices each Socket.IO client follows and the rooms that implies.
+
+    A client follows every device (``ALL_DEVICES``) or a set of device codes
+    and groups. Groups are expanded to their device rooms, so a reading is
+    published to exactly two rooms (its device and ``ALL_DEVICES``) and a
+    client never receives the same reading twice. Methods return the rooms
+    to join and leave; the caller applies them with ``join_room``/``leave_room``.
+    """
+
+    def __init__(self, groups: Union[Dict[str, Set[str]], None] = None):
+        self.groups = groups or {}
+        self._clients = {}
+        self._members = Counter()
+        self._lock = threading.Lock()
+
+    def connect(self, sid: str, batch: bool = False, devices: Iterable = (),
+                groups: Iterable = (), fmt: str = 'json') -> List[str]:
+        """Register a client; without devices or groups it follows all devices."""
+        self._check_groups(groups)
+        state = {'batch': batch, 'format': check_format(fmt), 'all': not devices and not groups,
+                 'devices': set(map(str, devices)), 'groups': set(groups)}
+        rooms = self._rooms(state)
+        with self._lock:
+            previous = self._clients.get(sid)
+            if previous is not None:
+                self._members.subtract(self._rooms(previous))
+            self._clients[sid] = state
+            self._members.update(rooms)
+        return sorted(rooms)
+
+    def disconnect(self, sid: str):
+        with self._lock:
+            state = self._clients.pop(sid, None)
+            if state is not None:
+                self._members.subtract(self._rooms(state))
+
+    def has_members(self, room: str) -> bool:
+        return self._members[room] > 0
+
+    def devices_for(self, sid: str) -> Union[Set[str], None]:
+        """Device codes the client follows, or None when it follows all devices."""
+        with self._lock:
+            state = self._clients.get(sid)
+            if state is None or state['all']:
+                return None
+            return self._codes(state)
+
+    def clients(self) -> Dict[str, Tuple[bool, str, Union[Set[str], None]]]:
+        """``{sid: (batch, format, devices)}`` of every client; ``devices`` is None for all devices."""
+        with self._lock:
+            return {sid: (state['batch'], state['format'], None if state['all'] else self._codes(state))
+                    for sid, state in self._clients.items()}
+
+    def batch_clients(self) -> Dict[str, Tuple[str, Union[Set[str], None]]]:
+        """``{sid: (format, devices)}`` of clients that receive 'readings_batch' frames."""
+        return {sid: (fmt, devices) for sid, (batch, fmt, devices) in self.clients().items() if batch}
+
+    def format(self, sid: str) -> str:
+        """Wire format the client picked at connect time."""
+        state = self._clients.get(sid)
+        return state['format'] if state else 'json'
+
+    def subscribe(self, sid: str, devices: Iterable = (), groups: Iterable = (),
+                  all_devices: Union[bool, None] = None) -> Tuple[List[str], List[str]]:
+        """Follow more devices/groups. Naming devices or groups narrows an all-devices
+        subscription unless ``all_devices`` is true. Returns ``(join, leave)`` rooms."""
+        self._check_groups(groups)
+
+        def change(state):
+            state['devices'].update(map(str, devices))
+            state['groups'].update(groups)
+            if all_devices is not None:
+                state['all'] = all_devices
+            elif devices or groups:
+                state['all'] = False
+        return self._update(sid, change)
+
+    def unsubscribe(self, sid: str, devices: Iterable = (), groups: Iterable = (),
+                    all_devices: bool = False) -> Tuple[List[str], List[str]]:
+        """Stop following devices/groups (or all devices). Returns ``(join, leave)`` rooms."""
+
+        def change(state):
+            state['devices'].difference_update(map(str, devices))
+            state['groups'].difference_update(groups)
+            if all_devices:
+                state['all'] = False
+        return self._update(sid, change)
+
+    def describe(self, sid: str) -> dict:
+        with self._lock:
+            state = self._clients.get(sid)
+            if state is None:
+                return {}
+            return {'all': state['all'], 'devices': sorted(state['devices']), 'groups': sorted(state['groups'])}
+
+    def _update(self, sid, change) -> Tuple[List[str], List[str]]:
+        with self._lock:
+            state = self._clients.get(sid)
+            if state is None:
+                state = self._clients[sid] = {'batch': False, 'format': 'json', 'all': True,
+                                              'devices': set(), 'groups': set()}
+                self._members.update(self._rooms(state))
+            before = self._rooms(state)
+            change(state)
+            after = self._rooms(state)
+            self._members.subtract(before - after)
+            self._members.update(after - before)
+        return sorted(after - before), sorted(before - after)
+
+    def _codes(self, state) -> Set[str]:
+        codes = set(state['devices'])
+        for group in state['groups']:
+            codes.update(self.groups.get(group, ()))
+        return codes
+
+    def _rooms(self, state) -> Set[str]:
+        if state['all']:
+            rooms = {ALL_DEVICES}
+        else:
+            rooms = {device_room(code) for code in self._codes(state)}
+        return {delivery_room(room, state['batch'], state['format']) for room in rooms}
+
+    def _check_groups(self, groups: Iterable):
+        unknown = [g for g in groups if g not in self.groups]
+        if unknown:
+            raise ValueError(f"Unknown device group(s): {unknown}")
@@ -0,0 +1,154 @@
+import gzip
+import os
+import struct
+import threading
+import time
+import zlib
+import logging
+from typing import Callable, Iterator, Tuple, Union
+
+# arrival time (epoch seconds), topic length, payload length
+_RECORD_HEADER = struct.Struct('>dHI')
+# gzip framing for zlib.decompressobj
+_GZIP_WBITS = zlib.MAX_WBITS | 16
+
+
+def _pack(arrived_at: float, topic: str, payload: bytes) -> bytes:
+    topic_bytes = topic.encode('utf-8')
+    return _RECORD_HEADER.pack(arrived_at, len(topic_bytes), len(payload)) + topic_bytes + payload
+
+
+class CaptureWriter:
+    """Records raw MQTT messages (arrival time, topic, payload) to a gzip capture file.
+
+    Used by ``MQTTClient`` in tap mode. Compression level 1 keeps the cost on
+    the network thread low; records are appended, so several runs can share a file.
+    The gzip stream is sync-flushed at most every ``flush_interval`` seconds, so
+    an unclean exit loses only the records written since the last flush.
+    """
+
+    def __init__(self, path: str, compresslevel: int = 1, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        if os.path.exists(path):
+            _recover(path, compresslevel)
+        self._file = gzip.open(path, 'ab', compresslevel=compresslevel)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.records = 0
+
+    def record(self, topic: str, payload: Union[bytes, str], arrived_at: Union[float, None] = None):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        record = _pack(arrived_at if arrived_at is not None else time.time(), topic, payload)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(record)
+            self.records += 1
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                # Ends the deflate block on a byte boundary and writes it out; readable without the trailer
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+                self._last_flush = now
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                logging.info(f"Capture closed with {self.records} records: {self.path}")
+
+
+def _inflate(path: str, state: Union[dict, None] = None, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    # zlib instead of gzip.open: GzipFile raises on a missing trailer and drops
+    # what the failing read had already decompressed. ``state['complete']`` tells
+    # whether the last gzip member was properly ended.
+    state = state if state is not None else {}
+    state['complete'] = True
+    with open(path, 'rb') as f:
+        decompressor = zlib.decompressobj(_GZIP_WBITS)
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                return
+            state['complete'] = False
+            while data:
+                try:
+                    yield decompressor.decompress(data)
+                except zlib.error as e:
+                    logging.warning(f"Capture {path} is corrupt after this point, stopping: {e}")
+                    return
+                state['complete'] = decompressor.eof
+                data = b''
+                if decompressor.eof:
+                    # Each run appends its own gzip member
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(_GZIP_WBITS)
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, str, bytes]]:
+    """Yield ``(arrived_at, topic, payload)`` records from a capture file in order.
+
+    A capture cut short by an unclean exit ends at the last complete record
+    that reached the disk.
+    """
+    buffer = bytearray()
+    offset = 0
+    for data in _inflate(path):
+        buffer += data
+        while True:
+            if len(buffer) - offset < _RECORD_HEADER.size:
+                break
+            arrived_at, topic_len, payload_len = _RECORD_HEADER.unpack_from(buffer, offset)
+            end = offset + _RECORD_HEADER.size + topic_len + payload_len
+            if len(buffer) < end:
+                break
+            start = offset + _RECORD_HEADER.size
+            yield (arrived_at, bytes(buffer[start:start + topic_len]).decode('utf-8'),
+                   bytes(buffer[start + topic_len:end]))
+            offset = end
+        del buffer[:offset]
+        offset = 0
+
+
+def _recover(path: str, compresslevel: int = 1) -> None:
+    """Rewrite a capture left unterminated by an unclean exit so more runs can be appended.
+
+    A gzip member appended after a truncated one would be read as part of it.
+    """
+    state = {}
+    for _ in _inflate(path, state):
+        pass
+    if state['complete']:
+        return
+    recovered = path + '.recovering'
+    count = 0
+    with gzip.open(recovered, 'wb', compresslevel=compresslevel) as f:
+        for record in read_capture(path):
+            f.write(_pack(*record))
+            count += 1
+    os.replace(recovered, path)
+    logging.warning(f"Capture {path} was not closed cleanly; kept its {count} complete records")
+
+
+def replay(records, sink: Callable[[str, bytes], None], speed: Union[float, None] = 1.0,
+           sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic) -> int:
+    """Feed captured records to ``sink(topic, payload)`` preserving their timing.
+
+    ``speed`` scales the original inter-arrival gaps (2.0 replays twice as
+    fast); ``None`` replays as fast as the sink accepts. Returns the number of
+    records replayed.
+    """
+    count = 0
+    first_arrival = started = None
+    for arrived_at, topic, payload in records:
+        if speed:
+            if first_arrival is None:
+                first_arrival, started = arrived_at, clock()
+            delay = (arrived_at - first_arrival) / speed - (clock() - started)
+            if delay > 0:
+                sleep(delay)
+        sink(topic, payload)
+        count += 1
+    return count
@@ -0,0 +1,210 @@
+import datetime
+import json
+import math
+import struct
+from typing import Dict, List, Tuple, Union
+
+from modules.readings import Reading, reading_from_message, readings_from_batch
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed when a topic uses the msgpack codec
+    msgpack = None
+
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be decoded by its codec."""
+
+
+def from_epoch_ms(value: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+
+
+def to_epoch_ms(value: Union[str, datetime.datetime]) -> int:
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _sent_at(data) -> Union[int, None]:
+    """Publisher send time (epoch ms) embedded by load generators, if any."""
+    if isinstance(data, dict):
+        sent_at = data.get('sentAt')
+        if isinstance(sent_at, (int, float)):
+            return sent_at
+    return None
+
+
+def _wrap(messages: List[dict], batch: bool, sent_at: Union[int, None]):
+    if not batch:
+        message = messages[0]
+        if sent_at is not None:
+            message['sentAt'] = sent_at
+        return message
+    return messages if sent_at is None else {'sentAt': sent_at, 'readings': messages}
+
+
+def _to_message(reading: Reading, timestamp) -> dict:
+    return {
+        'deviceCode': reading.device_code,
+        'timestamp': timestamp,
+        'temp': reading.temperature,
+        'humidity': reading.humidity,
+        'brightness': reading.brightness,
+        'electric': reading.electric,
+    }
+
+
+class JsonCodec:
+    """The original format: one JSON object per message, or a batch envelope."""
+    name = 'json'
+
+    def decode(self, payload: Union[bytes, str], batch: bool = False) -> List[Reading]:
+        return self.decode_message(payload, batch)[0]
+
+    def decode_message(self, payload: Union[bytes, str], batch: bool = False) -> Tuple[List[Reading], Union[int, None]]:
+        """Return the readings and the optional ``sentAt`` epoch-ms send time."""
+        data = json.loads(payload)
+        if batch:
+            return readings_from_batch(data), _sent_at(data)
+        reading = reading_from_message(data)
+        return ([reading] if reading is not None else []), _sent_at(data)
+
+    def encode(self, readings: List[Reading], batch: bool = False, sent_at: Union[int, None] = None) -> bytes:
+        messages = [_to_message(r, r.timestamp if isinstance(r.timestamp, str) else r.timestamp.isoformat())
+                    for r in readings]
+        return json.dumps(_wrap(messages, batch, sent_at)).encode('utf-8')
+
+
+class MsgpackCodec:
+    """MessagePack maps with the JSON field names and epoch-millisecond timestamps.
+
+    A payload holding a single map is one reading; anything else is treated as
+    a batch envelope, so no separate batch topic is needed.
+    """
+    name = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("The msgpack codec requires the 'msgpack' package")
+
+    def decode(self, payload: bytes, batch: bool = False) -> List[Reading]:
+        return self.decode_message(payload, batch)[0]
+
+    def decode_message(self, payload: bytes, batch: bool = False) -> Tuple[List[Reading], Union[int, None]]:
+        """Return the readings and the optional ``sentAt`` epoch-ms send time."""
+        try:
+            data = msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise CodecError(f"Invalid MessagePack payload: {e}") from e
+
+        if not batch and isinstance(data, dict) and not isinstance(data.get('timestamp'), list) \
+                and 'readings' not in data:
+            reading = reading_from_message(data)
+            readings = [reading] if reading is not None else []
+        else:
+            readings = readings_from_batch(data)
+        readings = [r._replace(timestamp=from_epoch_ms(r.timestamp)) if isinstance(r.timestamp, int) else r
+                    for r in readings]
+        return readings, _sent_at(data)
+
+    def encode(self, readings: List[Reading], batch: bool = False, sent_at: Union[int, None] = None) -> bytes:
+        messages = [_to_message(r, to_epoch_ms(r.timestamp)) for r in readings]
+        return msgpack.packb(_wrap(messages, batch, sent_at))
+
+
+class StructCodec:
+    """Fixed 48-byte little-endian records; a payload is one or more records back to back.
+
+    Layout: device code (24 bytes, NUL padded ASCII), timestamp (int64 epoch ms),
+    temperature, humidity (float32), brightness (int32), electric (float32).
+    Missing floats are NaN and a missing brightness is INT32_MIN. Values are
+    float32, the same precision as the power_readings FLOAT columns. There is
+    no room for a send time, so ``sent_at`` is ignored.
+    """
+    name = 'struct'
+    RECORD = struct.Struct('<24sqffif')
+    MISSING_INT = -2 ** 31
+
+    def decode(self, payload: bytes, batch: bool = False) -> List[Reading]:
+        size = self.RECORD.size
+        if not payload or len(payload) % size:
+            raise CodecError(f"Struct payload length {len(payload)} is not a multiple of {size}")
+
+        readings = []
+        for device, timestamp, temperature, humidity, brightness, electric in self.RECORD.iter_unpack(payload):
+            readings.append(Reading(
+                device.rstrip(b'\0').decode('ascii'),
+                from_epoch_ms(timestamp),
+                None if math.isnan(temperature) else temperature,
+                None if math.isnan(humidity) else humidity,
+                None if brightness == self.MISSING_INT else brightness,
+                None if math.isnan(electric) else electric,
+            ))
+        return readings
+
+    def decode_message(self, payload: bytes, batch: bool = False) -> Tuple[List[Reading], None]:
+        return self.decode(payload, batch), None
+
+    def encode(self, readings: List[Reading], batch: bool = False, sent_at: Union[int, None] = None) -> bytes:
+        nan = float('nan')
+        readings = readings if batch else readings[:1]
+        for r in readings:
+            # struct.pack would silently truncate a longer code
+            if len(str(r.device_code)) > 24:
+                raise CodecError(f"Device code '{r.device_code}' does not fit the 24-byte struct field")
+        return b''.join(
+            self.RECORD.pack(
+                str(r.device_code).encode('ascii'),
+                to_epoch_ms(r.timestamp),
+                nan if r.temperature is None else r.temperature,
+                nan if r.humidity is None else r.humidity,
+                self.MISSING_INT if r.brightness is None else r.brightness,
+                nan if r.electric is None else r.electric,
+            )
+            for r in readings
+        )
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+    StructCodec.name: StructCodec,
+}
+
+
+class CodecRegistry:
+    """Maps MQTT topics to payload codecs; unmapped topics use JSON."""
+
+    def __init__(self, topics: Union[Dict[str, str], None] = None, default: str = 'json'):
+        self.default = CODECS[default]()
+        self.topic_codecs = {}
+        for topic, name in (topics or {}).items():
+            if name not in CODECS:
+                raise ValueError(f"Unknown payload codec '{name}' for topic '{topic}', expected one of {list(CODECS)}")
+            self.topic_codecs[topic] = CODECS[name]()
+
+    @classmethod
+    def from_env(cls, value: str) -> 'CodecRegistry':
+        """Build from ``topic=codec`` pairs separated by commas, e.g. ``power/bin=struct``."""
+        topics = {}
+        for pair in filter(None, (p.strip() for p in (value or '').split(','))):
+            topic, _, name = pair.partition('=')
+            topics[topic.strip()] = name.strip()
+        return cls(topics)
+
+    @property
+    def topics(self) -> List[str]:
+        return list(self.topic_codecs)
+
+    def codec_for(self, topic: Union[str, None]):
+        return self.topic_codecs.get(topic, self.default)
+
+    def decode(self, topic: Union[str, None], payload: Union[bytes, str], batch: bool = False) -> List[Reading]:
+        return self.codec_for(topic).decode(payload, batch)
+
+    def decode_message(self, topic: Union[str, None], payload: Union[bytes, str],
+                       batch: bool = False) -> Tuple[List[Reading], Union[int, None]]:
+        return self.codec_for(topic).decode_message(payload, batch)
@@ -2,14 +2,132 @@ import mysql.connector
 from mysql.connector import pooling
 import os
 import datetime
-from typing import Union
+import functools
+import threading
+import time
+from typing import Callable, Iterator, List, Tuple, Union
 import logging
 
+try:
+    from eventlet import patcher, tpool
+except ImportError:  # optional: without eventlet every query runs in the calling thread
+    patcher = tpool = None
+
+from modules.metrics import RollingStats
+from modules.rollups import (HOURLY_TABLE, DAILY_TABLE, RAW_AGGREGATES_SQL, TREND_BUCKETS, VALUE_COLUMNS_SQL,
+                             affected_buckets, from_epoch_seconds, merge_query, naive_utc, rebuild_daily_query,
+                             rebuild_hourly_query, rollup_deltas, trend_query)
+
+INSERT_READING_QUERY = (
+    "INSERT INTO power_readings (timestamp, device_code, temperature, humidity, brightness, electric) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+# Redelivered (device_code, timestamp) rows hit uq_device_timestamp and become a no-op
+INSERT_READING_IDEMPOTENT_QUERY = INSERT_READING_QUERY + " ON DUPLICATE KEY UPDATE id = id"
+
+# Named ranges accepted by the summary and trend endpoints, ending now
+TIME_RANGES = {
+    '1h': datetime.timedelta(hours=1),
+    '6h': datetime.timedelta(hours=6),
+    '24h': datetime.timedelta(hours=24),
+    '7d': datetime.timedelta(days=7),
+    '30d': datetime.timedelta(days=30),
+}
+# Columns of exported readings, in order
+EXPORT_COLUMNS = ('id', 'timestamp', 'device_code', 'temperature', 'humidity', 'brightness', 'electric')
+# Fields of a get_trend row, in order
+TREND_FIELDS = ('timestamp', 'readings_count', 'temperature', 'humidity', 'brightness', 'electric_avg',
+                'electric_total', 'electric_min', 'electric_max')
+# Upper bound on the buckets of one trend query
+MAX_TREND_BUCKETS = 10000
+
+
+def parse_timestamp(timestamp: Union[str, datetime.datetime]) -> datetime.datetime:
+    """Convert an ISO 8601 string (optionally 'Z'-suffixed) to a datetime."""
+    if isinstance(timestamp, str):
+        # Handle ISO format with 'Z' suffix (UTC timezone)
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1] + '+00:00'
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    return timestamp
+
+
+# MySQL errors caused by a value that cannot be stored (bad null, out of range,
+# wrong type, bad datetime, too long); retrying such rows unchanged cannot succeed
+DATA_ERRNOS = {1048, 1264, 1265, 1292, 1366, 1406}
+
+
+def is_data_error(err: BaseException) -> bool:
+    """True if ``err`` was caused by the rows being written rather than by the connection or server."""
+    if isinstance(err, (mysql.connector.DataError, mysql.connector.IntegrityError, TypeError, ValueError)):
+        return True
+    return isinstance(err, mysql.connector.Error) and err.errno in DATA_ERRNOS
+
+
+class BlockingExecutor:
+    """Runs blocking database calls without stalling the eventlet hub.
+
+    Under eventlet, Flask and Socket.IO handlers are green threads on the OS
+    thread that runs the hub, so a query made there freezes every WebSocket
+    until MySQL answers. Such calls are handed to eventlet's pool of ``size``
+    real threads (``tpool``) while the green thread waits cooperatively.
+    Calls from other OS threads (batch writer, ingest workers without monkey
+    patching) already run beside the hub and are made directly.
+
+    Create it on the thread that will run the hub. Keep ``size`` below the
+    MySQL connection pool size, which does not wait for a free connection.
+    """
+
+    def __init__(self, size: int = 4):
+        if tpool is None:
+            raise RuntimeError("BlockingExecutor requires the 'eventlet' package")
+        self.size = size
+        # Takes effect when tpool starts its threads, i.e. before the first offloaded call
+        tpool.set_num_threads(size)
+        self._get_ident = patcher.original('_thread').get_ident
+        self._hub_thread = self._get_ident()
+        self.offloaded = 0
+        self.direct = 0
+        self.latency = RollingStats()
+
+    def run(self, method: Callable, *args, **kwargs):
+        if self._get_ident() != self._hub_thread:
+            self.direct += 1
+            return method(*args, **kwargs)
+        self.offloaded += 1
+        started = time.monotonic()
+        try:
+            return tpool.execute(method, *args, **kwargs)
+        finally:
+            self.latency.add((time.monotonic() - started) * 1000)
+
+    def stats(self) -> dict:
+        """Offloaded and direct call counts and offloaded call latency (ms, including the wait for a thread)."""
+        return {
+            'threads': self.size,
+            'offloaded': self.offloaded,
+            'direct': self.direct,
+            'offloaded_ms': self.latency.snapshot(),
+        }
+
+
+def _blocking(method):
+    """Run a ``Database`` method through the instance's executor, if it has one."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.executor is None:
+            return method(self, *args, **kwargs)
+        return self.executor.run(method, self, *args, **kwargs)
+    return wrapper
+
+
 class Database:
     """MySQL database helper class.
 
     Uses a connection pool for efficient reuse across threads.
     Provides helper methods to insert and query power readings.
+    With an ``executor`` (``BlockingExecutor``) queries do not block the
+    eventlet hub.
     """
 
     def __init__(self,
@@ -18,7 +136,9 @@ class Database:
                  password: Union[str, None] = None,
                  database: Union[str, None] = None,
                  pool_name: str = "flask_app_pool",
-                 pool_size: int = 5):
+                 pool_size: int = 5,
+                 executor: Union[BlockingExecutor, None] = None):
+        self.executor = executor
         self.db_config = {
             "host": host or os.environ.get("MYSQL_HOST", "mysql"),
             "user": user or os.environ.get("MYSQL_USER", "power_user"),
@@ -44,6 +164,7 @@ class Database:
         return self.cnx_pool.get_connection()
 
     # --- CRUD Methods -----------------------------------------------------
+    @_blocking
     def insert_reading(
         self,
         device_code: str,
@@ -52,45 +173,244 @@ class Database:
         humidity: Union[float, None] = None,
         brightness: Union[int, None] = None,
         electric: Union[float, None] = None,
+        ignore_duplicates: bool = False,
     ) -> None:
-        """Insert a power reading row into the database."""
-        if isinstance(timestamp, str):
-            # Handle ISO format with 'Z' suffix (UTC timezone)
-            if timestamp.endswith('Z'):
-                timestamp = timestamp[:-1] + '+00:00'
-            timestamp = datetime.datetime.fromisoformat(timestamp)
+        """Insert a power reading row into the database.
 
-        query = (
-            "INSERT INTO power_readings (timestamp, device_code, temperature, humidity, brightness, electric) "
-            "VALUES (%s, %s, %s, %s, %s, %s)"
-        )
+        With ``ignore_duplicates`` a row whose (device_code, timestamp) already
+        exists is skipped instead of raising, so redelivered messages are harmless.
+        """
+        timestamp = naive_utc(parse_timestamp(timestamp))
         params = (timestamp, device_code, temperature, humidity, brightness, electric)
+        query = INSERT_READING_IDEMPOTENT_QUERY if ignore_duplicates else INSERT_READING_QUERY
 
         try:
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute(query, params)
+                    self._update_rollups(cursor, [params], cursor.rowcount)
                     conn.commit()
         except mysql.connector.Error as err:
             logging.error(f"Error inserting reading: {err}", exc_info=True)
             raise
 
-    def fetch_power_data(self, limit: int = 100):
-        """Fetch recent power data."""
+    @_blocking
+    def insert_readings(self, rows: List[Tuple], ignore_duplicates: bool = False) -> int:
+        """Insert many reading rows with a single multi-row INSERT and one commit.
+
+        Each row is ``(timestamp, device_code, temperature, humidity, brightness, electric)``
+        with ``timestamp`` already parsed; timestamps with an offset are stored as UTC.
+        Returns the number of rows written, which excludes skipped duplicates when
+        ``ignore_duplicates`` is set. The hourly and daily rollups are updated in the
+        same transaction.
+        """
+        if not rows:
+            return 0
+        rows = [(naive_utc(row[0]),) + tuple(row[1:]) for row in rows]
+        query = INSERT_READING_IDEMPOTENT_QUERY if ignore_duplicates else INSERT_READING_QUERY
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    # mysql.connector rewrites INSERT ... VALUES into one multi-row statement
+                    cursor.executemany(query, rows)
+                    written = cursor.rowcount
+                    self._update_rollups(cursor, rows, written)
+                    conn.commit()
+                    return written
+        except mysql.connector.Error as err:
+            logging.error(f"Error inserting {len(rows)} readings: {err}", exc_info=True)
+            raise
+
+    @staticmethod
+    def _update_rollups(cursor, rows: List[Tuple], written: int) -> None:
+        """Fold just-inserted reading ``rows`` into the hourly and daily rollups.
+
+        Buckets are keyed by reading time, so late and out-of-order rows land in
+        their own hour and day. When some rows were skipped as duplicates it is
+        not known which, so the buckets the batch touches are recomputed instead.
+        """
+        if written <= 0:
+            return
+        if written == len(rows):
+            hourly, daily = rollup_deltas(rows)
+            cursor.executemany(merge_query(HOURLY_TABLE), hourly)
+            cursor.executemany(merge_query(DAILY_TABLE), daily)
+            return
+        hours, days = affected_buckets(rows)
+        for start, device_code in sorted(hours):
+            cursor.execute(rebuild_hourly_query(by_device=True),
+                           (start, start + datetime.timedelta(hours=1), device_code))
+        for day, device_code in sorted(days):
+            start = datetime.datetime.combine(day, datetime.time())
+            cursor.execute(rebuild_daily_query(by_device=True),
+                           (start, start + datetime.timedelta(days=1), device_code))
+
+    @_blocking
+    def rebuild_rollups(self, start: datetime.datetime, end: datetime.datetime) -> Tuple[int, int]:
+        """Recompute the rollups of the whole days from ``start`` up to ``end`` from power_readings.
+
+        Used to backfill history. Returns the hourly and daily rows written.
+        """
+        start = datetime.datetime.combine(start.date(), datetime.time())
+        end = datetime.datetime.combine(end.date(), datetime.time())
+        if end < start + datetime.timedelta(days=1):
+            end = start + datetime.timedelta(days=1)
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(rebuild_hourly_query(), (start, end))
+                    hourly = cursor.rowcount
+                    cursor.execute(rebuild_daily_query(), (start, end))
+                    daily = cursor.rowcount
+                    conn.commit()
+                    return hourly, daily
+        except mysql.connector.Error as err:
+            logging.error(f"Error rebuilding rollups from {start} to {end}: {err}", exc_info=True)
+            raise
+
+    @_blocking
+    def fetch_reading_time_range(self) -> Tuple[Union[datetime.datetime, None], Union[datetime.datetime, None]]:
+        """Timestamps of the oldest and newest reading, or ``(None, None)`` when there are none."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM power_readings")
+                    return tuple(cursor.fetchone() or (None, None))
+        except mysql.connector.Error as err:
+            logging.error(f"Error fetching reading time range: {err}", exc_info=True)
+            raise
+
+    @_blocking
+    def fetch_power_data(self, limit: int = 100, device_code: Union[str, None] = None,
+                         start: Union[datetime.datetime, None] = None, end: Union[datetime.datetime, None] = None,
+                         before: Union[Tuple, None] = None, raw: bool = False):
+        """Fetch power data, newest first.
+
+        ``device_code``, ``start`` (inclusive) and ``end`` (exclusive) filter the rows.
+        ``before`` is the ``(timestamp, id, device_code)`` of the last row of the
+        previous page; the page continues after it in
+        ``(timestamp, id)`` order, so deep pages cost the same as the first one.
+        A row without an id is looked up, or else continued after in
+        ``(timestamp, device_code)`` order.
+        With ``raw`` rows are ``EXPORT_COLUMNS`` tuples instead of dicts.
+        """
+        conditions, params = [], []
+        if device_code is not None:
+            conditions.append("device_code = %s")
+            params.append(device_code)
+        if start is not None:
+            conditions.append("timestamp >= %s")
+            params.append(naive_utc(start))
+        if end is not None:
+            conditions.append("timestamp < %s")
+            params.append(naive_utc(end))
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(dictionary=not raw) as cursor:
+                    if before is not None:
+                        timestamp, row_id, row_device = before
+                        if row_id is None:
+                            # Rows served from the recent readings store may predate their id
+                            cursor.execute("SELECT id FROM power_readings WHERE device_code = %s AND timestamp = %s",
+                                           (row_device, timestamp))
+                            found = cursor.fetchone()
+                            row_id = (found['id'] if not raw else found[0]) if found else None
+                        if row_id is None:
+                            # Never stored: (device_code, timestamp) is still unique, so rows sharing
+                            # the timestamp continue by device_code instead of being skipped
+                            conditions.append("timestamp <= %s AND (timestamp < %s OR device_code < %s)")
+                            params += [timestamp, timestamp, row_device]
+                        else:
+                            # Written so the timestamp range alone can drive the index scan
+                            conditions.append("timestamp <= %s AND (timestamp < %s OR id < %s)")
+                            params += [timestamp, timestamp, row_id]
+                    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+                    # idx_timestamp and uq_device_timestamp both end in the primary key, so
+                    # (timestamp, id) order is read straight from the index
+                    query = (
+                        f"SELECT {', '.join(EXPORT_COLUMNS)} "
+                        f"FROM power_readings {where}ORDER BY timestamp DESC, id DESC LIMIT %s"
+                    )
+                    cursor.execute(query, (*params, limit))
+                    return cursor.fetchall()
+        except mysql.connector.Error as err:
+            logging.error(f"Error fetching data: {err}", exc_info=True)
+            return []
+
+    def iter_readings(self, device_code: Union[str, None] = None, start: Union[datetime.datetime, None] = None,
+                      end: Union[datetime.datetime, None] = None, chunk_size: int = 5000) -> Iterator[List[tuple]]:
+        """Yield every matching reading as ``EXPORT_COLUMNS`` tuples, oldest first, in lists of ``chunk_size``.
+
+        The result is read with an unbuffered cursor, so MySQL streams it and only
+        one chunk is held in memory. The connection stays checked out until the
+        generator is exhausted or closed.
+        """
+        conditions, params = [], []
+        if device_code is not None:
+            conditions.append("device_code = %s")
+            params.append(device_code)
+        if start is not None:
+            conditions.append("timestamp >= %s")
+            params.append(naive_utc(start))
+        if end is not None:
+            conditions.append("timestamp < %s")
+            params.append(naive_utc(end))
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM power_readings {where}ORDER BY timestamp, id"
+
+        def run(call, *args):
+            # Each round trip goes through the executor, like the @_blocking methods
+            return call(*args) if self.executor is None else self.executor.run(call, *args)
+
+        conn = run(self._get_connection)
+        finished = False
+        try:
+            cursor = conn.cursor()
+            run(cursor.execute, query, tuple(params))
+            while True:
+                rows = run(cursor.fetchmany, chunk_size)
+                if not rows:
+                    break
+                yield rows
+            finished = True
+            cursor.close()
+        except mysql.connector.Error as err:
+            logging.error(f"Error streaming readings: {err}", exc_info=True)
+            raise
+        finally:
+            if not finished:
+                # Reading the rest of an abandoned result could take as long as the export
+                # itself; drop the session instead, the pool reconnects it on next use
+                try:
+                    conn.disconnect()
+                except mysql.connector.Error:
+                    pass
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+
+    @_blocking
+    def fetch_latest_per_device(self):
+        """Fetch the most recent reading of every device."""
+        # GROUP BY device_code with MAX(timestamp) is a loose index scan on uq_device_timestamp
         query = (
-            "SELECT id, timestamp, device_code, temperature, humidity, brightness, electric "
-            "FROM power_readings ORDER BY timestamp DESC LIMIT %s"
+            "SELECT r.id, r.timestamp, r.device_code, r.temperature, r.humidity, r.brightness, r.electric "
+            "FROM power_readings r JOIN ("
+            "SELECT device_code, MAX(timestamp) AS timestamp FROM power_readings GROUP BY device_code"
+            ") latest ON r.device_code = latest.device_code AND r.timestamp = latest.timestamp"
         )
         try:
             with self._get_connection() as conn:
                 with conn.cursor(dictionary=True) as cursor:
-                    cursor.execute(query, (limit,))
+                    cursor.execute(query)
                     return cursor.fetchall()
         except mysql.connector.Error as err:
-            logging.error(f"Error fetching data: {err}", exc_info=True)
+            logging.error(f"Error fetching latest readings per device: {err}", exc_info=True)
             return []
 
     # Convenience function for migrations/checks
+    @_blocking
     def ping(self):
         try:
             with self._get_connection() as conn:
@@ -99,6 +419,7 @@ class Database:
         except mysql.connector.Error:
             return False
 
+    @_blocking
     def create_esg_report(self):
         """Generate dummy ESG report entry and return id, url."""
         query = (
@@ -116,6 +437,40 @@ class Database:
             logging.error(f"Error inserting esg report: {err}", exc_info=True)
             raise
 
+    @_blocking
+    def get_data_version(self) -> Union[Tuple[int, Union[datetime.datetime, None]], None]:
+        """``(id, created_at)`` of the newest power_readings row, ``(0, None)`` when empty.
+
+        A primary-key lookup, cheap enough to decide whether an aggregate has
+        to be recomputed. None if MySQL could not be asked.
+        """
+        query = "SELECT id, created_at FROM power_readings ORDER BY id DESC LIMIT 1"
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query)
+                    row = cursor.fetchone()
+                    return (row[0], row[1]) if row else (0, None)
+        except mysql.connector.Error as err:
+            logging.error(f"Error fetching data version: {err}", exc_info=True)
+            return None
+
+    @_blocking
+    def get_report_version(self) -> Union[Tuple[str, Union[datetime.datetime, None]], None]:
+        """Version token and newest ``created_at`` of esg_reports, or None if MySQL could not be asked."""
+        query = "SELECT COUNT(*), MAX(id), MAX(created_at) FROM esg_reports"
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query)
+                    count, max_id, created_at = cursor.fetchone()
+                    # The count changes on deletes, the id on inserts
+                    return f"{count}.{max_id or 0}", created_at
+        except mysql.connector.Error as err:
+            logging.error(f"Error fetching report version: {err}", exc_info=True)
+            return None
+
+    @_blocking
     def fetch_esg_reports(self):
         """Fetch list of ESG reports."""
         query = "SELECT id, file_path AS url, created_at FROM esg_reports ORDER BY created_at DESC"
@@ -128,6 +483,7 @@ class Database:
             logging.error(f"Error fetching esg reports: {err}", exc_info=True)
             return []
 
+    @_blocking
     def get_summary_data(self, time_range: str = '24h'):
         """
         Fetch summary statistics for the given time range.
@@ -148,27 +504,37 @@ class Database:
         }
         
         interval = interval_map.get(time_range, 'INTERVAL 24 HOUR')
+        since = f"NOW() - {interval}"
+        # Whole hours come from the hourly rollup, the partial first hour from raw rows
+        first_full_hour = f"DATE({since}) + INTERVAL (HOUR({since}) + 1) HOUR"
         
         query = f"""
         SELECT 
-            COUNT(*) as total_readings,
-            AVG(temperature) as avg_temperature,
-            MIN(temperature) as min_temperature,
-            MAX(temperature) as max_temperature,
-            AVG(humidity) as avg_humidity,
-            MIN(humidity) as min_humidity,
-            MAX(humidity) as max_humidity,
-            AVG(brightness) as avg_brightness,
-            MIN(brightness) as min_brightness,
-            MAX(brightness) as max_brightness,
-            AVG(electric) as avg_electric,
-            MIN(electric) as min_electric,
-            MAX(electric) as max_electric,
-            SUM(electric) as total_electric,
-            MIN(timestamp) as period_start,
-            MAX(timestamp) as period_end
-        FROM power_readings 
-        WHERE timestamp >= NOW() - {interval}
+            COALESCE(SUM(readings), 0) as total_readings,
+            SUM(temperature_sum) / NULLIF(SUM(temperature_count), 0) as avg_temperature,
+            MIN(temperature_min) as min_temperature,
+            MAX(temperature_max) as max_temperature,
+            SUM(humidity_sum) / NULLIF(SUM(humidity_count), 0) as avg_humidity,
+            MIN(humidity_min) as min_humidity,
+            MAX(humidity_max) as max_humidity,
+            SUM(brightness_sum) / NULLIF(SUM(brightness_count), 0) as avg_brightness,
+            MIN(brightness_min) as min_brightness,
+            MAX(brightness_max) as max_brightness,
+            SUM(electric_sum) / NULLIF(SUM(electric_count), 0) as avg_electric,
+            MIN(electric_min) as min_electric,
+            MAX(electric_max) as max_electric,
+            SUM(electric_sum) as total_electric,
+            MIN(first_timestamp) as period_start,
+            MAX(last_timestamp) as period_end
+        FROM (
+            SELECT {VALUE_COLUMNS_SQL}
+            FROM {HOURLY_TABLE}
+            WHERE bucket >= {first_full_hour}
+            UNION ALL
+            SELECT {RAW_AGGREGATES_SQL}
+            FROM power_readings 
+            WHERE timestamp >= {since} AND timestamp < {first_full_hour}
+        ) buckets
         """
         
         try:
@@ -230,55 +596,316 @@ class Database:
         Fetch hourly aggregated data for trend analysis.
         
         Args:
-            time_range: '24h', '7d', '30d'
+            time_range: '1h', '6h', '24h', '7d', '30d'
         
         Returns:
             list of hourly aggregated readings
         """
-        interval_map = {
-            '24h': 'INTERVAL 24 HOUR',
-            '7d': 'INTERVAL 7 DAY', 
-            '30d': 'INTERVAL 30 DAY'
-        }
-        
-        interval = interval_map.get(time_range, 'INTERVAL 24 HOUR')
-        
-        query = f"""
-        SELECT 
-            DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00') as hour_start,
-            COUNT(*) as readings_count,
-            AVG(temperature) as avg_temperature,
-            AVG(humidity) as avg_humidity,
-            AVG(brightness) as avg_brightness,
-            AVG(electric) as avg_electric,
-            SUM(electric) as total_electric
-        FROM power_readings 
-        WHERE timestamp >= NOW() - {interval}
-        GROUP BY DATE_FORMAT(timestamp, '%Y-%m-%d %H')
-        ORDER BY hour_start ASC
+        now = datetime.datetime.utcnow()
+        return self.get_trend(now - TIME_RANGES.get(time_range, TIME_RANGES['24h']), now, '1h')
+
+    @_blocking
+    def get_trend(self, start: datetime.datetime, end: datetime.datetime, bucket: str = '1h',
+                  device_code: Union[str, None] = None):
+        """
+        Aggregate readings of ``[start, end)`` into buckets of ``bucket`` (a ``TREND_BUCKETS`` key).
+
+        Buckets are aligned to the epoch (days start at midnight) and only those
+        holding readings are returned. Whole hours and days come from the rollup
+        tables when the bucket is at least that coarse.
+
+        Raises:
+            ValueError: for an unknown bucket or more than ``MAX_TREND_BUCKETS`` buckets
         """
+        if bucket not in TREND_BUCKETS:
+            raise ValueError(f"Unknown bucket {bucket!r}")
+        bucket_seconds = TREND_BUCKETS[bucket]
+        start, end = naive_utc(start), naive_utc(end)
+        if end <= start:
+            return []
+        if (end - start).total_seconds() / bucket_seconds > MAX_TREND_BUCKETS:
+            raise ValueError(f"More than {MAX_TREND_BUCKETS} buckets of {bucket} requested")
+        query, params = trend_query(start, end, bucket_seconds, device_code)
         
         try:
             with self._get_connection() as conn:
                 with conn.cursor(dictionary=True) as cursor:
-                    cursor.execute(query)
+                    cursor.execute(query, params)
                     results = cursor.fetchall()
                     
                     # 데이터 형식 정리
                     formatted_results = []
                     for row in results:
+                        bucket_start = from_epoch_seconds(int(row['bucket_epoch']))
                         formatted_results.append({
-                            'timestamp': row['hour_start'],
-                            'readings_count': row['readings_count'],
+                            'timestamp': bucket_start.strftime('%Y-%m-%d %H:%M:%S'),
+                            'readings_count': int(row['readings_count']),
                             'temperature': float(row['avg_temperature']) if row['avg_temperature'] else 0,
                             'humidity': float(row['avg_humidity']) if row['avg_humidity'] else 0,
                             'brightness': float(row['avg_brightness']) if row['avg_brightness'] else 0,
                             'electric_avg': float(row['avg_electric']) if row['avg_electric'] else 0,
-                            'electric_total': float(row['total_electric']) if row['total_electric'] else 0
+                            'electric_total': float(row['total_electric']) if row['total_electric'] else 0,
+                            'electric_min': float(row['min_electric']) if row['min_electric'] is not None else None,
+                            'electric_max': float(row['max_electric']) if row['max_electric'] is not None else None
                         })
                     
                     return formatted_results
                     
         except mysql.connector.Error as err:
-            logging.error(f"Error fetching hourly trend: {err}", exc_info=True)
+            logging.error(f"Error fetching {bucket} trend: {err}", exc_info=True)
             return []
+
+
+class BatchWriter:
+    """Buffers readings and writes them to MySQL in group-committed batches.
+
+    A batch is flushed when it holds ``max_batch_size`` rows or when its oldest
+    row has waited ``max_batch_age`` seconds, whichever comes first. Each flush
+    is one ``Database.insert_readings`` call, i.e. one INSERT and one commit.
+    Call ``close()`` on shutdown to flush whatever is still buffered.
+
+    Rows may carry an ``on_commit`` callback (e.g. an MQTT ack) that runs only
+    after their batch has been committed; if the batch is lost instead,
+    ``on_flush_failure`` is called. Duplicates are skipped by default so
+    one redelivered reading cannot fail a whole batch, and a batch MySQL refuses
+    for bad data is retried row by row so only the offending rows are lost.
+
+    With a ``spool`` (``modules.spool.Spool``) the writer degrades instead of
+    losing data: when there is no database, an insert fails or a flush takes
+    longer than ``latency_budget_ms``, batches are appended to the spool until
+    a ``SpoolReplayer`` has drained it and calls ``resume_direct_writes()``.
+    A batch the spool cannot take either (disk full) stays buffered, its
+    callbacks pending, and is retried on the next flush.
+    """
+
+    def __init__(self, db: Union[Database, None], max_batch_size: int = 500, max_batch_age: float = 1.0,
+                 ignore_duplicates: bool = True, spool=None, latency_budget_ms: Union[float, None] = None,
+                 on_flush_failure: Union[Callable, None] = None):
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.max_batch_age = max_batch_age
+        self.ignore_duplicates = ignore_duplicates
+        self.spool = spool
+        self.latency_budget_ms = latency_budget_ms
+        # Called when a failed batch's callbacks are dropped, e.g. MQTTClient.request_redelivery
+        self.on_flush_failure = on_flush_failure
+        # True while batches go to the spool instead of MySQL; rows left in the
+        # spool by a previous run are replayed before new ones are written directly
+        self.degraded = spool is not None and (db is None or spool.pending_rows > 0)
+
+        self._buffer = []
+        self._callbacks = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        # Flushes are serialized so batches are committed in arrival order
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.flush_latency = RollingStats()
+        self.batch_sizes = RollingStats()
+        self.rows_written = 0
+        self.rows_spooled = 0
+        self.duplicates_skipped = 0
+        self.rows_rejected = 0
+        self.flush_errors = 0
+
+    def start(self):
+        """Start the background thread that flushes batches past their max age."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+        self._thread.start()
+        logging.info(f"Batch writer started (size={self.max_batch_size}, age={self.max_batch_age}s).")
+
+    def add(self, device_code, timestamp, temperature=None, humidity=None, brightness=None, electric=None,
+            on_commit=None):
+        """Buffer one reading; flushes inline when the batch is full."""
+        row = (parse_timestamp(timestamp), device_code, temperature, humidity, brightness, electric)
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(row)
+            if on_commit is not None:
+                self._callbacks.append(on_commit)
+            full = len(self._buffer) >= self.max_batch_size
+        if full:
+            self.flush()
+
+    def add_many(self, readings, on_commit=None):
+        """Buffer several readings at once so they are committed in the same batch.
+
+        ``readings`` are ``(device_code, timestamp, temperature, humidity, brightness, electric)``
+        tuples such as ``modules.readings.Reading``; ``on_commit`` runs once for all of them.
+        """
+        rows = [
+            (parse_timestamp(timestamp), device_code, temperature, humidity, brightness, electric)
+            for device_code, timestamp, temperature, humidity, brightness, electric in readings
+        ]
+        if not rows:
+            return
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.extend(rows)
+            if on_commit is not None:
+                self._callbacks.append(on_commit)
+            full = len(self._buffer) >= self.max_batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write all buffered rows now. Returns the number of rows flushed."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                callbacks, self._callbacks = self._callbacks, []
+                self._oldest = None
+            if not batch:
+                return 0
+
+            if self.degraded:
+                return self._spool(batch, callbacks)
+
+            started = time.monotonic()
+            try:
+                if self.db is None:
+                    raise RuntimeError("Database not available")
+                rejected = 0
+                try:
+                    written = self.db.insert_readings(batch, ignore_duplicates=self.ignore_duplicates)
+                except Exception as e:
+                    if not is_data_error(e):
+                        raise
+                    written, rejected = self._insert_each(batch, e)
+            except Exception as e:
+                self.flush_errors += 1
+                if self.spool is not None:
+                    logging.warning(f"Failed to flush batch of {len(batch)} readings, spooling to disk: {e}")
+                    self.degraded = True
+                    return self._spool(batch, callbacks)
+                # Callbacks are not run; on_flush_failure gets their messages redelivered
+                logging.error(f"Failed to flush batch of {len(batch)} readings: {e}")
+                if callbacks and self.on_flush_failure is not None:
+                    self.on_flush_failure()
+                return 0
+
+            elapsed_ms = (time.monotonic() - started) * 1000
+            self.flush_latency.add(elapsed_ms)
+            self.batch_sizes.add(len(batch))
+            self.rows_written += written
+            self.duplicates_skipped += len(batch) - written - rejected
+            logging.debug(f"Flushed {len(batch)} readings in {elapsed_ms:.1f} ms")
+
+            if self.spool is not None and self.latency_budget_ms and elapsed_ms > self.latency_budget_ms:
+                logging.warning(f"Flush took {elapsed_ms:.0f} ms (budget {self.latency_budget_ms:.0f} ms); "
+                                "spooling further batches until MySQL catches up")
+                self.degraded = True
+
+            self._run_callbacks(callbacks)
+            return len(batch)
+
+    def _insert_each(self, batch, error) -> Tuple[int, int]:
+        """Insert ``batch`` row by row after it failed with data ``error`` as a whole.
+
+        Rows MySQL still refuses are set aside (quarantined with a spool, logged
+        otherwise) so the rest of the batch is committed and acknowledged.
+        Any other error is raised as for a whole batch. Returns the number of
+        rows written and the number rejected.
+        """
+        written, rejected = 0, []
+        if len(batch) == 1:
+            rejected = batch
+        else:
+            logging.warning(f"Batch of {len(batch)} readings was refused ({error}); retrying its rows one by one")
+            for row in batch:
+                try:
+                    written += self.db.insert_readings([row], ignore_duplicates=self.ignore_duplicates)
+                except Exception as e:
+                    if not is_data_error(e):
+                        raise
+                    rejected.append(row)
+        self.rows_rejected += len(rejected)
+        if self.spool is not None:
+            self.spool.quarantine(rejected)
+        else:
+            for row in rejected:
+                logging.error(f"Dropped reading MySQL refused to store: {row}")
+        return written, len(rejected)
+
+    def resume_direct_writes(self, drain) -> int:
+        """Run ``drain()`` with flushes blocked, then write to MySQL directly again.
+
+        Used by the spool replayer so no batch can be spooled after the final
+        drain. Returns what ``drain()`` returns.
+        """
+        with self._flush_lock:
+            drained = drain()
+            self.degraded = False
+            return drained
+
+    def _spool(self, batch, callbacks) -> int:
+        try:
+            self.spool.append(batch)
+        except Exception as e:
+            self.flush_errors += 1
+            logging.error(f"Failed to spool batch of {len(batch)} readings, keeping it buffered: {e}",
+                          exc_info=True)
+            self._requeue(batch, callbacks)
+            return 0
+        self.rows_spooled += len(batch)
+        # Spooled rows are durable on disk, so their messages can be acknowledged
+        self._run_callbacks(callbacks)
+        return len(batch)
+
+    def _requeue(self, batch, callbacks):
+        # Back in front of anything buffered since, so the batch is retried first
+        # on the next flush (by age or size) and its callbacks still run only once it is stored
+        with self._lock:
+            self._buffer = batch + self._buffer
+            self._callbacks = callbacks + self._callbacks
+            self._oldest = time.monotonic()
+
+    @staticmethod
+    def _run_callbacks(callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Commit callback failed: {e}")
+
+    def close(self):
+        """Stop the flush thread and write out any remaining rows."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        logging.info("Batch writer closed.")
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def stats(self) -> dict:
+        """Flush latency (ms) and batch size distributions for tuning."""
+        return {
+            'pending': self.pending(),
+            'rows_written': self.rows_written,
+            'rows_spooled': self.rows_spooled,
+            'degraded': self.degraded,
+            'duplicates_skipped': self.duplicates_skipped,
+            'rows_rejected': self.rows_rejected,
+            'flush_errors': self.flush_errors,
+            'flush_latency_ms': self.flush_latency.snapshot(),
+            'batch_size': self.batch_sizes.snapshot(),
+        }
+
+    def _run(self):
+        interval = max(self.max_batch_age / 4, 0.01)
+        while not self._stop.wait(interval):
+            with self._lock:
+                oldest = self._oldest
+            if oldest is not None and time.monotonic() - oldest >= self.max_batch_age:
+                self.flush()
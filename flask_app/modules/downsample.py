@@ -0,0 +1,74 @@
+import datetime
+from typing import Sequence, Union
+
+import numpy as np
+
+# Smallest max_points LTTB can honour: the first and last points are always kept
+MIN_POINTS = 3
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps from the series ``(x, y)``.
+
+    ``x`` must be sorted. The first and last points are kept; the points between
+    are split into ``max_points - 2`` equal buckets and each contributes the point
+    forming the largest triangle with the point kept from the previous bucket and
+    the average of the next one, so peaks and dips survive. NaN values in ``y``
+    are only picked when a bucket holds nothing else.
+    """
+    n = len(x)
+    if max_points >= n or max_points < MIN_POINTS:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Bucket i covers [edges[i], edges[i + 1]); the last one ends before the final point
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    # Average of every bucket, used as the third corner by the bucket before it
+    sums_x = np.add.reduceat(x[:-1], edges[:-1])
+    counts = np.diff(edges)
+    finite = np.isfinite(y[:-1])
+    sums_y = np.add.reduceat(np.where(finite, y[:-1], 0.0), edges[:-1])
+    finite_counts = np.add.reduceat(finite.astype(np.int64), edges[:-1])
+    avg_x = np.append(sums_x / counts, x[-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_y = np.append(sums_y / finite_counts, y[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Twice the triangle area; the constant factor does not change the argmax
+        areas = np.abs((x[previous] - avg_x[i + 1]) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (avg_y[i + 1] - y[previous]))
+        areas = np.where(np.isnan(areas), -1.0, areas)
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def _as_number(value) -> float:
+    if value is None:
+        return np.nan
+    if isinstance(value, datetime.datetime):
+        return value.timestamp() if value.tzinfo else (value - datetime.datetime(1970, 1, 1)).total_seconds()
+    if isinstance(value, str):
+        return _as_number(datetime.datetime.fromisoformat(value.replace('Z', '+00:00')))
+    return float(value)
+
+
+def downsample_rows(rows: Sequence, max_points: int, x_key: Union[str, int] = 'timestamp',
+                    y_key: Union[str, int] = 'electric') -> list:
+    """At most ``max_points`` of ``rows``, picked by LTTB over ``(row[x_key], row[y_key])``.
+
+    Rows are dicts, or tuples with ``x_key``/``y_key`` as positions. They may come
+    in any time order; the kept rows stay in their original order. Timestamps
+    may be datetimes or ISO 8601 strings.
+    """
+    if max_points >= len(rows):
+        return list(rows)
+    x = np.fromiter((_as_number(row[x_key]) for row in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter((_as_number(row[y_key]) for row in rows), dtype=np.float64, count=len(rows))
+    order = np.argsort(x, kind='stable')
+    kept = np.sort(order[lttb_indices(x[order], y[order], max_points)])
+    return [rows[i] for i in kept]
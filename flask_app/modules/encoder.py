@@ -0,0 +1,78 @@
+import datetime
+import json
+from decimal import Decimal
+from operator import itemgetter
+from typing import Iterable, List, Sequence
+
+from flask import Response
+
+from modules.codecs import to_epoch_ms
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library encoder is used without it
+    orjson = None
+
+# Fields sent as epoch milliseconds in columnar responses
+TIME_FIELDS = ('timestamp',)
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+
+
+def _default(value):
+    # Only reached for types the JSON backend does not encode itself
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Type {type(value)} not serializable")
+
+
+def dumps(obj) -> bytes:
+    """JSON bytes for ``obj``; datetimes become ISO 8601 strings and Decimals floats."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+
+def as_tuples(rows: Sequence, fields: Sequence[str]) -> List[tuple]:
+    """``rows`` as tuples in ``fields`` order; dict rows (``dictionary=True`` cursors, the recent store) are picked apart."""
+    if not rows or not isinstance(rows[0], dict):
+        return list(rows)
+    if len(fields) == 1:
+        return [(row.get(fields[0]),) for row in rows]
+    try:
+        return list(map(itemgetter(*fields), rows))
+    except KeyError:
+        # Missing fields are null, as in the row objects built from the same dicts before
+        return [tuple(row.get(field) for field in fields) for row in rows]
+
+
+def row_objects(fields: Sequence[str], rows: Iterable[tuple]) -> List[dict]:
+    """Cursor tuples as one object per row, ready for ``dumps``.
+
+    ``dict(zip())`` and orjson both run in C; splicing encoded values into a
+    row template without dicts was slower (see scripts/bench_api_encoding.py).
+    """
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def _epoch_ms(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        # Stored timestamps are naive UTC
+        return (value - _EPOCH) // _MILLISECOND
+    return to_epoch_ms(value)
+
+
+def columns(fields: Sequence[str], rows: Sequence[tuple]) -> dict:
+    """Cursor tuples as one list per field, with ``TIME_FIELDS`` as epoch milliseconds."""
+    transposed = list(zip(*rows)) if rows else [()] * len(fields)
+    return {field: list(map(_epoch_ms, values)) if field in TIME_FIELDS else list(values)
+            for field, values in zip(fields, transposed)}
+
+
+def json_response(obj, status: int = 200) -> Response:
+    """Flask response with ``obj`` encoded once by ``dumps`` (instead of ``jsonify``)."""
+    return Response(dumps(obj), status=status, mimetype='application/json')
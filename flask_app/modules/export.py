@@ -0,0 +1,116 @@
+import csv
+import datetime
+import io
+import json
+from decimal import Decimal
+from typing import Iterable, Iterator, List
+
+from modules.database import EXPORT_COLUMNS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional: only needed for Parquet exports
+    pyarrow = None
+
+# Export formats and their content types
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {list(FORMATS)}")
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet export requires the 'pyarrow' package")
+    return fmt
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type {type(value)} not serializable")
+
+
+def _ndjson(chunks: Iterable[List[tuple]]) -> Iterator[bytes]:
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=_json_value) + '\n'
+                      for row in rows).encode()
+
+
+def _csv(chunks: Iterable[List[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(row[:1] + (row[1].isoformat(),) + row[2:] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _Drain:
+    """Write-only file whose contents are handed out as they are written."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+def _parquet(chunks: Iterable[List[tuple]]) -> Iterator[bytes]:
+    schema = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('timestamp', pyarrow.timestamp('s')),
+        ('device_code', pyarrow.string()),
+        ('temperature', pyarrow.float32()),
+        ('humidity', pyarrow.float32()),
+        ('brightness', pyarrow.int32()),
+        ('electric', pyarrow.float32()),
+    ])
+    sink = _Drain()
+    # Every chunk becomes one row group; the footer follows the last one
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+def export_chunks(fmt: str, chunks: Iterable[List[tuple]]) -> Iterator[bytes]:
+    """Encode lists of ``EXPORT_COLUMNS`` rows (``Database.iter_readings``) as ``fmt``, chunk by chunk.
+
+    Raises ValueError right away for an unusable format, before anything is streamed.
+    """
+    encoders = {'ndjson': _ndjson, 'csv': _csv, 'parquet': _parquet}
+    return encoders[check_format(fmt)](chunks)
@@ -0,0 +1,220 @@
+import os
+import struct
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Union
+
+from modules.metrics import RollingStats
+
+POLICIES = ('block', 'drop_oldest', 'spill')
+
+# enqueued_at (epoch seconds), topic length, payload length
+_SPILL_HEADER = struct.Struct('>dHI')
+
+
+class _SpillFile:
+    """Append-only overflow file for payloads that did not fit in the queue.
+
+    Records are read back in the order they were written; the file is
+    truncated once every record has been consumed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Ack callbacks cannot be serialized, so they stay in memory next to their records
+        self._acks = deque()
+        self._read_offset = 0
+        self.depth = 0
+        open(self.path, 'wb').close()
+
+    def append(self, topic: str, payload: bytes, enqueued_at: float, ack: Union[Callable, None] = None):
+        topic_bytes = (topic or '').encode('utf-8')
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(_SPILL_HEADER.pack(enqueued_at, len(topic_bytes), len(payload)))
+                f.write(topic_bytes)
+                f.write(payload)
+            self._acks.append(ack)
+            self.depth += 1
+
+    def pop(self):
+        """Return the oldest spilled ``(enqueued_at, topic, payload, ack)`` or None."""
+        with self._lock:
+            if self.depth == 0:
+                return None
+            with open(self.path, 'rb') as f:
+                f.seek(self._read_offset)
+                enqueued_at, topic_len, payload_len = _SPILL_HEADER.unpack(f.read(_SPILL_HEADER.size))
+                topic = f.read(topic_len).decode('utf-8') or None
+                payload = f.read(payload_len)
+                self._read_offset = f.tell()
+            ack = self._acks.popleft()
+            self.depth -= 1
+            if self.depth == 0:
+                open(self.path, 'wb').close()
+                self._read_offset = 0
+            # Spilled records carry wall-clock time so waits survive the round trip
+            return time.monotonic() - (time.time() - enqueued_at), topic, payload, ack
+
+
+class IngestPipeline:
+    """Bounded queue plus worker pool between the MQTT network loop and processing.
+
+    The network thread only calls ``submit()`` with the raw payload; parsing,
+    database writes and Socket.IO emits run on the worker threads, which call
+    ``handler(payload, topic, ack)``. When the
+    queue is full the backpressure policy decides what happens:
+
+    - ``block``: the submitting thread waits for room (slows the MQTT socket down).
+    - ``drop_oldest``: the oldest queued payload is discarded.
+    - ``spill``: the payload is appended to an overflow file and processed later.
+    """
+
+    def __init__(self,
+                 handler: Callable,
+                 maxsize: int = 10000,
+                 workers: int = 2,
+                 policy: str = 'block',
+                 spill_path: Union[str, None] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}', expected one of {POLICIES}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.num_workers = workers
+        self.policy = policy
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._busy = 0
+        self._workers = []
+        self._spill = None
+        if policy == 'spill':
+            self._spill = _SpillFile(spill_path or os.path.join('/tmp', f'ingest-spill-{os.getpid()}.bin'))
+
+        self.wait_time = RollingStats()
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.errors = 0
+
+    def start(self):
+        """Start the worker threads."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._work, name=f'ingest-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logging.info(f"Ingest pipeline started ({self.num_workers} workers, "
+                     f"queue size {self.maxsize}, policy '{self.policy}').")
+
+    def submit(self,
+               payload: Union[bytes, str],
+               topic: Union[str, None] = None,
+               ack: Union[Callable, None] = None) -> bool:
+        """Enqueue a raw payload. Returns False if it was not accepted.
+
+        ``ack`` is passed through to the handler, which calls it once the
+        message has been durably processed. Dropped messages are never acked,
+        which is why ``MQTTClient`` refuses ``drop_oldest`` with at_least_once delivery.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                if self.policy == 'block':
+                    while self._running and len(self._queue) >= self.maxsize:
+                        self._cond.wait()
+                    if not self._running:
+                        return False
+                elif self.policy == 'drop_oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self._spill.append(topic, payload, time.time(), ack)
+                    self.spilled += 1
+                    self.enqueued += 1
+                    self._cond.notify()
+                    return True
+            self._queue.append((now, topic, payload, ack))
+            self.enqueued += 1
+            self._cond.notify()
+        return True
+
+    def stop(self, drain: bool = True, timeout: float = 10.0):
+        """Stop the workers, by default after the queue has been processed."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if drain:
+                while (self._queue or self._busy or self.spill_depth()) and time.monotonic() < deadline:
+                    self._cond.wait(timeout=0.05)
+            self._running = False
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout=max(deadline - time.monotonic(), 0.1))
+        self._workers = []
+        logging.info("Ingest pipeline stopped.")
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def spill_depth(self) -> int:
+        return self._spill.depth if self._spill else 0
+
+    def stats(self) -> dict:
+        """Queue depth, counters and queue wait time (ms) distribution."""
+        return {
+            'depth': self.depth(),
+            'maxsize': self.maxsize,
+            'policy': self.policy,
+            'workers': self.num_workers,
+            'spill_depth': self.spill_depth(),
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'errors': self.errors,
+            'wait_ms': self.wait_time.snapshot(),
+        }
+
+    def _next_item(self):
+        with self._cond:
+            while self._running and not self._queue and not self.spill_depth():
+                self._cond.wait()
+            if not self._running:
+                return None
+            if self._queue:
+                item = self._queue.popleft()
+            else:
+                item = self._spill.pop()
+            self._busy += 1
+            # Wake a producer blocked on a full queue
+            self._cond.notify_all()
+            return item
+
+    def _work(self):
+        while True:
+            item = self._next_item()
+            if item is None:
+                return
+            enqueued_at, topic, payload, ack = item
+            self.wait_time.add((time.monotonic() - enqueued_at) * 1000)
+            try:
+                self.handler(payload, topic, ack)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Error processing ingested message: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self.processed += 1
+                    self._cond.notify_all()
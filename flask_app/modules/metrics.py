@@ -0,0 +1,41 @@
+import threading
+from collections import deque
+
+
+class RollingStats:
+    """Thread-safe summary of the most recent samples of a measurement.
+
+    Keeps a bounded window of samples so percentiles reflect current
+    behaviour rather than the whole process lifetime.
+    """
+
+    def __init__(self, window: int = 1024):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        """Return count, mean and percentiles of the current window."""
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+
+        if not samples:
+            return {'count': count, 'avg': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {
+            'count': count,
+            'avg': sum(samples) / len(samples),
+            'p50': pct(0.50),
+            'p95': pct(0.95),
+            'p99': pct(0.99),
+            'max': samples[-1],
+        }
@@ -1,38 +1,134 @@
 import paho.mqtt.client as mqtt
 import os
+import socket
 import threading
 import time
 import logging
+from functools import partial
+
+DELIVERY_MODES = ('at_most_once', 'at_least_once')
+
+def shared_topic(topic, group):
+    """Return the shared-subscription filter for ``topic`` in consumer ``group``."""
+    return f'$share/{group}/{topic}' if group else topic
+
 
 class MQTTClient:
-    def __init__(self, on_message_callback, topics=['power/measurement']):
+    def __init__(self, on_message_callback, topics=['power/measurement'], pipeline=None, shared_group=None,
+                 delivery=None, codecs=None, tap=None):
         self.broker = os.environ.get('MQTT_BROKER', 'mosquitto')
         self.port = int(os.environ.get('MQTT_PORT', 1883))
         self.topics = topics
-        self.client_id = f'flask-mqtt-client-{os.getpid()}'
+        # Consumer group: replicas in the same group split messages instead of each receiving all of them
+        self.shared_group = shared_group if shared_group is not None else os.environ.get('MQTT_SHARED_GROUP') or None
         self.on_message_callback = on_message_callback
-        
-        self.client = mqtt.Client(client_id=self.client_id)
+        # Optional IngestPipeline; when set the network loop only enqueues raw payloads
+        self.pipeline = pipeline
+        # Optional CodecRegistry; topics with a non-default codec are subscribed as well.
+        # Payloads are decoded by the callback, off the network thread.
+        self.codecs = codecs
+        # Optional CaptureWriter; records every raw message for later replay
+        self.tap = tap
+
+        # at_least_once: QoS 1, persistent session, PUBACK only after the reading is committed
+        self.delivery = delivery or os.environ.get('MQTT_DELIVERY', 'at_most_once')
+        if self.delivery not in DELIVERY_MODES:
+            raise ValueError(f"Unknown MQTT delivery mode '{self.delivery}', expected one of {DELIVERY_MODES}")
+        self.reliable = self.delivery == 'at_least_once'
+        self.qos = 1 if self.reliable else 0
+        if self.reliable and pipeline is not None and pipeline.policy == 'drop_oldest':
+            raise ValueError("The 'drop_oldest' backpressure policy discards messages without acknowledging them; "
+                             "use 'block' or 'spill' with at_least_once delivery")
+        # Minimum seconds between reconnects forced to get unacknowledged messages redelivered
+        self.redelivery_delay = float(os.environ.get('MQTT_REDELIVERY_DELAY', 5.0))
+        self.forced_reconnects = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._redelivery_timer = None
+        self._last_forced_reconnect = 0.0
+
+        if self.reliable:
+            # A persistent session is keyed by client id, so it must survive restarts
+            self.client_id = os.environ.get('MQTT_CLIENT_ID') or f'flask-mqtt-client-{socket.gethostname()}'
+        else:
+            # Containers all run as PID 1, so the hostname is needed to keep client ids unique
+            self.client_id = f'flask-mqtt-client-{socket.gethostname()}-{os.getpid()}'
+
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                                  client_id=self.client_id,
+                                  clean_session=not self.reliable,
+                                  manual_ack=self.reliable)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
 
-    def on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
+    def on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if not reason_code.is_failure:
             logging.info("Connected to MQTT Broker!")
             
             # Subscribe to all topics in the list
-            for topic in self.topics:
-                self.client.subscribe(topic)
-                logging.info(f"Subscribed to topic: {topic}")
+            for topic in self.subscribed_topics():
+                subscription = shared_topic(topic, self.shared_group)
+                self.client.subscribe(subscription, qos=self.qos)
+                logging.info(f"Subscribed to topic: {subscription}")
         else:
-            logging.error(f"Failed to connect to MQTT broker, return code {rc}")
+            logging.error(f"Failed to connect to MQTT broker: {reason_code}")
+
+    def subscribed_topics(self):
+        topics = list(self.topics)
+        if self.codecs is not None:
+            topics += [t for t in self.codecs.topics if t not in topics]
+        return topics
 
     def on_message(self, client, userdata, msg):
+        # With manual acks the callback acknowledges once the reading is durable;
+        # anything left unacknowledged is redelivered by the broker on reconnect.
+        ack = partial(self.client.ack, msg.mid, msg.qos) if self.reliable else None
+        if self.tap is not None:
+            try:
+                self.tap.record(msg.topic, msg.payload)
+            except Exception as e:
+                logging.error(f"Failed to record message to capture: {e}")
+        if self.pipeline is not None:
+            if not self.pipeline.submit(msg.payload, msg.topic, ack):
+                logging.warning(f"Ingest pipeline rejected message on topic {msg.topic}")
+            return
         try:
-            # Pass the received message to the callback function provided during initialization
-            self.on_message_callback(msg.payload.decode('utf-8'))
+            # Pass the raw payload to the callback; it is decoded with the topic's codec
+            self.on_message_callback(msg.payload, msg.topic, ack)
         except Exception as e:
             logging.error(f"Error in on_message_callback: {e}", exc_info=True)
+            self.request_redelivery()
+
+    def request_redelivery(self):
+        """Get messages that will not be acknowledged on this connection redelivered.
+
+        The broker resends unacknowledged QoS 1 messages only on a new
+        connection, and stops sending once its in-flight window is full of
+        them. So a message that failed is not left in flight: the client
+        reconnects, at most once per ``redelivery_delay`` seconds, and
+        requests made before a pending reconnect share it. No-op for
+        at_most_once delivery.
+        """
+        if not self.reliable:
+            return
+        with self._lock:
+            if self._redelivery_timer is not None or self._stopping.is_set():
+                return
+            delay = max(self._last_forced_reconnect + self.redelivery_delay - time.monotonic(), 0)
+            self._redelivery_timer = threading.Timer(delay, self._force_reconnect)
+            self._redelivery_timer.daemon = True
+            self._redelivery_timer.start()
+
+    def _force_reconnect(self):
+        with self._lock:
+            self._redelivery_timer = None
+            if self._stopping.is_set():
+                return
+            self._last_forced_reconnect = time.monotonic()
+            self.forced_reconnects += 1
+        logging.warning("Reconnecting to the MQTT broker so unacknowledged messages are redelivered.")
+        # loop_forever() returns; _run() opens the new connection
+        self.client.disconnect()
 
     def start(self):
         """Connects to the broker and starts the network loop in a separate thread."""
@@ -40,7 +136,7 @@ class MQTTClient:
             self.client.connect(self.broker, self.port, 60)
             
             # Start the network loop in a separate thread to avoid blocking
-            thread = threading.Thread(target=self.client.loop_forever)
+            thread = threading.Thread(target=self._run, name='mqtt-loop')
             thread.daemon = True
             thread.start()
             logging.info("MQTT client network loop started.")
@@ -51,7 +147,26 @@ class MQTTClient:
             # Optionally re-raise or handle the inability to connect
             raise
 
+    def _run(self):
+        while True:
+            self.client.loop_forever(retry_first_connection=True)
+            # Disconnected by stop(), or by _force_reconnect() to get a fresh session
+            while not self._stopping.is_set():
+                try:
+                    self.client.reconnect()
+                    break
+                except OSError as e:
+                    logging.warning(f"MQTT reconnect failed, retrying: {e}")
+                    self._stopping.wait(self.redelivery_delay)
+            if self._stopping.is_set():
+                return
+
     def stop(self):
+        with self._lock:
+            self._stopping.set()
+            if self._redelivery_timer is not None:
+                self._redelivery_timer.cancel()
+                self._redelivery_timer = None
         self.client.loop_stop()
         self.client.disconnect()
         logging.info("MQTT client disconnected.")
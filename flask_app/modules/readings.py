@@ -0,0 +1,120 @@
+import datetime
+import math
+from typing import Any, List, NamedTuple, Union
+
+# Message field names as sent by the devices, in Reading field order
+MESSAGE_FIELDS = ('temp', 'humidity', 'brightness', 'electric')
+# Fields stored in INT columns; the others are FLOAT
+INTEGER_FIELDS = ('brightness',)
+
+
+class Reading(NamedTuple):
+    """One sensor sample as received from a device."""
+    device_code: Any
+    timestamp: Any
+    temperature: Union[float, None] = None
+    humidity: Union[float, None] = None
+    brightness: Union[int, None] = None
+    electric: Union[float, None] = None
+
+    def to_event(self) -> dict:
+        """Payload of the Socket.IO 'reading' event."""
+        timestamp = self.timestamp
+        if isinstance(timestamp, datetime.datetime):
+            # Binary codecs decode to datetimes; events keep ISO strings
+            timestamp = timestamp.isoformat()
+        return {
+            'device_code': self.device_code,
+            'timestamp': timestamp,
+            'temperature': self.temperature,
+            'humidity': self.humidity,
+            'brightness': self.brightness,
+            'electric': self.electric,
+        }
+
+
+def metric_value(value, integer: bool = False) -> Union[float, int, None]:
+    """``value`` as a number MySQL will store, or None if it is missing or not numeric.
+
+    Numeric strings are converted; anything else (``"n/a"``, NaN, booleans,
+    nested objects) becomes null so one bad field cannot fail a whole batch.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(number):
+        return None
+    return int(round(number)) if integer else number
+
+
+def _metrics(values) -> tuple:
+    return tuple(metric_value(value, field in INTEGER_FIELDS) for field, value in zip(MESSAGE_FIELDS, values))
+
+
+def reading_from_message(data: dict, device_code: Any = None) -> Union[Reading, None]:
+    """Build a Reading from a single-reading message, or None if it is incomplete.
+
+    ``device_code`` is used when the message itself has no ``deviceCode``
+    (readings nested in a batch envelope).
+    """
+    if not isinstance(data, dict):
+        return None
+    device_code = data.get('deviceCode', device_code)
+    timestamp = data.get('timestamp')
+    if device_code is None or timestamp is None:
+        return None
+    return Reading(device_code, timestamp, *_metrics(data.get(field) for field in MESSAGE_FIELDS))
+
+
+def readings_from_batch(data: Any) -> List[Reading]:
+    """Validate a batch envelope and return its complete readings.
+
+    Accepted forms:
+
+    - a list of single-reading messages;
+    - ``{"deviceCode": ..., "readings": [...]}`` where entries may omit ``deviceCode``;
+    - columnar ``{"deviceCode": ..., "timestamp": [...], "temp": [...], ...}``
+      with one equally long array per field.
+
+    Incomplete readings are dropped and unusable metric values become null. Raises ValueError if the envelope itself is malformed.
+    """
+    if isinstance(data, list):
+        items, device_code = data, None
+    elif isinstance(data, dict) and isinstance(data.get('readings'), list):
+        items, device_code = data['readings'], data.get('deviceCode')
+    elif isinstance(data, dict) and isinstance(data.get('timestamp'), list):
+        return _readings_from_columns(data)
+    else:
+        raise ValueError("Batch payload must be a list, a 'readings' envelope or columnar arrays")
+
+    readings = []
+    for item in items:
+        reading = reading_from_message(item, device_code)
+        if reading is not None:
+            readings.append(reading)
+    return readings
+
+
+def _readings_from_columns(data: dict) -> List[Reading]:
+    device_code = data.get('deviceCode')
+    if device_code is None:
+        raise ValueError("Columnar batch requires a deviceCode")
+
+    timestamps = data['timestamp']
+    columns = []
+    for field in MESSAGE_FIELDS:
+        values = data.get(field)
+        if values is None:
+            values = [None] * len(timestamps)
+        elif not isinstance(values, list) or len(values) != len(timestamps):
+            raise ValueError(f"Columnar field '{field}' must be an array as long as 'timestamp'")
+        columns.append(values)
+
+    return [
+        Reading(device_code, timestamp, *_metrics(values))
+        for timestamp, *values in zip(timestamps, *columns)
+        if timestamp is not None
+    ]
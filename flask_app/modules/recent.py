@@ -0,0 +1,244 @@
+import datetime
+import math
+import threading
+import logging
+import uuid
+from array import array
+from typing import Dict, Iterable, List, Set, Union
+
+from modules.database import parse_timestamp
+from modules.rollups import naive_utc
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_NAN = float('nan')
+# Marks a missing brightness or database id in the integer columns
+_MISSING = -2 ** 63
+
+
+def _optional(value, kind):
+    # MySQL returns Decimal/float, devices send int/float/None
+    return None if value is None else kind(value)
+
+
+def _float(value) -> float:
+    return _NAN if value is None else value
+
+
+def _int(value) -> int:
+    return _MISSING if value is None else value
+
+
+class RecentReadings:
+    """The last ``capacity`` readings in arrival order plus the latest reading of each device.
+
+    Filled by the ingest path and warmed from MySQL at startup, so live
+    endpoints can answer without a query. The ring buffer is column-oriented:
+    one preallocated ``array`` per numeric field (NaN / INT64_MIN for missing
+    values) and one list of device codes, so it holds no per-reading objects.
+    Rows are returned in the shape of ``Database.fetch_power_data``; readings
+    that have not been read back from MySQL have ``id`` None.
+
+    Every stored reading gets a sequence number (its position in the write
+    order). Together with ``stream``, which changes on every restart, it is
+    the cursor Socket.IO clients resume from with ``since_seq()``.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self._ids = array('q', [_MISSING]) * capacity
+        # Microseconds since the epoch of the (naive) timestamp
+        self._timestamps = array('q', [0]) * capacity
+        self._devices = [None] * capacity
+        self._temperature = array('d', [_NAN]) * capacity
+        self._humidity = array('d', [_NAN]) * capacity
+        self._brightness = array('q', [_MISSING]) * capacity
+        self._electric = array('d', [_NAN]) * capacity
+        self._latest: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        # Total readings ever added, i.e. the sequence number of the newest one;
+        # the next one goes to slot written % capacity
+        self.written = 0
+        self.stream = uuid.uuid4().hex[:12]
+        # False once readings older than the ring's contents may exist
+        self._complete = True
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def add(self, device_code, timestamp, temperature=None, humidity=None, brightness=None,
+            electric=None, row_id: Union[int, None] = None) -> Union[int, None]:
+        """Add one reading. Returns its sequence number, or None if it was skipped
+        (unparseable or a redelivery)."""
+        row = self._normalize(device_code, timestamp, temperature, humidity, brightness, electric, row_id)
+        if row is None:
+            return None
+        device_code, timestamp = row['device_code'], row['timestamp']
+
+        with self._lock:
+            latest = self._latest.get(device_code)
+            if latest is not None and latest['timestamp'] == timestamp:
+                # At-least-once delivery repeats messages; the database keeps one row too
+                return None
+            if self.written >= self.capacity:
+                self._complete = False
+            slot = self.written % self.capacity
+            self._ids[slot] = _int(row['id'])
+            self._timestamps[slot] = (timestamp - _EPOCH) // _MICROSECOND
+            self._devices[slot] = device_code
+            self._temperature[slot] = _float(row['temperature'])
+            self._humidity[slot] = _float(row['humidity'])
+            self._brightness[slot] = _int(row['brightness'])
+            self._electric[slot] = _float(row['electric'])
+            self.written += 1
+            if latest is None or timestamp >= latest['timestamp']:
+                self._latest[device_code] = row
+            return self.written
+
+    def add_many(self, readings: Iterable) -> int:
+        """Add ``Reading`` tuples in order. Returns the number added."""
+        return sum(1 for reading in readings if self.add(*reading))
+
+    def covers(self, limit: int) -> bool:
+        """Whether ``latest(limit)`` can be answered from memory."""
+        return 0 < limit <= len(self)
+
+    def latest(self, limit: int = 100) -> List[dict]:
+        """The ``limit`` most recently received readings, newest timestamp first."""
+        with self._lock:
+            count = min(limit, len(self))
+            slots = [(self.written - 1 - i) % self.capacity for i in range(count)]
+            rows = [self._row(slot) for slot in slots]
+        rows.sort(key=lambda row: row['timestamp'], reverse=True)
+        return rows
+
+    def latest_for(self, device_code) -> Union[dict, None]:
+        """The newest reading of ``device_code``, or None."""
+        row = self._latest.get(str(device_code))
+        return dict(row) if row is not None else None
+
+    def devices(self) -> List[str]:
+        return list(self._latest)
+
+    def since_seq(self, seq: int, devices: Union[Set[str], None] = None,
+                  limit: Union[int, None] = None) -> Union[List[dict], None]:
+        """Events for the readings after sequence number ``seq``, oldest first.
+
+        Only readings of ``devices`` are included (all devices when None).
+        Returns None when the ring no longer holds every reading after ``seq``,
+        ``seq`` is from the future, or more than ``limit`` readings match.
+        """
+        with self._lock:
+            oldest = self.written - len(self) + 1
+            if seq > self.written or seq + 1 < oldest:
+                return None
+            return self._events(range(seq + 1, self.written + 1), devices, limit)
+
+    def since(self, timestamp, devices: Union[Set[str], None] = None,
+              limit: Union[int, None] = None) -> Union[List[dict], None]:
+        """Events for readings timestamped after ``timestamp``, in arrival order.
+
+        Returns None when older readings were evicted, so readings after
+        ``timestamp`` may be missing, or more than ``limit`` readings match.
+        """
+        try:
+            micros = (naive_utc(parse_timestamp(timestamp)) - _EPOCH) // _MICROSECOND
+        except (AttributeError, TypeError, ValueError):
+            return None
+        with self._lock:
+            seqs = range(self.written - len(self) + 1, self.written + 1)
+            if not self._complete and min(self._timestamps[:len(self)], default=micros) > micros:
+                return None
+            recent = [seq for seq in seqs if self._timestamps[(seq - 1) % self.capacity] > micros]
+            return self._events(recent, devices, limit)
+
+    def snapshot(self, devices: Union[Set[str], None] = None) -> List[dict]:
+        """Events for the latest reading of each device (of ``devices`` when given)."""
+        with self._lock:
+            rows = [row for code, row in self._latest.items() if devices is None or code in devices]
+        return [self._to_event(row) for row in rows]
+
+    def warm(self, db) -> int:
+        """Load the newest ``capacity`` rows and every device's latest row from MySQL."""
+        rows = db.fetch_power_data(limit=self.capacity)
+        # fetch_power_data is newest first; the ring is filled oldest first
+        loaded = sum(1 for row in reversed(rows) if self.add(*self._fields(row), row_id=row.get('id')))
+        if len(rows) >= self.capacity:
+            # MySQL may hold older rows than the ring
+            self._complete = False
+        # Devices that were quiet recently are not in the ring but still have a latest value
+        for row in db.fetch_latest_per_device():
+            latest = self._normalize(*self._fields(row), row.get('id'))
+            if latest is not None:
+                with self._lock:
+                    current = self._latest.get(latest['device_code'])
+                    if current is None or latest['timestamp'] > current['timestamp']:
+                        self._latest[latest['device_code']] = latest
+        logging.info(f"Recent readings store warmed with {loaded} readings of {len(self._latest)} devices.")
+        return loaded
+
+    def stats(self) -> dict:
+        return {'capacity': self.capacity, 'size': len(self), 'written': self.written,
+                'devices': len(self._latest)}
+
+    @staticmethod
+    def _fields(row: dict) -> tuple:
+        return (row.get('device_code'), row.get('timestamp'), row.get('temperature'),
+                row.get('humidity'), row.get('brightness'), row.get('electric'))
+
+    @staticmethod
+    def _normalize(device_code, timestamp, temperature, humidity, brightness, electric,
+                   row_id) -> Union[dict, None]:
+        try:
+            timestamp = naive_utc(parse_timestamp(timestamp))
+            return {
+                'id': row_id,
+                'timestamp': timestamp,
+                'device_code': str(device_code),
+                'temperature': _optional(temperature, float),
+                'humidity': _optional(humidity, float),
+                'brightness': _optional(brightness, int),
+                'electric': _optional(electric, float),
+            }
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def _events(self, seqs: Iterable[int], devices, limit) -> Union[List[dict], None]:
+        events = []
+        for seq in seqs:
+            slot = (seq - 1) % self.capacity
+            if devices is not None and self._devices[slot] not in devices:
+                continue
+            if limit is not None and len(events) >= limit:
+                return None
+            event = self._to_event(self._row(slot))
+            event['seq'] = seq
+            events.append(event)
+        return events
+
+    @staticmethod
+    def _to_event(row: dict) -> dict:
+        # Same fields as Reading.to_event()
+        return {
+            'device_code': row['device_code'],
+            'timestamp': row['timestamp'].isoformat(),
+            'temperature': row['temperature'],
+            'humidity': row['humidity'],
+            'brightness': row['brightness'],
+            'electric': row['electric'],
+        }
+
+    def _row(self, slot: int) -> dict:
+        def number(value):
+            return None if math.isnan(value) else value
+
+        row_id, brightness = self._ids[slot], self._brightness[slot]
+        return {
+            'id': None if row_id == _MISSING else row_id,
+            'timestamp': _EPOCH + datetime.timedelta(microseconds=self._timestamps[slot]),
+            'device_code': self._devices[slot],
+            'temperature': number(self._temperature[slot]),
+            'humidity': number(self._humidity[slot]),
+            'brightness': None if brightness == _MISSING else brightness,
+            'electric': number(self._electric[slot]),
+        }
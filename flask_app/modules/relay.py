@@ -0,0 +1,139 @@
+import json
+import time
+import logging
+import threading
+import uuid
+from typing import Callable, List, Union
+
+try:
+    import redis
+except ImportError:  # optional: only needed when workers share a redis:// message queue
+    redis = None
+
+
+class LocalRelay:
+    """Hands received readings to the handlers of this process.
+
+    The ingest path calls ``publish()`` with reading events; every handler
+    (recent readings store, broadcaster) runs in the caller's thread. This is
+    the single-process relay and the in-process stand-in for ``RedisRelay``.
+    """
+
+    def __init__(self):
+        self._handlers: List[Callable] = []
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, handler: Callable):
+        """Call ``handler(events)`` with every list of readings published by any worker."""
+        self._handlers.append(handler)
+
+    def publish(self, events: List[dict]):
+        if not events:
+            return
+        self.published += len(events)
+        self._deliver(events)
+
+    def start(self, start_background_task: Callable = None):
+        pass
+
+    def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {'backend': 'local', 'published': self.published, 'received': self.received}
+
+    def _deliver(self, events: List[dict]):
+        for handler in self._handlers:
+            try:
+                handler(events)
+            except Exception as e:
+                logging.error(f"Relayed readings handler failed: {e}", exc_info=True)
+
+
+class RedisRelay(LocalRelay):
+    """Relays readings between worker processes over a Redis pub/sub channel.
+
+    Published readings are handled locally right away and sent to the other
+    workers as one JSON message ``{"host_id", "readings": [...]}``; a
+    background task delivers the other workers' messages to the local
+    handlers. ``client`` is any object with redis-py's ``publish()`` and
+    ``pubsub()``, so tests can pass a stand-in.
+    """
+
+    def __init__(self, url: str = None, channel: str = 'flask-socketio-readings', client=None,
+                 retry_interval: float = 1.0):
+        super().__init__()
+        if client is None:
+            if redis is None:
+                raise RuntimeError("A redis:// message queue requires the 'redis' package")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.channel = channel
+        self.retry_interval = retry_interval
+        # Messages carry the sender so a worker skips its own readings
+        self.host_id = uuid.uuid4().hex
+        self.publish_errors = 0
+        self._running = False
+
+    def publish(self, events: List[dict]):
+        if not events:
+            return
+        super().publish(events)
+        try:
+            self.client.publish(self.channel, json.dumps({'host_id': self.host_id, 'readings': events}))
+        except Exception as e:
+            self.publish_errors += 1
+            logging.error(f"Failed to relay {len(events)} readings to other workers: {e}")
+
+    def start(self, start_background_task: Callable = None):
+        if self._running:
+            return
+        self._running = True
+        if start_background_task is None:
+            threading.Thread(target=self._listen, name='reading-relay', daemon=True).start()
+        else:
+            start_background_task(self._listen)
+        logging.info(f"Reading relay listening on Redis channel '{self.channel}'.")
+
+    def stop(self):
+        self._running = False
+
+    def stats(self) -> dict:
+        return dict(super().stats(), backend='redis', channel=self.channel, publish_errors=self.publish_errors)
+
+    def handle_message(self, data: Union[bytes, str]):
+        """Deliver one pub/sub message from another worker to the local handlers."""
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            logging.warning(f"Ignoring malformed relay message: {data!r}")
+            return
+        if not isinstance(message, dict) or message.get('host_id') == self.host_id:
+            return
+        events = message.get('readings') or []
+        self.received += len(events)
+        self._deliver(events)
+
+    def _listen(self):
+        while self._running:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if not self._running:
+                        break
+                    if message and message.get('type') == 'message':
+                        self.handle_message(message['data'])
+            except Exception as e:
+                logging.error(f"Reading relay lost its Redis subscription: {e}; retrying.")
+                time.sleep(self.retry_interval)
+
+
+def create_relay(url: Union[str, None] = None, channel: str = 'flask-socketio-readings') -> LocalRelay:
+    """Relay for the Socket.IO message queue ``url``; a ``LocalRelay`` when there is none."""
+    if not url:
+        return LocalRelay()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisRelay(url, channel=channel)
+    raise ValueError(f"Unsupported message queue '{url}' for relaying readings, expected redis:// or rediss://")
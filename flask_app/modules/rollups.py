@@ -0,0 +1,226 @@
+import datetime
+import struct
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Aggregated reading columns; each gets <metric>_count, _sum, _min and _max in the rollup tables
+METRICS = ('temperature', 'humidity', 'brightness', 'electric')
+# power_readings stores these as FLOAT, so rollups built from it see single-precision values
+_FLOAT_METRICS = ('temperature', 'humidity', 'electric')
+_FLOAT32 = struct.Struct('f')
+
+HOURLY_TABLE = 'power_rollup_hourly'
+DAILY_TABLE = 'power_rollup_daily'
+
+COLUMNS = ('bucket', 'device_code', 'readings', 'first_timestamp', 'last_timestamp') + tuple(
+    f'{metric}_{agg}' for metric in METRICS for agg in ('count', 'sum', 'min', 'max'))
+_VALUE_COLUMNS = COLUMNS[2:]
+
+
+# Rollup value columns and the aggregates over raw power_readings rows that produce them, in the same order
+VALUE_COLUMNS_SQL = ', '.join(_VALUE_COLUMNS)
+RAW_AGGREGATES_SQL = 'COUNT(*) AS readings, MIN(timestamp) AS first_timestamp, MAX(timestamp) AS last_timestamp, ' + ', '.join(
+    f'COUNT({m}) AS {m}_count, COALESCE(SUM({m}), 0) AS {m}_sum, MIN({m}) AS {m}_min, MAX({m}) AS {m}_max'
+    for m in METRICS)
+
+# Trend bucket sizes in seconds
+TREND_BUCKETS = {'1m': 60, '5m': 300, '15m': 900, '1h': 3600, '1d': 86400}
+# Rollup tables by bucket length, coarsest first
+_ROLLUP_GRANULARITY = ((86400, DAILY_TABLE), (3600, HOURLY_TABLE))
+_EPOCH = datetime.datetime(1970, 1, 1)
+_SECOND = datetime.timedelta(seconds=1)
+
+
+def _epoch_bucket(column: str, seconds: int) -> str:
+    # Integer seconds since a naive epoch: unlike UNIX_TIMESTAMP() it ignores the session time zone,
+    # and the range filter stays on the bare column so idx_timestamp still applies
+    return f"TIMESTAMPDIFF(SECOND, '1970-01-01', {column}) DIV {seconds} * {seconds}"
+
+
+def _least(column: str) -> str:
+    # LEAST/GREATEST return NULL if either side is NULL (a metric the bucket has not seen yet)
+    return f"{column} = LEAST(COALESCE({column}, VALUES({column})), COALESCE(VALUES({column}), {column}))"
+
+
+def _greatest(column: str) -> str:
+    return f"{column} = GREATEST(COALESCE({column}, VALUES({column})), COALESCE(VALUES({column}), {column}))"
+
+
+def _merge_clause() -> str:
+    updates = ['readings = readings + VALUES(readings)', _least('first_timestamp'), _greatest('last_timestamp')]
+    for metric in METRICS:
+        updates += [f'{metric}_count = {metric}_count + VALUES({metric}_count)',
+                    f'{metric}_sum = {metric}_sum + VALUES({metric}_sum)',
+                    _least(f'{metric}_min'), _greatest(f'{metric}_max')]
+    return ', '.join(updates)
+
+
+def _replace_clause() -> str:
+    return ', '.join(f'{column} = VALUES({column})' for column in _VALUE_COLUMNS)
+
+
+def merge_query(table: str) -> str:
+    """Upsert adding one delta row (see ``rollup_deltas``) to a bucket of ``table``."""
+    return (f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * len(COLUMNS))}) "
+            f"ON DUPLICATE KEY UPDATE {_merge_clause()}")
+
+
+def rebuild_hourly_query(by_device: bool = False) -> str:
+    """Recompute the hourly buckets of ``[start, end)`` (of one device) from power_readings.
+
+    Parameters: start, end[, device_code]. Ranges should start and end on the hour.
+    """
+    device_filter = ' AND device_code = %s' if by_device else ''
+    return (f"INSERT INTO {HOURLY_TABLE} ({', '.join(COLUMNS)}) "
+            f"SELECT DATE(timestamp) + INTERVAL HOUR(timestamp) HOUR AS hour_start, device_code, {RAW_AGGREGATES_SQL} "
+            f"FROM power_readings WHERE timestamp >= %s AND timestamp < %s{device_filter} "
+            f"GROUP BY hour_start, device_code "
+            f"ON DUPLICATE KEY UPDATE {_replace_clause()}")
+
+
+def rebuild_daily_query(by_device: bool = False) -> str:
+    """Recompute the daily buckets of ``[start, end)`` (of one device) from the hourly rollup.
+
+    Parameters: start, end[, device_code]. Ranges should start and end at midnight.
+    """
+    aggregates = ', '.join(f'SUM({m}_count), SUM({m}_sum), MIN({m}_min), MAX({m}_max)' for m in METRICS)
+    device_filter = ' AND device_code = %s' if by_device else ''
+    return (f"INSERT INTO {DAILY_TABLE} ({', '.join(COLUMNS)}) "
+            f"SELECT DATE(bucket) AS day, device_code, SUM(readings), "
+            f"MIN(first_timestamp), MAX(last_timestamp), {aggregates} "
+            f"FROM {HOURLY_TABLE} WHERE bucket >= %s AND bucket < %s{device_filter} "
+            f"GROUP BY day, device_code "
+            f"ON DUPLICATE KEY UPDATE {_replace_clause()}")
+
+
+def naive_utc(timestamp: datetime.datetime) -> datetime.datetime:
+    """``timestamp`` as a naive UTC datetime; naive values are taken to be UTC already.
+
+    Readings are stored as UTC wall-clock DATETIMEs, so device offsets are
+    applied before writing and query bounds are converted the same way.
+    """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def stored_timestamp(timestamp: datetime.datetime) -> datetime.datetime:
+    """The value a DATETIME column keeps: UTC wall-clock time, fractional seconds rounded."""
+    timestamp = naive_utc(timestamp)
+    if timestamp.microsecond:
+        rounded = timestamp.replace(microsecond=0)
+        return rounded + datetime.timedelta(seconds=1) if timestamp.microsecond >= 500000 else rounded
+    return timestamp
+
+
+def hour_start(timestamp: datetime.datetime) -> datetime.datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _stored_value(metric: str, value):
+    value = float(value)
+    if metric in _FLOAT_METRICS:
+        return _FLOAT32.unpack(_FLOAT32.pack(value))[0]
+    return round(value)
+
+
+def rollup_deltas(rows: Iterable[Tuple]) -> Tuple[List[tuple], List[tuple]]:
+    """Hourly and daily delta rows (in ``COLUMNS`` order) for newly inserted reading rows.
+
+    ``rows`` are ``(timestamp, device_code, temperature, humidity, brightness, electric)``
+    with parsed timestamps, as passed to ``Database.insert_readings``.
+    """
+    hourly: Dict[tuple, list] = {}
+    daily: Dict[tuple, list] = {}
+    for timestamp, device_code, *values in rows:
+        timestamp = stored_timestamp(timestamp)
+        device_code = str(device_code)
+        for buckets, key in ((hourly, (hour_start(timestamp), device_code)),
+                             (daily, (timestamp.date(), device_code))):
+            delta = buckets.get(key)
+            if delta is None:
+                delta = buckets[key] = [0, timestamp, timestamp] + [0, 0.0, None, None] * len(METRICS)
+            delta[0] += 1
+            delta[1] = min(delta[1], timestamp)
+            delta[2] = max(delta[2], timestamp)
+            for i, (metric, value) in enumerate(zip(METRICS, values)):
+                if value is None:
+                    continue
+                value = _stored_value(metric, value)
+                offset = 3 + 4 * i
+                delta[offset] += 1
+                delta[offset + 1] += value
+                delta[offset + 2] = value if delta[offset + 2] is None else min(delta[offset + 2], value)
+                delta[offset + 3] = value if delta[offset + 3] is None else max(delta[offset + 3], value)
+    return ([key + tuple(delta) for key, delta in hourly.items()],
+            [key + tuple(delta) for key, delta in daily.items()])
+
+
+def affected_buckets(rows: Iterable[Tuple]) -> Tuple[Set[tuple], Set[tuple]]:
+    """``(hour_start, device_code)`` and ``(day, device_code)`` pairs touched by reading ``rows``."""
+    hours, days = set(), set()
+    for timestamp, device_code, *_ in rows:
+        timestamp = stored_timestamp(timestamp)
+        hours.add((hour_start(timestamp), str(device_code)))
+        days.add((timestamp.date(), str(device_code)))
+    return hours, days
+
+
+def epoch_seconds(timestamp: datetime.datetime) -> int:
+    return (timestamp - _EPOCH) // _SECOND
+
+
+def from_epoch_seconds(seconds: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def trend_segments(start: datetime.datetime, end: datetime.datetime, bucket_seconds: int,
+                   _granularity=None) -> List[tuple]:
+    """Split ``[start, end)`` into ``(table, start, end)`` pieces to aggregate trend buckets from.
+
+    Whole days and hours are read from the daily and hourly rollups when the bucket
+    length is a multiple of theirs; the ragged edges fall back to power_readings
+    (``table`` None).
+    """
+    if _granularity is None:
+        _granularity = [(g, table) for g, table in _ROLLUP_GRANULARITY if bucket_seconds % g == 0]
+    for i, (granularity, table) in enumerate(_granularity):
+        inner_start = -(-epoch_seconds(start) // granularity) * granularity
+        if start > from_epoch_seconds(inner_start):
+            inner_start += granularity
+        inner_end = epoch_seconds(end) // granularity * granularity
+        if inner_start < inner_end:
+            inner_start, inner_end = from_epoch_seconds(inner_start), from_epoch_seconds(inner_end)
+            finer = _granularity[i + 1:]
+            return (trend_segments(start, inner_start, bucket_seconds, finer)
+                    + [(table, inner_start, inner_end)]
+                    + trend_segments(inner_end, end, bucket_seconds, finer))
+    return [(None, start, end)] if start < end else []
+
+
+def trend_query(start: datetime.datetime, end: datetime.datetime, bucket_seconds: int,
+                device_code: str = None) -> Tuple[str, list]:
+    """Query and parameters aggregating a non-empty ``[start, end)`` into epoch-aligned buckets.
+
+    Rows carry ``bucket_epoch`` (bucket start in epoch seconds), ``readings_count``,
+    the metric averages, ``total_electric`` and the electric extremes.
+    """
+    parts, params = [], []
+    device_filter = ' AND device_code = %s' if device_code is not None else ''
+    for table, segment_start, segment_end in trend_segments(start, end, bucket_seconds):
+        if table is None:
+            parts.append(f"SELECT {_epoch_bucket('timestamp', bucket_seconds)} AS bucket_epoch, {RAW_AGGREGATES_SQL} "
+                         f"FROM power_readings WHERE timestamp >= %s AND timestamp < %s{device_filter} "
+                         f"GROUP BY bucket_epoch")
+        else:
+            if table == DAILY_TABLE:
+                segment_start, segment_end = segment_start.date(), segment_end.date()
+            parts.append(f"SELECT {_epoch_bucket('bucket', bucket_seconds)} AS bucket_epoch, {VALUE_COLUMNS_SQL} "
+                         f"FROM {table} WHERE bucket >= %s AND bucket < %s{device_filter}")
+        params += [segment_start, segment_end] + ([device_code] if device_code is not None else [])
+    averages = ', '.join(f'SUM({m}_sum) / NULLIF(SUM({m}_count), 0) AS avg_{m}' for m in METRICS)
+    query = (f"SELECT bucket_epoch, SUM(readings) AS readings_count, {averages}, "
+             f"SUM(electric_sum) AS total_electric, MIN(electric_min) AS min_electric, "
+             f"MAX(electric_max) AS max_electric "
+             f"FROM ({' UNION ALL '.join(parts)}) buckets "
+             f"GROUP BY bucket_epoch ORDER BY bucket_epoch")
+    return query, params
@@ -0,0 +1,63 @@
+from typing import List, Union
+
+from modules.codecs import to_epoch_ms
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed when a client asks for msgpack frames
+    msgpack = None
+
+# Wire formats a Socket.IO client can pick at connect time with auth {"format": ...}
+FORMATS = ('json', 'msgpack')
+# Event fields sent as epoch milliseconds in msgpack frames
+TIME_FIELDS = ('timestamp', 'server_time')
+# Columns of a msgpack 'readings_batch' frame, in event field order
+BATCH_COLUMNS = ('seq', 'device_code', 'timestamp', 'temperature', 'humidity', 'brightness', 'electric')
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown Socket.IO format '{fmt}', expected one of {list(FORMATS)}")
+    if fmt == 'msgpack' and msgpack is None:
+        raise ValueError("The msgpack Socket.IO format requires the 'msgpack' package")
+    return fmt
+
+
+def _epoch_ms(value):
+    if value is None:
+        return None
+    try:
+        return to_epoch_ms(value)
+    except (TypeError, ValueError):
+        # Device timestamps are passed through as received; keep what cannot be parsed
+        return value
+
+
+def encode_event(data: dict, fmt: str = 'json') -> Union[dict, bytes]:
+    """Payload of a single event in ``fmt``.
+
+    JSON clients get ``data`` unchanged. msgpack clients get one binary
+    attachment with timestamps as epoch milliseconds and floats packed as
+    float32 (the precision of the power_readings FLOAT columns).
+    """
+    if fmt == 'json':
+        return data
+    return msgpack.packb({key: _epoch_ms(value) if key in TIME_FIELDS else value
+                          for key, value in data.items()}, use_single_float=True)
+
+
+def encode_batch(events: List[dict], fmt: str = 'json', **fields) -> Union[dict, bytes]:
+    """Payload of a multi-reading frame ('readings_batch', 'resume') in ``fmt``.
+
+    JSON frames are ``{"count", "readings": [...]}``; msgpack frames are
+    columnar, ``{"count", "seq": [...], "device_code": [...], ...}``, so
+    field names are sent once per frame instead of once per reading.
+    ``fields`` are added to the top level of the frame.
+    """
+    if fmt == 'json':
+        return {**fields, 'count': len(events), 'readings': events}
+    frame = {**fields, 'count': len(events)}
+    for column in BATCH_COLUMNS:
+        values = [event.get(column) for event in events]
+        frame[column] = [_epoch_ms(v) for v in values] if column in TIME_FIELDS else values
+    return msgpack.packb(frame, use_single_float=True)
@@ -0,0 +1,255 @@
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+import logging
+from typing import Callable, List, Tuple, Union
+
+from modules.database import is_data_error
+
+SEGMENT_PATTERN = 'spool-*.log'
+# Rows MySQL refused to store, kept for inspection instead of blocking replay
+QUARANTINE_FILE = 'quarantine.log'
+
+
+class Spool:
+    """Durable append-only spool of reading rows for when MySQL cannot keep up.
+
+    Rows are stored as JSON lines in numbered segment files under ``directory``.
+    Each ``append()`` writes a whole batch with one write and one fsync, and the
+    active segment is sealed once it grows past ``segment_bytes``. Segments are
+    replayed oldest first and deleted after they have been committed to MySQL.
+    Rows MySQL will never accept are moved to ``quarantine.log`` during replay.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._file = None
+        segments = self._segments()
+        self._next_seq = self._seq(segments[-1]) + 1 if segments else 1
+        # Rows left over from a previous run are counted so the metric is right after a restart
+        self.pending_rows = sum(self._count_rows(path) for path in segments)
+        self.rows_appended = 0
+        self.rows_replayed = 0
+        self.rows_quarantined = 0
+
+    def append(self, rows: List[Tuple]) -> None:
+        """Durably append ``(timestamp, device_code, temperature, humidity, brightness, electric)`` rows."""
+        if not rows:
+            return
+        data = self._encode(rows)
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.pending_rows += len(rows)
+            self.rows_appended += len(rows)
+            if self._file.tell() >= self.segment_bytes:
+                self._seal()
+
+    def replay(self, insert: Callable[[List[Tuple]], int], chunk_size: int = 1000,
+               is_bad_row: Union[Callable[[BaseException], bool], None] = None) -> int:
+        """Feed spooled rows to ``insert`` in chunks, oldest segment first.
+
+        The active segment is sealed first so everything spooled so far is
+        included. A segment is deleted only after all of its chunks were
+        inserted; if ``insert`` raises, replay stops and the segment is kept.
+        Inserts must therefore be idempotent. Returns the number of rows replayed.
+
+        With ``is_bad_row``, a chunk failing with an error it accepts is retried
+        row by row and the rows that fail again that way are quarantined, so one
+        unstorable reading cannot hold back the rest of the spool.
+        """
+        with self._lock:
+            self._seal()
+            segments = self._segments()
+
+        replayed = 0
+        for path in segments:
+            rows = self._read_rows(path)
+            rejected = []
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                try:
+                    insert(chunk)
+                except Exception as e:
+                    if is_bad_row is None or not is_bad_row(e):
+                        raise
+                    logging.warning(f"Spooled chunk from {os.path.basename(path)} was refused ({e}); "
+                                    "retrying its rows one by one")
+                    rejected.extend(self._insert_each(insert, chunk, is_bad_row))
+            if rejected:
+                self.quarantine(rejected)
+            os.remove(path)
+            with self._lock:
+                self.pending_rows = max(self.pending_rows - len(rows), 0)
+                self.rows_replayed += len(rows) - len(rejected)
+            replayed += len(rows) - len(rejected)
+            logging.info(f"Replayed {len(rows) - len(rejected)} spooled readings from {os.path.basename(path)}")
+        return replayed
+
+    def quarantine(self, rows: List[Tuple]) -> None:
+        """Durably set aside rows that can never be inserted, in the spool record format."""
+        if not rows:
+            return
+        data = self._encode(rows)
+        with self._lock:
+            with open(os.path.join(self.directory, QUARANTINE_FILE), 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.rows_quarantined += len(rows)
+        logging.error(f"Quarantined {len(rows)} readings MySQL refused to store in "
+                      f"{os.path.join(self.directory, QUARANTINE_FILE)}")
+
+    @staticmethod
+    def _insert_each(insert, rows: List[Tuple], is_bad_row) -> List[Tuple]:
+        # Errors other than bad rows (MySQL went away) stop the replay as usual
+        rejected = []
+        for row in rows:
+            try:
+                insert([row])
+            except Exception as e:
+                if not is_bad_row(e):
+                    raise
+                rejected.append(row)
+        return rejected
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        segments = self._segments()
+        return {
+            'segments': len(segments),
+            'bytes': sum(os.path.getsize(path) for path in segments),
+            'pending_rows': self.pending_rows,
+            'rows_appended': self.rows_appended,
+            'rows_replayed': self.rows_replayed,
+            'rows_quarantined': self.rows_quarantined,
+        }
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)), key=self._seq)
+
+    @staticmethod
+    def _seq(path: str) -> int:
+        return int(os.path.basename(path)[len('spool-'):-len('.log')])
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f'spool-{self._next_seq:08d}.log')
+        self._next_seq += 1
+        self._file = open(path, 'ab')
+
+    def _seal(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def _encode(rows: List[Tuple]) -> bytes:
+        return ''.join(
+            json.dumps([ts.isoformat() if isinstance(ts, datetime.datetime) else ts, *rest]) + '\n'
+            for ts, *rest in rows
+        ).encode('utf-8')
+
+    @staticmethod
+    def _count_rows(path: str) -> int:
+        with open(path, 'rb') as f:
+            return sum(1 for _ in f)
+
+    @staticmethod
+    def _read_rows(path: str) -> List[Tuple]:
+        rows = []
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    ts, *rest = json.loads(line)
+                except ValueError:
+                    # A crash can leave a torn last line; it was never acknowledged
+                    logging.warning(f"Skipping unreadable spool record in {os.path.basename(path)}")
+                    continue
+                rows.append((datetime.datetime.fromisoformat(ts), *rest))
+        return rows
+
+
+class SpoolReplayer:
+    """Background thread that drains the spool into MySQL once it is reachable again.
+
+    ``connect`` creates a Database when the writer started without one (MySQL
+    was down at startup). When the spool is empty the writer is switched back
+    to writing to MySQL directly.
+    """
+
+    def __init__(self, spool: Spool, writer, connect: Union[Callable, None] = None, interval: float = 5.0):
+        self.spool = spool
+        self.writer = writer
+        self.connect = connect
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='spool-replayer', daemon=True)
+        self._thread.start()
+        logging.info(f"Spool replayer started for {self.spool.directory}.")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def replay_once(self) -> int:
+        """Try to drain the spool now. Returns the number of rows replayed."""
+        if self.writer.db is None:
+            if self.connect is None:
+                return 0
+            try:
+                self.writer.db = self.connect()
+                logging.info("Database became available; replaying spool.")
+            except Exception as e:
+                logging.debug(f"Database still unavailable: {e}")
+                return 0
+
+        if not self.writer.degraded and not self.spool.pending_rows:
+            return 0
+        if not self.writer.db.ping():
+            return 0
+
+        def insert(rows):
+            return self.writer.db.insert_readings(rows, ignore_duplicates=True)
+
+        def drain():
+            return self.spool.replay(insert, self.writer.max_batch_size, is_data_error)
+
+        try:
+            started = time.monotonic()
+            replayed = drain()
+            # The writer blocks flushes while the tail is drained, then writes to MySQL again
+            replayed += self.writer.resume_direct_writes(drain)
+        except Exception as e:
+            logging.warning(f"Spool replay interrupted, will retry: {e}")
+            return 0
+        if replayed:
+            logging.info(f"Spool drained ({replayed} readings in {time.monotonic() - started:.1f}s); "
+                         "writing to MySQL directly again.")
+        return replayed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.replay_once()
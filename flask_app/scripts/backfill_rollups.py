@@ -0,0 +1,55 @@
+"""Build the hourly and daily rollup tables from existing power_readings history.
+
+Recomputes whole days in chunks, so it is safe to re-run and to run while
+readings are being ingested. The usual MYSQL_* settings apply.
+
+Examples (from flask_app/):
+    python scripts/backfill_rollups.py
+    python scripts/backfill_rollups.py --since 2024-01-01 --until 2024-02-01 --chunk-days 7
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules.database import Database  # noqa: E402
+
+
+def parse_date(value):
+    return datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--since', type=parse_date, help='first day (YYYY-MM-DD); default: oldest reading')
+    parser.add_argument('--until', type=parse_date, help='day after the last one; default: after the newest reading')
+    parser.add_argument('--chunk-days', type=int, default=1, help='days recomputed per transaction')
+    args = parser.parse_args()
+
+    db = Database(pool_size=1)
+    oldest, newest = db.fetch_reading_time_range()
+    if oldest is None:
+        print("No readings to roll up.")
+        return
+    start = (args.since or oldest).replace(hour=0, minute=0, second=0, microsecond=0)
+    end = args.until or newest.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+    chunk = datetime.timedelta(days=max(args.chunk_days, 1))
+
+    started = time.monotonic()
+    hourly_total = daily_total = 0
+    while start < end:
+        chunk_end = min(start + chunk, end)
+        hourly, daily = db.rebuild_rollups(start, chunk_end)
+        hourly_total += hourly
+        daily_total += daily
+        print(f"{start:%Y-%m-%d} .. {chunk_end:%Y-%m-%d}: {hourly} hourly / {daily} daily rows")
+        start = chunk_end
+    # ON DUPLICATE KEY UPDATE counts a changed row twice, so these are upper bounds
+    print(f"Done in {time.monotonic() - started:.1f}s ({hourly_total} hourly / {daily_total} daily rows affected).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Microbenchmark: encoding a 1000-row /api/power_data response, old path vs modules.encoder.
+
+The old path built a dict per row, ran json_serializer on every value and let
+jsonify encode the result again. The encoder turns cursor tuples into JSON
+bytes in one pass, with orjson when it is installed. "rows, spliced" encodes
+each column once and formats the values into a row-object template without
+building dicts; it is kept to show why row_objects still builds them.
+
+Usage (from flask_app/):
+    python scripts/bench_api_encoding.py [--rows 1000] [--repeat 5]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import timeit
+from decimal import Decimal
+
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules import encoder  # noqa: E402
+from modules.api import POWER_DATA_FIELDS  # noqa: E402
+
+
+def json_serializer(obj):
+    # The per-value helper modules/api.py used before the encoder
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (int, float, str, type(None))):
+        return obj
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+def make_rows(count):
+    start = datetime.datetime(2024, 1, 1)
+    return [(i, start + datetime.timedelta(seconds=5 * i), f'AA:BB:CC:DD:EE:{i % 50:02X}',
+             round(random.uniform(18, 30), 2), round(random.uniform(30, 70), 2),
+             random.randint(0, 1000), round(random.uniform(0, 2000), 2))
+            for i in range(count)]
+
+
+def old_path(rows):
+    # fetch_power_data(dictionary=True) rows, serialized value by value, then jsonify
+    dict_rows = [dict(zip(POWER_DATA_FIELDS, row)) for row in rows]
+    return jsonify([{k: json_serializer(v) for k, v in row.items()} for row in dict_rows]).get_data()
+
+
+def encoder_rows(rows):
+    return encoder.json_response(encoder.row_objects(POWER_DATA_FIELDS, rows)).get_data()
+
+
+def spliced_rows(rows):
+    # Row objects without dicts: each column encoded once, values formatted into a per-row template
+    template = b'{' + b','.join(encoder.dumps(field) + b':%s' for field in POWER_DATA_FIELDS) + b'}'
+    encoded = []
+    for values in zip(*rows):
+        if any(isinstance(value, str) for value in values):
+            # Strings may hold commas, so they cannot be split out of an encoded array
+            encoded.append([encoder.dumps(value) for value in values])
+        else:
+            encoded.append(encoder.dumps(values)[1:-1].split(b','))
+    body = b','.join([template] * len(rows)) % tuple(value for row in zip(*encoded) for value in row)
+    return encoder.Response(b'[' + body + b']', mimetype='application/json').get_data()
+
+
+def encoder_columnar(rows):
+    return encoder.json_response(encoder.columns(POWER_DATA_FIELDS, rows)).get_data()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000, help='rows per response')
+    parser.add_argument('--repeat', type=int, default=5, help='timing rounds, best is reported')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    backend = encoder.orjson
+    variants = [('old (json_serializer + jsonify)', old_path, backend),
+                ('encoder rows, stdlib json', encoder_rows, None),
+                ('encoder columnar, stdlib json', encoder_columnar, None)]
+    if backend is not None:
+        variants += [('encoder rows, orjson', encoder_rows, backend),
+                     ('rows, spliced, orjson', spliced_rows, backend),
+                     ('encoder columnar, orjson', encoder_columnar, backend)]
+
+    with Flask(__name__).app_context():
+        print(f"{'path':<34}{'bytes':>10}{'ms/response':>14}{'speedup':>10}")
+        baseline = None
+        for name, encode, json_backend in variants:
+            encoder.orjson = json_backend
+            number = 20
+            best = min(timeit.repeat(lambda: encode(rows), number=number, repeat=args.repeat)) / number
+            baseline = baseline or best
+            print(f"{name:<34}{len(encode(rows)):>10}{best * 1000:>14.2f}{baseline / best:>9.1f}x")
+        encoder.orjson = backend
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Microbenchmark: decode cost per reading for each MQTT payload codec.
+
+Each measurement covers what the ingest path does per message: decode the
+payload and turn the timestamp into a datetime for the INSERT.
+
+Usage (from flask_app/):
+    python scripts/bench_codecs.py [--batch-size 60] [--repeat 5]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules.codecs import CODECS  # noqa: E402
+from modules.database import parse_timestamp  # noqa: E402
+from modules.readings import Reading  # noqa: E402
+
+
+def make_readings(count):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    return [
+        Reading(
+            'aa:bb:cc:dd:ee:%02x' % (i % 256),
+            (start + datetime.timedelta(seconds=5 * i)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            round(random.uniform(22, 28), 1),
+            round(random.uniform(40, 60), 1),
+            random.randint(400, 900),
+            round(random.uniform(800, 1500), 1),
+        )
+        for i in range(count)
+    ]
+
+
+def decode_and_parse(codec, payload, batch):
+    for reading in codec.decode(payload, batch):
+        parse_timestamp(reading.timestamp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=60, help='readings per batch payload')
+    parser.add_argument('--repeat', type=int, default=5, help='timing rounds, best is reported')
+    args = parser.parse_args()
+
+    readings = make_readings(args.batch_size)
+    print(f"{'codec':<10}{'mode':<8}{'bytes/reading':>15}{'ns/reading':>14}")
+    for name, codec_cls in CODECS.items():
+        try:
+            codec = codec_cls()
+        except RuntimeError as e:
+            print(f"{name:<10}skipped: {e}")
+            continue
+        for batch in (False, True):
+            sample = readings if batch else readings[:1]
+            payload = codec.encode(sample, batch=batch)
+            number = max(1, 20000 // len(sample))
+            best = min(timeit.repeat(lambda: decode_and_parse(codec, payload, batch),
+                                     number=number, repeat=args.repeat))
+            per_reading_ns = best / (number * len(sample)) * 1e9
+            print(f"{name:<10}{'batch' if batch else 'single':<8}"
+                  f"{len(payload) / len(sample):>15.1f}{per_reading_ns:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Microbenchmark: Socket.IO bytes and encode time per reading for each client format.
+
+Each measurement covers what the server does per frame: build the payload
+for the client's format and encode the Socket.IO packet that goes on the
+wire ('reading' events one by one, or one 'readings_batch' frame).
+
+Usage (from flask_app/):
+    python scripts/bench_socket_payloads.py [--batch-size 60] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+from socketio import packet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scripts.bench_codecs import make_readings  # noqa: E402
+from modules.socket_format import FORMATS, check_format, encode_batch, encode_event  # noqa: E402
+
+
+def wire_bytes(encoded) -> int:
+    # Binary packets encode to a text header followed by the binary attachments
+    parts = encoded if isinstance(encoded, list) else [encoded]
+    return sum(len(p.encode('utf-8') if isinstance(p, str) else p) for p in parts)
+
+
+def encode_frames(events, fmt, batch):
+    if batch:
+        return [packet.Packet(packet.EVENT, data=['readings_batch', encode_batch(events, fmt)]).encode()]
+    return [packet.Packet(packet.EVENT, data=['reading', encode_event(e, fmt)]).encode() for e in events]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=60, help='readings per readings_batch frame')
+    parser.add_argument('--repeat', type=int, default=5, help='timing rounds, best is reported')
+    args = parser.parse_args()
+
+    events = [r.to_event() for r in make_readings(args.batch_size)]
+    print(f"{'format':<10}{'mode':<8}{'bytes/reading':>15}{'ns/reading':>14}")
+    for fmt in FORMATS:
+        try:
+            check_format(fmt)
+        except ValueError as e:
+            print(f"{fmt:<10}skipped: {e}")
+            continue
+        for batch in (False, True):
+            frames = encode_frames(events, fmt, batch)
+            number = max(1, 20000 // len(events))
+            best = min(timeit.repeat(lambda: encode_frames(events, fmt, batch),
+                                     number=number, repeat=args.repeat))
+            per_reading_ns = best / (number * len(events)) * 1e9
+            size = sum(wire_bytes(f) for f in frames)
+            print(f"{fmt:<10}{'batch' if batch else 'single':<8}"
+                  f"{size / len(events):>15.1f}{per_reading_ns:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Export power_readings as NDJSON, CSV or Parquet without loading them into memory.
+
+Rows are streamed from MySQL with an unbuffered cursor and written chunk by
+chunk, oldest first. The usual MYSQL_* settings apply.
+
+Examples (from flask_app/):
+    python scripts/export_readings.py --since 2024-01-01 --until 2025-01-01 > readings.ndjson
+    python scripts/export_readings.py --format parquet --device AA:BB:CC:DD:EE:FF --output device.parquet
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules.database import Database  # noqa: E402
+from modules.export import FORMATS, check_format, export_chunks  # noqa: E402
+
+
+def parse_date(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+    parser.add_argument('--output', help='file to write; default: stdout')
+    parser.add_argument('--device', help='only this device_code')
+    parser.add_argument('--since', type=parse_date, help='first timestamp (ISO 8601, inclusive)')
+    parser.add_argument('--until', type=parse_date, help='last timestamp (ISO 8601, exclusive)')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='rows fetched and written at a time')
+    args = parser.parse_args()
+    try:
+        check_format(args.format)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.format == 'parquet' and not args.output and sys.stdout.isatty():
+        parser.error('refusing to write Parquet to a terminal; use --output')
+
+    db = Database(pool_size=1)
+    chunks = db.iter_readings(device_code=args.device, start=args.since, end=args.until,
+                              chunk_size=max(args.chunk_size, 1))
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    started = time.monotonic()
+    written = 0
+    try:
+        for data in export_chunks(args.format, chunks):
+            out.write(data)
+            written += len(data)
+    finally:
+        if args.output:
+            out.close()
+    print(f"Wrote {written} bytes in {time.monotonic() - started:.1f}s.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Synthetic device fleet load generator for capacity planning.
+
+Simulates many devices over a few persistent MQTT connections. Every device
+produces a reading each --interval seconds (with --jitter), optionally sped up
+by --burst-factor for --burst-length seconds every --burst-every seconds.
+Messages embed a 'sentAt' epoch-ms send time (json/msgpack), so the ingest
+side reports end-to-end latency percentiles under /api/metrics.
+
+Examples (from flask_app/):
+    # 2000 devices, one reading every 5 s each (~400 msg/s), over 4 connections
+    python scripts/load_generator.py --devices 2000 --interval 5 --connections 4
+
+    # gateways sending 30-reading batches, 10x bursts for 10 s every minute
+    python scripts/load_generator.py --devices 5000 --format batch --batch-size 30 \\
+        --burst-every 60 --burst-length 10 --burst-factor 10
+"""
+import argparse
+import datetime
+import heapq
+import itertools
+import os
+import random
+import sys
+import time
+
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules.codecs import CODECS  # noqa: E402
+from modules.readings import Reading  # noqa: E402
+
+DEFAULT_TOPICS = {'single': 'power/measurement', 'batch': 'power/measurement/batch'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=os.getenv('MQTT_BROKER_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('MQTT_PORT', 1883)))
+    parser.add_argument('--devices', type=int, default=1000, help='number of simulated devices')
+    parser.add_argument('--connections', type=int, default=1, help='persistent MQTT connections to spread devices over')
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between readings of one device')
+    parser.add_argument('--rate', type=float, help='total readings per second (overrides --interval)')
+    parser.add_argument('--jitter', type=float, default=0.1, help='random +/- fraction applied to each interval')
+    parser.add_argument('--burst-every', type=float, default=0, help='seconds between bursts (0 = no bursts)')
+    parser.add_argument('--burst-length', type=float, default=5, help='duration of a burst in seconds')
+    parser.add_argument('--burst-factor', type=float, default=10, help='rate multiplier during a burst')
+    parser.add_argument('--format', choices=['single', 'batch'], default='single',
+                        help='one reading per message, or per-device batches')
+    parser.add_argument('--batch-size', type=int, default=30, help='readings per batch message')
+    parser.add_argument('--codec', choices=list(CODECS), default='json')
+    parser.add_argument('--topic', help='defaults to power/measurement or power/measurement/batch')
+    parser.add_argument('--qos', type=int, choices=[0, 1], default=0)
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run (0 = until interrupted)')
+    parser.add_argument('--report-every', type=float, default=5, help='seconds between progress lines')
+    args = parser.parse_args()
+    if args.rate:
+        args.interval = args.devices / args.rate
+    return args
+
+
+def connect_clients(args):
+    clients = []
+    for i in range(args.connections):
+        client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                             client_id=f'loadgen-{os.getpid()}-{i}')
+        client.max_queued_messages_set(0)
+        client.connect(args.host, args.port, 60)
+        client.loop_start()
+        clients.append(client)
+    return clients
+
+
+def make_reading(device_code, now):
+    return Reading(
+        device_code,
+        now.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        round(random.uniform(22, 28), 1),
+        round(random.uniform(40, 60), 1),
+        random.randint(400, 900),
+        round(random.uniform(800, 1500), 1),
+    )
+
+
+def in_burst(args, elapsed):
+    return args.burst_every > 0 and elapsed % args.burst_every < args.burst_length
+
+
+def main():
+    args = parse_args()
+    codec = CODECS[args.codec]()
+    topic = args.topic or DEFAULT_TOPICS[args.format]
+    batch = args.format == 'batch'
+    clients = connect_clients(args)
+    print(f"{args.devices} devices over {len(clients)} connection(s) -> {topic} "
+          f"({args.codec}, {args.format}, ~{args.devices / args.interval:.0f} readings/s)")
+
+    devices = [f'sim-{i:06d}' for i in range(args.devices)]
+    buffers = {device: [] for device in devices}
+    # Spread first readings over one interval so devices do not fire in lockstep
+    started = time.monotonic()
+    schedule = [(started + random.uniform(0, args.interval), i) for i in range(args.devices)]
+    heapq.heapify(schedule)
+    round_robin = itertools.cycle(clients)
+
+    sent_messages = sent_readings = 0
+    last_report, last_messages = started, 0
+    try:
+        while True:
+            now = time.monotonic()
+            if args.duration and now - started >= args.duration:
+                break
+            due, index = schedule[0]
+            if due > now:
+                time.sleep(min(due - now, 0.05))
+                continue
+
+            device = devices[index]
+            reading = make_reading(device, datetime.datetime.now(datetime.timezone.utc))
+            buffers[device].append(reading)
+            if not batch or len(buffers[device]) >= args.batch_size:
+                payload = codec.encode(buffers[device], batch=batch, sent_at=int(time.time() * 1000))
+                next(round_robin).publish(topic, payload, qos=args.qos)
+                sent_messages += 1
+                sent_readings += len(buffers[device])
+                buffers[device] = []
+
+            interval = args.interval / (args.burst_factor if in_burst(args, now - started) else 1)
+            interval *= 1 + random.uniform(-args.jitter, args.jitter)
+            heapq.heapreplace(schedule, (due + interval, index))
+
+            if now - last_report >= args.report_every:
+                rate = (sent_messages - last_messages) / (now - last_report)
+                print(f"[{now - started:7.1f}s] {sent_messages} messages, {sent_readings} readings, "
+                      f"{rate:.0f} msg/s{' (burst)' if in_burst(args, now - started) else ''}")
+                last_report, last_messages = now, sent_messages
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for client in clients:
+            client.loop_stop()
+            client.disconnect()
+
+    elapsed = time.monotonic() - started
+    print(f"Sent {sent_messages} messages / {sent_readings} readings in {elapsed:.1f}s "
+          f"({sent_messages / elapsed:.0f} msg/s). See /api/metrics for end-to-end latency.")
+
+
+if __name__ == '__main__':
+    main()
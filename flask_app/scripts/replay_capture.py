@@ -0,0 +1,112 @@
+"""Replay a recorded MQTT capture for reproducible ingest benchmarks.
+
+Captures are written by the flask_app tap mode (MQTT_TAP_PATH). Targets:
+
+    callback  call on_message_callback directly (DB + Socket.IO path, no broker)
+    pipeline  submit to the ingest pipeline (queue + workers + DB + Socket.IO)
+    broker    republish to an MQTT broker, for a running flask_app
+
+The callback and pipeline targets import app.py, so the usual MYSQL_* settings apply.
+
+Examples (from flask_app/):
+    python scripts/replay_capture.py capture.bin.gz --target pipeline --speed max
+    python scripts/replay_capture.py capture.bin.gz --target broker --speed 10
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules.capture import read_capture, replay  # noqa: E402
+
+
+def parse_speed(value):
+    if value == 'max':
+        return None
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError('speed must be positive or "max"')
+    return speed
+
+
+def start_fan_out(app):
+    """Run the relay and drain the broadcaster every window, as app.py does when serving.
+
+    No Socket.IO client connects during a replay, but the broadcaster still
+    receives every reading; left unflushed its inbox would grow for the whole
+    run and skew the numbers. Returns a function that stops the flush loop.
+    """
+    app.reading_relay.start()
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(app.broadcaster.window):
+            app.broadcaster.flush()
+
+    threading.Thread(target=run, name='broadcaster', daemon=True).start()
+
+    def stop_fan_out():
+        stop.set()
+        app.broadcaster.flush()
+    return stop_fan_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', help='capture file recorded by MQTT_TAP_PATH')
+    parser.add_argument('--target', choices=['callback', 'pipeline', 'broker'], default='pipeline')
+    parser.add_argument('--speed', type=parse_speed, default=1.0, help='1, 10 (or 10x), or max')
+    parser.add_argument('--host', default=os.getenv('MQTT_BROKER_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('MQTT_PORT', 1883)))
+    parser.add_argument('--qos', type=int, choices=[0, 1], default=0)
+    args = parser.parse_args()
+
+    if args.target == 'broker':
+        import paho.mqtt.client as mqtt
+        client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                             client_id=f'replay-{os.getpid()}')
+        client.connect(args.host, args.port, 60)
+        client.loop_start()
+
+        def sink(topic, payload):
+            client.publish(topic, payload, qos=args.qos)
+
+        def finish():
+            client.loop_stop()
+            client.disconnect()
+    else:
+        import app
+        if app.ingest_writer is None:
+            sys.exit("Neither the database nor a spool is available; check the MYSQL_* settings.")
+        app.ingest_writer.start()
+        stop_fan_out = start_fan_out(app)
+        if args.target == 'pipeline' and app.ingest_pipeline is not None:
+            app.ingest_pipeline.start()
+
+            def sink(topic, payload):
+                app.ingest_pipeline.submit(payload, topic)
+        else:
+            def sink(topic, payload):
+                app.on_message_callback(payload, topic)
+
+        def finish():
+            # Drains the pipeline, flushes the writer and stops the relay
+            app.shutdown()
+            stop_fan_out()
+            print('Writer:', app.ingest_writer.stats())
+            print('Broadcaster:', app.broadcaster.stats())
+            if args.target == 'pipeline' and app.ingest_pipeline is not None:
+                print('Pipeline:', app.ingest_pipeline.stats())
+
+    started = time.monotonic()
+    count = replay(read_capture(args.capture), sink, speed=args.speed)
+    finish()
+    elapsed = time.monotonic() - started
+    print(f"Replayed {count} messages to {args.target} in {elapsed:.2f}s ({count / elapsed:.0f} msg/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,8 @@ def mock_db():
 
     # tests/test_api.py mock_db fixture 안에 아래 라인 추가
     db.create_esg_report.return_value = (1, "/dummy.csv")
+    db.get_data_version.return_value = (42, datetime.datetime(2024, 1, 1, 12, 0, 0))
+    db.get_report_version.return_value = ("1.1", datetime.datetime(2024, 1, 1, 9, 0, 0))
     return db
 
 @pytest.fixture
@@ -47,29 +49,242 @@ def test_get_power_data_success(client, mock_db):
     assert len(data) == 2
     
     # Check that the mock function was called with the correct limit
-    mock_db.fetch_power_data.assert_called_once_with(limit=2)
+    mock_db.fetch_power_data.assert_called_once_with(limit=2, raw=True)
     
     # Check if the data matches (ignoring timestamp precision)
     assert data[0]['temperature'] == 25.5
 
+def test_get_power_data_served_from_recent_store(mock_db):
+    """Requests the recent readings store can cover do not query MySQL."""
+    from modules.recent import RecentReadings
+    store = RecentReadings(capacity=10)
+    store.add('dev-1', '2024-01-01T12:00:00Z', 22.5, None, 700, 3.14)
+    app = Flask(__name__)
+    app.register_blueprint(setup_routes(mock_db, store=store))
+    client = app.test_client()
+
+    data = json.loads(client.get('/api/power_data?limit=1').data)
+    assert data[0]['device_code'] == 'dev-1'
+    assert data[0]['timestamp'] == '2024-01-01T12:00:00'
+    mock_db.fetch_power_data.assert_not_called()
+
+    # More rows than the store holds still come from the database
+    client.get('/api/power_data?limit=2')
+    mock_db.fetch_power_data.assert_called_once_with(limit=2, raw=True)
+
 def test_get_power_data_invalid_limit(client, mock_db):
     """Test that an invalid limit defaults to 100."""
     client.get('/api/power_data?limit=invalid')
-    mock_db.fetch_power_data.assert_called_once_with(limit=100)
+    mock_db.fetch_power_data.assert_called_once_with(limit=100, raw=True)
     
     # Reset mock and test for another invalid case
     mock_db.fetch_power_data.reset_mock()
     client.get('/api/power_data?limit=-10')
-    mock_db.fetch_power_data.assert_called_once_with(limit=100)
+    mock_db.fetch_power_data.assert_called_once_with(limit=100, raw=True)
 
-def test_not_implemented_endpoints(client):
-    """Test that placeholder endpoints return 501 Not Implemented."""
+def test_former_placeholder_endpoints_are_implemented(client, mock_db):
+    """/api/summary and generate_esg_report used to answer 501; both are served now."""
+    mock_db.get_summary_data.return_value = {'time_range': '24h', 'readings_count': 3, 'electric_avg': 1.5}
     summary_response = client.get('/api/summary')
-    assert summary_response.status_code == 501
-    
-    # generate_esg_report now implemented, should return 201 or 200
+    assert summary_response.status_code == 200
+    assert json.loads(summary_response.data)['readings_count'] == 3
+
     report_response = client.post('/api/generate_esg_report')
     assert report_response.status_code in (200, 201)
 
-    summary_data = json.loads(summary_response.data)
-    assert "not yet implemented" in summary_data['message']
+@pytest.mark.parametrize("version", [None, MagicMock(), (None, None), ("7", "not a datetime")])
+def test_conditional_get_tolerates_unusable_versions(client, mock_db, version):
+    """Without a usable data version the endpoint answers normally, without ETag validation."""
+    mock_db.get_data_version.return_value = version
+    mock_db.get_summary_data.return_value = {'readings_count': 3}
+
+    response = client.get('/api/summary', headers={'If-None-Match': '"anything"'})
+
+    assert response.status_code == 200
+    assert json.loads(response.data) == {'readings_count': 3}
+
+def test_get_trend_with_custom_range_and_bucket(client, mock_db):
+    """start/end, bucket and device_code are passed through to the bucketing query."""
+    mock_db.get_trend.return_value = [{'timestamp': '2024-01-01 12:15:00', 'readings_count': 3, 'electric_avg': 1.5}]
+
+    response = client.get('/api/trend?start=2024-01-01T12:00:00Z&end=2024-01-01T13:00:00Z'
+                          '&bucket=15m&device_code=dev-1')
+
+    assert response.status_code == 200
+    body = json.loads(response.data)
+    assert body['bucket'] == '15m' and body['time_range'] is None
+    assert body['data'][0]['readings_count'] == 3
+    start, end, bucket = mock_db.get_trend.call_args[0]
+    assert end - start == datetime.timedelta(hours=1)
+    assert bucket == '15m'
+    assert mock_db.get_trend.call_args[1] == {'device_code': 'dev-1'}
+
+def test_get_trend_rejects_bad_parameters(client, mock_db):
+    assert client.get('/api/trend?bucket=2h').status_code == 400
+    assert client.get('/api/trend?timeRange=1y').status_code == 400
+    assert client.get('/api/trend?start=yesterday').status_code == 400
+    mock_db.get_trend.side_effect = ValueError("More than 10000 buckets of 1m requested")
+    assert client.get('/api/trend?timeRange=30d&bucket=1m').status_code == 400
+
+def test_max_points_downsamples_power_data(client, mock_db):
+    base = datetime.datetime(2024, 1, 1)
+    mock_db.fetch_power_data.return_value = [
+        {'id': i, 'timestamp': base + datetime.timedelta(seconds=i), 'electric': float(i % 7)}
+        for i in reversed(range(5000))
+    ]
+
+    response = client.get('/api/power_data?limit=5000&max_points=300')
+
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 300
+    mock_db.fetch_power_data.assert_called_once_with(limit=5000, raw=True)
+    assert client.get('/api/power_data?max_points=1').status_code == 400
+
+def test_max_points_downsamples_trend(client, mock_db):
+    mock_db.get_trend.return_value = [
+        {'timestamp': f'2024-01-{d:02d} {h:02d}:00:00', 'electric_avg': float(h)} for d in range(1, 31) for h in range(24)
+    ]
+
+    body = json.loads(client.get('/api/trend?timeRange=30d&max_points=100').data)
+
+    assert len(body['data']) == 100
+
+def test_power_data_pages_with_opaque_cursor(client, mock_db):
+    """A full page carries X-Next-Cursor, which the next request turns back into a keyset position."""
+    last = datetime.datetime(2024, 1, 1, 11, 59, 58)
+    mock_db.fetch_power_data.return_value = [
+        {'id': 8, 'timestamp': datetime.datetime(2024, 1, 1, 12), 'device_code': 'dev-1'},
+        {'id': 7, 'timestamp': last, 'device_code': 'dev-1'},
+    ]
+
+    response = client.get('/api/power_data?limit=2&device_code=dev-1&start=2024-01-01T00:00:00')
+    cursor = response.headers['X-Next-Cursor']
+    assert mock_db.fetch_power_data.call_args[1] == {
+        'limit': 2, 'raw': True, 'device_code': 'dev-1', 'start': datetime.datetime(2024, 1, 1)}
+
+    mock_db.fetch_power_data.return_value = []
+    response = client.get(f'/api/power_data?limit=2&device_code=dev-1&cursor={cursor}')
+    assert mock_db.fetch_power_data.call_args[1]['before'] == (last, 7, 'dev-1')
+    assert 'X-Next-Cursor' not in response.headers
+
+    assert client.get('/api/power_data?cursor=not-a-cursor').status_code == 400
+
+def test_filtered_power_data_bypasses_recent_store(mock_db):
+    from modules.recent import RecentReadings
+    store = RecentReadings(capacity=10)
+    store.add('dev-1', '2024-01-01T12:00:00Z', 22.5, None, 700, 3.14)
+    app = Flask(__name__)
+    app.register_blueprint(setup_routes(mock_db, store=store))
+
+    app.test_client().get('/api/power_data?limit=1&device_code=dev-2')
+
+    mock_db.fetch_power_data.assert_called_once_with(limit=1, raw=True, device_code='dev-2')
+
+def test_export_streams_selected_format(client, mock_db):
+    mock_db.iter_readings.return_value = iter([
+        [(1, datetime.datetime(2024, 1, 1), 'dev-1', None, None, None, 1.0)],
+        [(2, datetime.datetime(2024, 1, 1, 0, 0, 5), 'dev-1', None, None, None, 2.0)],
+    ])
+
+    response = client.get('/api/export?format=csv&device_code=dev-1&end=2024-02-01T00:00:00Z')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert response.data.decode().splitlines()[2].startswith('2,2024-01-01T00:00:05,dev-1')
+    assert mock_db.iter_readings.call_args[1]['device_code'] == 'dev-1'
+
+def test_export_rejects_unknown_format(client, mock_db):
+    assert client.get('/api/export?format=xml').status_code == 400
+    mock_db.iter_readings.assert_not_called()
+
+def test_power_data_columnar_format(client, mock_db):
+    mock_db.fetch_power_data.return_value = [
+        {'id': 2, 'timestamp': datetime.datetime(2024, 1, 1, 0, 0, 1), 'device_code': 'dev-1',
+         'temperature': Decimal('25.5'), 'humidity': None, 'brightness': 10, 'electric': 1.5},
+        {'id': 1, 'timestamp': datetime.datetime(2024, 1, 1), 'device_code': 'dev-2',
+         'temperature': None, 'humidity': 40.0, 'brightness': None, 'electric': 2.5},
+    ]
+
+    body = json.loads(client.get('/api/power_data?limit=2&format=columnar').data)
+
+    assert body['timestamp'] == [1704067201000, 1704067200000]
+    assert body['device_code'] == ['dev-1', 'dev-2']
+    assert body['temperature'] == [25.5, None]
+    assert set(body) == {'id', 'timestamp', 'device_code', 'temperature', 'humidity', 'brightness', 'electric'}
+    assert client.get('/api/power_data?format=table').status_code == 400
+
+def test_trend_columnar_format(client, mock_db):
+    mock_db.get_trend.return_value = [
+        {'timestamp': '2024-01-01 01:00:00', 'readings_count': 3, 'temperature': 20.0, 'humidity': 0,
+         'brightness': 0, 'electric_avg': 1.0, 'electric_total': 3.0, 'electric_min': 0.5, 'electric_max': 2.0},
+    ]
+
+    body = json.loads(client.get('/api/trend?timeRange=24h&format=columnar').data)
+
+    assert body['data']['timestamp'] == [1704070800000]
+    assert body['data']['electric_max'] == [2.0]
+    assert body['total_hours'] == 1
+
+def test_summary_answers_matching_etag_without_querying(client, mock_db):
+    mock_db.get_summary_data.return_value = {'total_readings': 10}
+
+    first = client.get('/api/summary?timeRange=24h')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and 'no-cache' in first.headers['Cache-Control']
+    assert first.headers['Last-Modified']
+
+    second = client.get('/api/summary?timeRange=24h', headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    mock_db.get_summary_data.assert_called_once()
+
+    # A new reading changes the version
+    mock_db.get_data_version.return_value = (43, datetime.datetime(2024, 1, 1, 12, 0, 5))
+    assert client.get('/api/summary?timeRange=24h', headers={'If-None-Match': etag}).status_code == 200
+
+def test_fixed_trend_window_is_versioned_by_data_only(client, mock_db, monkeypatch):
+    mock_db.get_trend.return_value = []
+    url = '/api/trend?start=2024-01-01T00:00:00Z&end=2024-01-02T00:00:00Z'
+    etag = client.get(url).headers['ETag']
+    assert etag == '"42"'
+
+    response = client.get(url, headers={'If-Modified-Since': 'Mon, 01 Jan 2024 12:00:00 GMT'})
+    assert response.status_code == 304
+    assert mock_db.get_trend.call_count == 1
+
+    # Rolling windows also expire as time passes
+    rolling = client.get('/api/trend?timeRange=24h').headers['ETag']
+    monkeypatch.setattr('modules.api.time.time', lambda: 10 ** 10)
+    assert client.get('/api/trend?timeRange=24h', headers={'If-None-Match': rolling}).status_code == 200
+
+def test_esg_reports_are_conditional(client, mock_db):
+    mock_db.fetch_esg_reports.return_value = []
+    etag = client.get('/api/esg_reports').headers['ETag']
+
+    assert client.get('/api/esg_reports', headers={'If-None-Match': etag}).status_code == 304
+    mock_db.fetch_esg_reports.assert_called_once()
+
+def test_unknown_version_skips_validation(client, mock_db):
+    mock_db.get_data_version.return_value = None
+    mock_db.get_summary_data.return_value = {}
+
+    response = client.get('/api/summary', headers={'If-None-Match': '*'})
+
+    assert response.status_code == 200 and 'ETag' not in response.headers
+
+def test_routes_use_database_connected_after_startup(mock_db):
+    """A worker that started without MySQL serves the API once resolve_db finds it."""
+    current = {'db': None}
+    app = Flask(__name__)
+    app.register_blueprint(setup_routes(None, resolve_db=lambda: current['db']))
+    client = app.test_client()
+
+    assert client.get('/api/power_data').status_code == 500
+    assert client.get('/api/summary').status_code == 500
+
+    current['db'] = mock_db
+    response = client.get('/api/power_data')
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 2
+    mock_db.fetch_power_data.assert_called_once()
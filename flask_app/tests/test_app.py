@@ -1,8 +1,10 @@
 import pytest
 from unittest.mock import MagicMock
 import json
+import datetime
 
 # The function to test
+import app
 from app import on_message_callback
 
 # Since app.py initializes db globally, we need to mock it before import.
@@ -15,7 +17,22 @@ def mock_db_global(mocker):
     mocker.patch('app.db', mock_db)
     return mock_db
 
-def test_on_message_callback_success(mock_db_global):
+@pytest.fixture(autouse=True)
+def recent_store(mocker):
+    """A fresh recent readings store per test, since app.py keeps one globally."""
+    from modules.recent import RecentReadings
+    store = RecentReadings(capacity=10)
+    mocker.patch('app.recent_readings', store)
+    return store
+
+@pytest.fixture
+def mock_writer(mocker, mock_db_global):
+    """Mocks the global batch writer that readings are handed to."""
+    writer = MagicMock()
+    mocker.patch('app.ingest_writer', writer)
+    return writer
+
+def test_on_message_callback_success(mock_writer):
     """Test the callback with a valid JSON payload."""
     payload = {
         "deviceCode": 101,
@@ -28,12 +45,12 @@ def test_on_message_callback_success(mock_db_global):
     
     on_message_callback(json.dumps(payload))
     
-    # Check if insert_reading was called with the correct arguments
-    mock_db_global.insert_reading.assert_called_once_with(
-        101, "2024-01-01T12:00:00", 22.5, 55.0, 700, 3.14
+    # Check that the reading was buffered with the correct arguments
+    mock_writer.add.assert_called_once_with(
+        101, "2024-01-01T12:00:00", 22.5, 55.0, 700, 3.14, on_commit=None
     )
 
-def test_on_message_callback_missing_fields(mock_db_global):
+def test_on_message_callback_missing_fields(mock_writer):
     """Test that messages with missing required fields are skipped."""
     # Missing timestamp
     payload_no_ts = {"deviceCode": 102}
@@ -43,19 +60,195 @@ def test_on_message_callback_missing_fields(mock_db_global):
     payload_no_dc = {"timestamp": "2024-01-01T13:00:00"}
     on_message_callback(json.dumps(payload_no_dc))
 
-    # Assert that insert_reading was never called
-    mock_db_global.insert_reading.assert_not_called()
+    # Assert that nothing was buffered
+    mock_writer.add.assert_not_called()
 
-def test_on_message_callback_invalid_json(mock_db_global, caplog):
+def test_on_message_callback_invalid_json(mock_writer, caplog):
     """Test the callback with a malformed JSON string."""
     malformed_payload = "this is not json"
     
     on_message_callback(malformed_payload)
     
-    # Assert that insert_reading was not called
-    mock_db_global.insert_reading.assert_not_called()
+    # Assert that nothing was buffered
+    mock_writer.add.assert_not_called()
     
     # Assert that an error was logged
     assert len(caplog.records) == 1
     assert "Error decoding JSON" in caplog.text
     assert caplog.records[0].levelname == 'ERROR'
+
+def test_on_message_callback_acks_after_commit(mock_writer):
+    """In at-least-once mode the ack is deferred to the batch commit."""
+    ack = MagicMock()
+    payload = {"deviceCode": 101, "timestamp": "2024-01-01T12:00:00", "electric": 3.14}
+
+    on_message_callback(json.dumps(payload), 'power/measurement', ack)
+
+    assert mock_writer.add.call_args.kwargs['on_commit'] is ack
+    ack.assert_not_called()
+
+def test_on_message_callback_acks_malformed_messages(mock_writer):
+    """Messages that can never be stored are acknowledged immediately."""
+    ack = MagicMock()
+    on_message_callback("this is not json", 'power/measurement', ack)
+    on_message_callback(json.dumps({"deviceCode": 102}), 'power/measurement', ack)
+
+    assert ack.call_count == 2
+    mock_writer.add.assert_not_called()
+
+def test_on_message_callback_batch_topic(mock_writer, mocker):
+    """A batch envelope is buffered in one call and each reading is still emitted."""
+    from modules.broadcast import Subscriptions
+    emit = mocker.patch('app.socketio.emit')
+    subscriptions = Subscriptions()
+    subscriptions.connect('overview')
+    subscriptions.connect('detail', devices=['dev-1'])
+    mocker.patch.object(app.broadcaster, 'subscriptions', subscriptions)
+    mocker.patch.object(app.broadcaster, '_inbox', [])
+    ack = MagicMock()
+    payload = {
+        "deviceCode": "dev-1",
+        "timestamp": ["2024-01-01T12:00:00Z", "2024-01-01T12:00:05Z"],
+        "electric": [1.0, 1.1],
+    }
+
+    on_message_callback(json.dumps(payload), app.batch_topic, ack)
+
+    mock_writer.add_many.assert_called_once()
+    readings = mock_writer.add_many.call_args.args[0]
+    assert [r.electric for r in readings] == [1.0, 1.1]
+    assert mock_writer.add_many.call_args.kwargs['on_commit'] is ack
+    mock_writer.add.assert_not_called()
+    emit.assert_not_called()
+    app.broadcaster.flush()
+    rooms = [(c.args[0], c.kwargs['room']) for c in emit.call_args_list]
+    assert rooms == [('reading', 'overview')] * 2 + [('reading', 'detail')] * 2
+
+def test_on_message_callback_binary_topic(mock_writer, mocker):
+    """Payloads on a codec topic are decoded with that codec."""
+    from modules.codecs import CodecRegistry, StructCodec
+    from modules.readings import Reading
+    mocker.patch('app.payload_codecs', CodecRegistry({'power/bin': 'struct'}))
+    mocker.patch('app.socketio.emit')
+    payload = StructCodec().encode([Reading("dev-1", "2024-01-01T12:00:00Z", 22.5, None, None, 1.5)])
+
+    on_message_callback(payload, 'power/bin')
+
+    device_code, timestamp, temperature = mock_writer.add.call_args.args[:3]
+    assert device_code == "dev-1"
+    assert timestamp == datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    assert temperature == 22.5
+
+def test_on_message_callback_records_end_to_end_latency(mock_writer, mocker):
+    """Messages with a sentAt time record publish-to-commit latency when committed."""
+    mocker.patch('app.socketio.emit')
+    latency = mocker.patch('app.end_to_end_latency')
+    ack = MagicMock()
+    payload = {"deviceCode": 101, "timestamp": "2024-01-01T12:00:00Z", "sentAt": 1000}
+
+    on_message_callback(json.dumps(payload), 'power/measurement', ack)
+    latency.add.assert_not_called()
+
+    mock_writer.add.call_args.kwargs['on_commit']()
+    latency.add.assert_called_once()
+    ack.assert_called_once()
+
+def test_redelivered_reading_is_not_broadcast_again(mock_writer, mocker):
+    """A redelivered message is still handed to the writer but not re-sent to dashboards."""
+    publish = mocker.patch.object(app.broadcaster, 'publish')
+    payload = json.dumps({"deviceCode": "dev-1", "timestamp": "2024-01-01T12:00:00Z", "electric": 1.0})
+
+    on_message_callback(payload, 'power/measurement')
+    on_message_callback(payload, 'power/measurement')
+
+    assert mock_writer.add.call_count == 2
+    publish.assert_called_once()
+    assert publish.call_args.args[0]['seq'] == 1
+
+def test_readings_relayed_from_another_worker_are_stored_and_broadcast(mocker):
+    """A web-only worker serves readings ingested elsewhere from its store and broadcaster."""
+    publish = mocker.patch.object(app.broadcaster, 'publish')
+    event = {"device_code": "dev-1", "timestamp": "2024-01-01T12:00:00", "temperature": None,
+             "humidity": None, "brightness": None, "electric": 1.0}
+
+    app.on_relayed_readings([event])
+    app.on_relayed_readings([event])
+
+    assert app.recent_readings.latest_for("dev-1")['electric'] == 1.0
+    publish.assert_called_once()
+    assert publish.call_args.args[0] == dict(event, seq=1)
+    assert publish.call_args.kwargs['rooms'] == ('devices:all', 'device:dev-1')
+
+def _connect(auth):
+    client = app.socketio.test_client(app.app, auth=auth)
+    received = {message['name']: message['args'][0] for message in client.get_received()}
+    client.disconnect()
+    return received
+
+def test_connect_resumes_from_sequence_cursor(recent_store):
+    """A client reconnecting on the same stream gets the readings it missed in one frame."""
+    for second in range(3):
+        recent_store.add("dev-1", f"2024-01-01T12:00:0{second}Z", electric=float(second))
+
+    received = _connect({'batch': True, 'stream': recent_store.stream, 'since_seq': 1})
+
+    assert received['connection_status']['seq'] == 3
+    resume = received['resume']
+    assert resume['mode'] == 'replay'
+    assert [r['seq'] for r in resume['readings']] == [2, 3]
+    assert resume['readings'][0]['electric'] == 1.0
+
+def test_connect_falls_back_to_snapshot(recent_store):
+    """A cursor from another process (or too old) gets the latest reading per device instead."""
+    recent_store.add("dev-1", "2024-01-01T12:00:00Z")
+    recent_store.add("dev-2", "2024-01-01T12:00:01Z")
+    recent_store.add("dev-1", "2024-01-01T12:00:02Z")
+
+    resume = _connect({'stream': 'previous-process', 'since_seq': 1})['resume']
+
+    assert resume['mode'] == 'snapshot'
+    assert sorted((r['device_code'], r['timestamp']) for r in resume['readings']) == [
+        ('dev-1', '2024-01-01T12:00:02'), ('dev-2', '2024-01-01T12:00:01')]
+
+def test_connect_without_cursor_gets_no_resume():
+    assert 'resume' not in _connect({})
+
+def test_shutdown_drains_pipeline_before_closing_writer(mocker):
+    """SIGTERM/atexit shutdown stops MQTT, drains the pipeline, then flushes the writer, once."""
+    calls = MagicMock()
+    mocker.patch('app._shut_down', app.threading.Event())
+    mocker.patch('app.mqtt_client', calls.mqtt)
+    mocker.patch('app.ingest_pipeline', calls.pipeline)
+    mocker.patch('app.spool_replayer', None)
+    mocker.patch('app.ingest_writer', calls.writer)
+    mocker.patch('app.mqtt_tap', calls.tap)
+    mocker.patch('app.reading_relay', calls.relay)
+    calls.pipeline.stop.side_effect = RuntimeError("worker stuck")
+
+    app.shutdown()
+    app.shutdown()
+
+    assert [name for name, _, _ in calls.mock_calls if not name.endswith('__bool__')] == [
+        'mqtt.stop', 'pipeline.stop', 'writer.close', 'tap.close', 'relay.stop']
+
+def test_lazily_connected_database_gets_the_executor(mocker):
+    """The spool replayer and API routes create the Database like startup does, executor included."""
+    created = MagicMock()
+    database = mocker.patch('app.Database', return_value=created)
+    mocker.patch('app.db', None)
+    executor = object()
+    mocker.patch('app.db_executor', executor)
+
+    assert app.connect_database() is created
+    assert app.connect_database() is created
+    database.assert_called_once_with(executor=executor)
+    assert app.db is created
+
+def test_current_database_retries_at_most_once_per_interval(mocker):
+    database = mocker.patch('app.Database', side_effect=ConnectionError("down"))
+    mocker.patch('app.db', None)
+    mocker.patch('app._db_retry_at', 0.0)
+
+    assert app.current_database() is None
+    assert app.current_database() is None
+    assert database.call_count == 1
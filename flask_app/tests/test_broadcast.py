@@ -0,0 +1,319 @@
+from unittest.mock import MagicMock
+
+import msgpack
+import pytest
+
+from modules.broadcast import (ClientChannel, CoalescingBroadcaster, Subscriptions, ALL_DEVICES, device_room,
+                               parse_device_groups)
+from modules.socket_format import encode_batch, encode_event
+
+
+def batch_frames(socketio):
+    return [c for c in socketio.emit.call_args_list if c.args[0] == 'readings_batch']
+
+
+def make_broadcaster(*clients, **kwargs):
+    """Broadcaster with a mocked Socket.IO server and ``(sid, connect kwargs)`` clients."""
+    socketio = MagicMock()
+    subscriptions = Subscriptions()
+    for sid, options in clients:
+        subscriptions.connect(sid, **options)
+    return socketio, subscriptions, CoalescingBroadcaster(socketio, subscriptions=subscriptions, **kwargs)
+
+
+def event(device, n):
+    return {'device_code': device, 'n': n}
+
+
+def test_publish_only_queues_until_flush():
+    """Ingest threads never emit; the broadcaster task sends per-reading events on flush."""
+    socketio, _, broadcaster = make_broadcaster(('sid', {}))
+
+    broadcaster.publish({'device_code': 'a'})
+    socketio.emit.assert_not_called()
+
+    broadcaster.flush()
+    socketio.emit.assert_called_once_with('reading', {'device_code': 'a'}, room='sid', ignore_queue=True)
+
+
+def test_flush_sends_one_frame_per_batch_client():
+    """Everything published within a window goes to each batch client as one readings_batch frame."""
+    socketio, _, broadcaster = make_broadcaster(('overview', {'batch': True}),
+                                                ('detail', {'batch': True, 'devices': ['x']}))
+    for i in range(3):
+        broadcaster.publish(event('a', i))
+    broadcaster.publish(event('x', 9))
+
+    assert broadcaster.flush() == 2
+
+    frames = {c.kwargs['room']: c.args[1] for c in batch_frames(socketio)}
+    assert frames['overview']['count'] == 4
+    assert frames['detail'] == {'count': 1, 'readings': [event('x', 9)]}
+    stats = broadcaster.stats()
+    assert stats['frames'] == 2
+    assert stats['batch_size']['max'] == 4
+    assert stats['emit_ms']['count'] == 2
+    assert stats['coalesce_delay_ms']['count'] == 1
+
+
+def test_identical_frames_are_encoded_once(mocker):
+    encode = mocker.patch('modules.broadcast.encode_batch', side_effect=encode_batch)
+    socketio, _, broadcaster = make_broadcaster(*[(f'sid-{i}', {'batch': True}) for i in range(5)])
+
+    broadcaster.publish(event('a', 1))
+    assert broadcaster.flush() == 5
+
+    encode.assert_called_once()
+
+
+def test_flush_without_readings_emits_nothing():
+    socketio, _, broadcaster = make_broadcaster(('sid', {'batch': True}))
+
+    assert broadcaster.flush() == 0
+    socketio.emit.assert_not_called()
+
+
+def test_slow_client_is_conflated_without_holding_up_others():
+    """A client that has not acknowledged its last frame only keeps the newest reading per device."""
+    socketio, _, broadcaster = make_broadcaster(('slow', {'batch': True}), ('fast', {'batch': True}))
+    broadcaster.publish(event('a', 0))
+    broadcaster.flush()
+    acks = {c.kwargs['room']: c.kwargs['callback'] for c in batch_frames(socketio)}
+    acks['fast']()
+
+    for n in range(1, 4):
+        broadcaster.publish(event('a', n))
+        broadcaster.publish(event('b', n))
+        broadcaster.flush()
+        for c in batch_frames(socketio)[-1:]:
+            if c.kwargs['room'] == 'fast':
+                c.kwargs['callback']()
+
+    fast_frames = [c for c in batch_frames(socketio) if c.kwargs['room'] == 'fast']
+    assert len(fast_frames) == 4
+    slow = broadcaster.client_stats()['slow']
+    assert slow['inflight'] == 1
+    assert slow['pending'] == 2
+    assert slow['conflated'] == 4
+    assert slow['lag_ms'] > 0
+    assert broadcaster.stats()['clients_behind'] == 1
+
+    # Once it catches up it gets the newest reading of each device in one frame
+    acks['slow']()
+    broadcaster.flush()
+    assert batch_frames(socketio)[-1].args[1]['readings'] == [event('a', 3), event('b', 3)]
+
+
+def test_drop_policy_bounds_the_client_buffer():
+    channel = ClientChannel('sid', maxsize=3, policy='drop')
+    channel.push([event('a', 0)])
+    channel.take()
+
+    channel.push([event('a', n) for n in range(1, 6)])
+
+    stats = channel.stats()
+    assert stats['pending'] == 3
+    assert stats['dropped'] == 2
+    assert stats['conflated'] == 0
+
+
+def test_unacknowledged_frames_expire():
+    channel = ClientChannel('sid')
+    channel.push([event('a', 0)])
+    channel.take()
+    channel.push([event('a', 1)])
+    assert channel.take() == (None, [])
+
+    channel.expire(timeout=0)
+
+    assert channel.take()[1] == [event('a', 1)]
+    assert channel.ack_timeouts == 1
+
+
+def test_emit_failure_is_logged_and_later_frames_continue():
+    """A failing emit drops that frame without breaking the broadcaster."""
+    socketio, _, broadcaster = make_broadcaster(('sid', {'batch': True}))
+    socketio.emit.side_effect = [RuntimeError('boom'), None]
+
+    broadcaster.publish(event('a', 1))
+    broadcaster.flush()
+    broadcaster.publish(event('a', 2))
+    broadcaster.flush()
+
+    assert broadcaster.frames == 1
+    assert batch_frames(socketio)[-1].args[1]['readings'] == [event('a', 2)]
+
+
+def test_disconnected_clients_lose_their_channel():
+    _, subscriptions, broadcaster = make_broadcaster(('sid', {'batch': True}))
+    broadcaster.flush()
+    assert 'sid' in broadcaster.client_stats()
+
+    subscriptions.disconnect('sid')
+    broadcaster.flush()
+
+    assert broadcaster.client_stats() == {}
+
+
+def test_start_runs_flush_loop_as_background_task():
+    socketio = MagicMock()
+    broadcaster = CoalescingBroadcaster(socketio, window=0.1)
+
+    broadcaster.start()
+    broadcaster.start()
+
+    socketio.start_background_task.assert_called_once_with(broadcaster._run)
+
+
+def test_per_reading_clients_get_the_devices_they_follow():
+    """Each per-reading client gets one 'reading' event per reading it follows, sent to its sid."""
+    socketio, _, broadcaster = make_broadcaster(('overview', {}), ('detail', {'devices': ['dev-1']}))
+
+    broadcaster.publish(event('dev-1', 1), rooms=(ALL_DEVICES, device_room('dev-1')))
+    broadcaster.publish(event('dev-2', 2), rooms=(ALL_DEVICES, device_room('dev-2')))
+    assert broadcaster.flush() == 0
+
+    sent = [(c.kwargs['room'], c.args[1]['n']) for c in socketio.emit.call_args_list]
+    assert sent == [('overview', 1), ('overview', 2), ('detail', 1)]
+    assert broadcaster.client_stats()['detail']['mode'] == 'reading'
+
+
+def test_slow_per_reading_client_is_conflated_while_its_transport_is_backed_up():
+    """Per-reading clients send no acks; a transport still holding packets marks them as behind."""
+    backlog = {'slow': 0, 'fast': 0}
+    socketio, _, broadcaster = make_broadcaster(('slow', {}), ('fast', {}), client_queue_size=10,
+                                                backlog=backlog.get)
+    broadcaster.publish(event('a', 0))
+    broadcaster.flush()
+
+    backlog['slow'] = 40
+    for i in range(1, 4):
+        broadcaster.publish(event('a', i))
+        broadcaster.publish(event('b', i))
+        broadcaster.flush()
+
+    sent = [(c.kwargs['room'], c.args[1]['n']) for c in socketio.emit.call_args_list]
+    assert [n for room, n in sent if room == 'slow'] == [0]
+    assert [n for room, n in sent if room == 'fast'] == [0, 1, 1, 2, 2, 3, 3]
+    stats = broadcaster.client_stats()['slow']
+    assert (stats['pending'], stats['backlog'], stats['conflated']) == (2, 40, 4)
+
+    backlog['slow'] = 0
+    broadcaster.flush()
+    sent = [c.args[1] for c in socketio.emit.call_args_list if c.kwargs['room'] == 'slow']
+    assert sent[1:] == [event('a', 3), event('b', 3)]
+
+
+def test_per_reading_buffer_is_bounded():
+    backlog = {'sid': 5}
+    socketio, _, broadcaster = make_broadcaster(('sid', {}), client_queue_size=3, client_policy='drop',
+                                                backlog=backlog.get)
+    for i in range(5):
+        broadcaster.publish(event('a', i))
+    broadcaster.flush()
+
+    socketio.emit.assert_not_called()
+    assert broadcaster.client_stats()['sid']['dropped'] == 2
+
+
+def test_without_subscriptions_readings_go_to_rooms():
+    """Clients are unknown without subscriptions, so each reading is emitted to its rooms."""
+    socketio = MagicMock()
+    broadcaster = CoalescingBroadcaster(socketio)
+
+    broadcaster.publish({'n': 1}, rooms=(ALL_DEVICES, device_room('dev-1')))
+    broadcaster.flush()
+
+    rooms = [(c.args[0], c.kwargs['room']) for c in socketio.emit.call_args_list]
+    assert [r for r in rooms if '#' not in r[1]] == [('reading', 'devices:all'), ('reading', 'device:dev-1')]
+
+
+def test_msgpack_clients_get_binary_frames():
+    """msgpack clients get one binary event per reading and columnar batch frames."""
+    socketio, _, broadcaster = make_broadcaster(('single', {'fmt': 'msgpack'}),
+                                                ('batched', {'batch': True, 'fmt': 'msgpack'}))
+    reading = {'device_code': 'dev-1', 'timestamp': '2024-01-01T00:00:01Z', 'temperature': 22.5,
+               'humidity': None, 'brightness': 700, 'electric': 1.5}
+
+    broadcaster.publish(reading)
+    broadcaster.flush()
+
+    (single, batch) = socketio.emit.call_args_list
+    assert single.kwargs['room'] == 'single'
+    assert msgpack.unpackb(single.args[1])['timestamp'] == 1704067201000
+    assert batch.kwargs['room'] == 'batched'
+    frame = msgpack.unpackb(batch.args[1])
+    assert frame['count'] == 1
+    assert frame['device_code'] == ['dev-1']
+    assert frame['timestamp'] == [1704067201000]
+    assert frame['temperature'] == [22.5]
+
+
+def test_encode_event_keeps_unparseable_timestamps():
+    assert encode_event({'a': 1}) == {'a': 1}
+    assert msgpack.unpackb(encode_event({'timestamp': 'garbage', 'server_time': None}, 'msgpack')) == \
+        {'timestamp': 'garbage', 'server_time': None}
+    assert encode_batch([{'n': 1}]) == {'count': 1, 'readings': [{'n': 1}]}
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        Subscriptions().connect('sid', fmt='xml')
+
+
+def test_parse_device_groups():
+    assert parse_device_groups('floor1=dev-1|dev-2, floor2=dev-3') == {'floor1': {'dev-1', 'dev-2'},
+                                                                      'floor2': {'dev-3'}}
+    assert parse_device_groups('') == {}
+
+
+def test_subscriptions_default_to_all_devices():
+    subs = Subscriptions()
+
+    assert subs.connect('sid') == ['devices:all']
+    assert subs.connect('sid-batch', batch=True) == ['devices:all#batch']
+
+
+def test_subscribing_to_devices_narrows_all_devices():
+    """Naming devices replaces the implicit all-devices room with device rooms."""
+    subs = Subscriptions({'floor1': {'dev-1', 'dev-2'}})
+    subs.connect('sid')
+
+    joined, left = subs.subscribe('sid', devices=['dev-3'], groups=['floor1'])
+
+    assert joined == ['device:dev-1', 'device:dev-2', 'device:dev-3']
+    assert left == ['devices:all']
+    assert subs.describe('sid') == {'all': False, 'devices': ['dev-3'], 'groups': ['floor1']}
+
+
+def test_overlapping_group_and_device_share_one_room():
+    """A device followed directly and through a group is only left when both are gone."""
+    subs = Subscriptions({'floor1': {'dev-1', 'dev-2'}})
+    subs.connect('sid', batch=True, devices=['dev-1'])
+    subs.subscribe('sid', groups=['floor1'])
+
+    joined, left = subs.unsubscribe('sid', groups=['floor1'])
+    assert joined == []
+    assert left == ['device:dev-2#batch']
+
+    joined, left = subs.unsubscribe('sid', devices=['dev-1'])
+    assert left == ['device:dev-1#batch']
+
+
+def test_subscribe_all_keeps_overview_room():
+    subs = Subscriptions()
+    subs.connect('sid', devices=['dev-1'])
+
+    joined, left = subs.subscribe('sid', all_devices=True)
+
+    assert joined == ['devices:all']
+    assert left == ['device:dev-1']
+
+
+def test_unknown_group_is_rejected():
+    subs = Subscriptions({'floor1': {'dev-1'}})
+    subs.connect('sid')
+
+    with pytest.raises(ValueError):
+        subs.subscribe('sid', groups=['nope'])
+    assert subs.describe('sid')['all'] is True
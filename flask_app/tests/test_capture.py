@@ -0,0 +1,95 @@
+from unittest.mock import MagicMock
+
+from modules.capture import CaptureWriter, read_capture, replay
+from modules.mqtt_client import MQTTClient
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / 'capture.bin.gz')
+    writer = CaptureWriter(path)
+    writer.record('power/measurement', b'{"deviceCode": 1}', arrived_at=100.0)
+    writer.record('power/measurement/bin', b'\x00\x01', arrived_at=100.5)
+    writer.close()
+
+    assert list(read_capture(path)) == [
+        (100.0, 'power/measurement', b'{"deviceCode": 1}'),
+        (100.5, 'power/measurement/bin', b'\x00\x01'),
+    ]
+
+
+def test_replay_scales_timing():
+    records = [(100.0, 't', b'a'), (101.0, 't', b'b'), (103.0, 't', b'c')]
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    seen = []
+    count = replay(records, lambda topic, payload: seen.append(payload), speed=2.0,
+                   sleep=sleep, clock=lambda: now[0])
+
+    assert count == 3
+    assert seen == [b'a', b'b', b'c']
+    assert sleeps == [0.5, 1.0]
+
+
+def test_replay_max_speed_never_sleeps():
+    sleep = MagicMock()
+    records = [(100.0, 't', b'a'), (200.0, 't', b'b')]
+    assert replay(records, lambda topic, payload: None, speed=None, sleep=sleep) == 2
+    sleep.assert_not_called()
+
+
+def test_tap_records_before_enqueueing(mocker, tmp_path):
+    mocker.patch('paho.mqtt.client.Client')
+    tap = MagicMock()
+    client = MQTTClient(MagicMock(), pipeline=MagicMock(), tap=tap)
+
+    client.on_message(None, None, MagicMock(topic='power/measurement', payload=b'{}', mid=1, qos=0))
+
+    tap.record.assert_called_once_with('power/measurement', b'{}')
+    client.pipeline.submit.assert_called_once()
+
+
+def crash_copy(writer, path):
+    """Bytes a crash would leave on disk: flushed so far, never closed."""
+    writer._file.fileobj.flush()
+    with open(writer.path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def test_capture_cut_short_by_a_crash_keeps_flushed_records(tmp_path):
+    """An unclean exit leaves no gzip trailer; records up to the last sync flush are still readable."""
+    writer = CaptureWriter(str(tmp_path / 'live.bin.gz'), flush_interval=0)
+    for i in range(3):
+        writer.record('power/measurement', b'x' * i, arrived_at=100.0 + i)
+    path = str(tmp_path / 'capture.bin.gz')
+    crash_copy(writer, path)
+
+    expected = [(100.0 + i, 'power/measurement', b'x' * i) for i in range(3)]
+    assert list(read_capture(path)) == expected
+
+    # The next run repairs the file before appending its own gzip member
+    restarted = CaptureWriter(path)
+    restarted.record('power/test', b'{}', arrived_at=200.0)
+    restarted.close()
+    assert list(read_capture(path)) == expected + [(200.0, 'power/test', b'{}')]
+    writer.close()
+
+
+def test_truncated_record_is_dropped(tmp_path):
+    writer = CaptureWriter(str(tmp_path / 'live.bin.gz'), flush_interval=0)
+    writer.record('power/measurement', b'complete', arrived_at=1.0)
+    writer.record('power/measurement', b'cut off by the crash', arrived_at=2.0)
+    path = str(tmp_path / 'capture.bin.gz')
+    data = crash_copy(writer, path)
+    with open(path, 'wb') as f:
+        f.write(data[:-6])
+
+    assert list(read_capture(path)) == [(1.0, 'power/measurement', b'complete')]
+    writer.close()
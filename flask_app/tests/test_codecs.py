@@ -0,0 +1,65 @@
+import datetime
+import json
+import pytest
+
+from modules.codecs import CodecError, CodecRegistry, JsonCodec, MsgpackCodec, StructCodec, to_epoch_ms
+from modules.readings import Reading
+
+UTC = datetime.timezone.utc
+READINGS = [
+    Reading("aa:bb:cc:dd:ee:ff", datetime.datetime(2024, 1, 1, 12, 0, 0, tzinfo=UTC), 22.5, 55.0, 700, 3.5),
+    Reading("aa:bb:cc:dd:ee:ff", datetime.datetime(2024, 1, 1, 12, 0, 5, tzinfo=UTC), None, 55.5, None, 3.75),
+]
+
+
+@pytest.mark.parametrize("codec", [MsgpackCodec(), StructCodec()])
+def test_binary_codecs_round_trip(codec):
+    assert codec.decode(codec.encode(READINGS[:1])) == READINGS[:1]
+    assert codec.decode(codec.encode(READINGS, batch=True), batch=True) == READINGS
+
+
+def test_json_codec_matches_existing_message_format():
+    payload = json.dumps({"deviceCode": 101, "timestamp": "2024-01-01T12:00:00Z", "temp": 22.5})
+    assert JsonCodec().decode(payload) == [Reading(101, "2024-01-01T12:00:00Z", 22.5)]
+    assert JsonCodec().decode(json.dumps({"deviceCode": 101})) == []
+
+
+def test_msgpack_detects_batches_without_a_batch_topic():
+    payload = MsgpackCodec().encode(READINGS, batch=True)
+    assert MsgpackCodec().decode(payload) == READINGS
+
+
+def test_struct_record_layout():
+    payload = StructCodec().encode(READINGS[:1])
+    assert len(payload) == StructCodec.RECORD.size == 48
+    device, timestamp, *_ = StructCodec.RECORD.unpack(payload)
+    assert device.rstrip(b'\0') == b"aa:bb:cc:dd:ee:ff"
+    assert timestamp == to_epoch_ms(READINGS[0].timestamp)
+
+
+def test_corrupt_binary_payloads_raise_codec_error():
+    with pytest.raises(CodecError):
+        StructCodec().decode(b'\x00' * 39)
+    with pytest.raises(CodecError):
+        MsgpackCodec().decode(b'\xc1')
+
+
+def test_registry_selects_codec_by_topic():
+    registry = CodecRegistry.from_env("power/msgpack=msgpack, power/bin=struct")
+    assert registry.topics == ["power/msgpack", "power/bin"]
+    assert isinstance(registry.codec_for("power/bin"), StructCodec)
+    assert isinstance(registry.codec_for("power/measurement"), JsonCodec)
+
+    with pytest.raises(ValueError):
+        CodecRegistry({"power/x": "protobuf"})
+
+
+@pytest.mark.parametrize("codec", [JsonCodec(), MsgpackCodec()])
+def test_sent_at_round_trip(codec):
+    single = codec.encode(READINGS[:1], sent_at=1704110400123)
+    assert codec.decode_message(single) == (codec.decode(single), 1704110400123)
+
+    batch = codec.encode(READINGS, batch=True, sent_at=1704110400456)
+    readings, sent_at = codec.decode_message(batch, batch=True)
+    assert len(readings) == 2
+    assert sent_at == 1704110400456
@@ -1,7 +1,12 @@
 import pytest
 from unittest.mock import MagicMock
-from modules.database import Database
+from modules.database import (Database, BatchWriter, BlockingExecutor, INSERT_READING_QUERY,
+                              INSERT_READING_IDEMPOTENT_QUERY)
+from modules.rollups import (DAILY_TABLE, HOURLY_TABLE, merge_query, rebuild_daily_query,
+                             rebuild_hourly_query)
+import mysql.connector
 import datetime
+import time
 
 @pytest.fixture
 def mock_db(mocker):
@@ -15,6 +20,9 @@ def mock_db(mocker):
     mock_connection = MagicMock()
     mock_cursor = MagicMock()
     
+    # Every row of an executed batch counts as written unless a test says otherwise
+    mock_cursor.rowcount = 1
+
     # Configure the context manager behavior
     db.cnx_pool.get_connection.return_value.__enter__.return_value = mock_connection
     mock_connection.cursor.return_value.__enter__.return_value = mock_cursor
@@ -25,6 +33,11 @@ def mock_db(mocker):
     
     return db
 
+def reading_inserts(mock_db):
+    """executemany calls that wrote power_readings rows (rollup upserts follow them)."""
+    return [c for c in mock_db.mock_cursor.executemany.call_args_list
+            if c[0][0] in (INSERT_READING_QUERY, INSERT_READING_IDEMPOTENT_QUERY)]
+
 def test_insert_reading(mock_db):
     """Test that insert_reading constructs and executes the correct SQL query."""
     device_code = "aa:bb:cc:dd:ee:ff"
@@ -60,7 +73,7 @@ def test_fetch_power_data(mock_db):
     
     expected_query = (
         "SELECT id, timestamp, device_code, temperature, humidity, brightness, electric "
-        "FROM power_readings ORDER BY timestamp DESC LIMIT %s"
+        "FROM power_readings ORDER BY timestamp DESC, id DESC LIMIT %s"
     )
     
     # Assert that the query was executed with the correct limit
@@ -68,3 +81,367 @@ def test_fetch_power_data(mock_db):
     # Assert that the fetched data matches our sample data
     assert result == sample_data
     mock_db.mock_cursor.fetchall.assert_called_once()
+
+def test_insert_readings_uses_one_executemany_and_commit(mock_db):
+    """A batch of rows is written with a single executemany and one commit."""
+    rows = [
+        (datetime.datetime(2024, 1, 1, 12, 0, i), "dev-1", 25.0, 50.0, 500, 1.0)
+        for i in range(3)
+    ]
+    mock_db.mock_cursor.rowcount = 3
+    mock_db.insert_readings(rows)
+
+    assert mock_db.mock_cursor.executemany.call_args_list[0][0] == (INSERT_READING_QUERY, rows)
+    assert len(reading_inserts(mock_db)) == 1
+    mock_db.mock_connection.commit.assert_called_once()
+
+def test_batch_writer_flushes_when_full(mock_db):
+    """The writer flushes automatically once max_batch_size rows are buffered."""
+    writer = BatchWriter(mock_db, max_batch_size=3, max_batch_age=60)
+
+    writer.add("dev-1", "2024-01-01T12:00:00Z", 25.0, 50.0, 500, 1.0)
+    writer.add("dev-1", "2024-01-01T12:00:01Z", 25.1, 50.0, 500, 1.0)
+    mock_db.mock_cursor.executemany.assert_not_called()
+
+    mock_db.mock_cursor.rowcount = 3
+    writer.add("dev-1", "2024-01-01T12:00:02Z", 25.2, 50.0, 500, 1.0)
+    [insert] = reading_inserts(mock_db)
+    _, rows = insert[0]
+    assert len(rows) == 3
+    assert isinstance(rows[0][0], datetime.datetime)
+    assert writer.pending() == 0
+
+    stats = writer.stats()
+    assert stats['rows_written'] == 3
+    assert stats['batch_size']['max'] == 3
+    assert stats['flush_latency_ms']['count'] == 1
+
+def test_batch_writer_flushes_by_age(mock_db):
+    """Rows older than max_batch_age are flushed by the background thread."""
+    writer = BatchWriter(mock_db, max_batch_size=100, max_batch_age=0.05)
+    writer.start()
+    try:
+        writer.add("dev-1", datetime.datetime.now(), 25.0, 50.0, 500, 1.0)
+        deadline = time.monotonic() + 2
+        while writer.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert writer.pending() == 0
+        assert len(reading_inserts(mock_db)) == 1
+    finally:
+        writer.close()
+
+def test_batch_writer_close_flushes_remaining(mock_db):
+    """close() writes out a partially filled batch."""
+    writer = BatchWriter(mock_db, max_batch_size=100, max_batch_age=60)
+    writer.add("dev-1", datetime.datetime.now(), 25.0, 50.0, 500, 1.0)
+
+    writer.close()
+
+    assert len(reading_inserts(mock_db)) == 1
+    assert writer.stats()['rows_written'] == 1
+
+def test_batch_writer_counts_failed_flushes(mock_db):
+    """A failing insert is counted and does not raise into the caller."""
+    mock_db.mock_cursor.executemany.side_effect = mysql.connector.Error("boom")
+    writer = BatchWriter(mock_db, max_batch_size=1, max_batch_age=60)
+
+    writer.add("dev-1", datetime.datetime.now())
+
+    assert writer.stats()['flush_errors'] == 1
+    assert writer.stats()['rows_written'] == 0
+
+def test_insert_reading_can_ignore_duplicates(mock_db):
+    """With ignore_duplicates the insert becomes a no-op for an existing (device, timestamp)."""
+    timestamp = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    mock_db.insert_reading("dev-1", timestamp, 25.0, ignore_duplicates=True)
+
+    mock_db.mock_cursor.execute.assert_called_once_with(
+        INSERT_READING_IDEMPOTENT_QUERY, (timestamp, "dev-1", 25.0, None, None, None))
+    assert INSERT_READING_IDEMPOTENT_QUERY.endswith("ON DUPLICATE KEY UPDATE id = id")
+
+def test_batch_writer_runs_commit_callbacks_after_commit(mock_db):
+    """on_commit callbacks (MQTT acks) run only once the batch has been committed."""
+    events = []
+    mock_db.mock_connection.commit.side_effect = lambda: events.append('commit')
+    mock_db.mock_cursor.rowcount = 1
+    writer = BatchWriter(mock_db, max_batch_size=2, max_batch_age=60)
+
+    writer.add("dev-1", "2024-01-01T12:00:00Z", on_commit=lambda: events.append('ack-1'))
+    writer.add("dev-1", "2024-01-01T12:00:00Z", on_commit=lambda: events.append('ack-2'))
+
+    assert events == ['commit', 'ack-1', 'ack-2']
+    [insert] = reading_inserts(mock_db)
+    query, _ = insert[0]
+    assert query == INSERT_READING_IDEMPOTENT_QUERY
+    # The redelivered second row was skipped by the unique key
+    assert writer.stats()['duplicates_skipped'] == 1
+
+def test_batch_writer_does_not_ack_failed_batches(mock_db):
+    """A failed flush leaves messages unacknowledged so the broker redelivers them."""
+    mock_db.mock_cursor.executemany.side_effect = mysql.connector.Error("boom")
+    acked = []
+    writer = BatchWriter(mock_db, max_batch_size=1, max_batch_age=60)
+
+    writer.add("dev-1", datetime.datetime.now(), on_commit=lambda: acked.append(1))
+
+    assert acked == []
+
+def test_batch_writer_retries_refused_batch_row_by_row():
+    """One row MySQL cannot store is dropped; the rest of the batch is written and acked."""
+    def insert_readings(rows, ignore_duplicates):
+        if any(row[2] == "n/a" for row in rows):
+            raise mysql.connector.DatabaseError(msg="Incorrect double value: 'n/a'", errno=1366)
+        return len(rows)
+
+    db = MagicMock()
+    db.insert_readings.side_effect = insert_readings
+    acked = []
+    writer = BatchWriter(db, max_batch_size=3, max_batch_age=60)
+    writer.add_many([
+        ("dev-1", "2024-01-01T12:00:00Z", 22.5, None, None, 1.0),
+        ("dev-1", "2024-01-01T12:00:05Z", "n/a", None, None, 1.1),
+        ("dev-1", "2024-01-01T12:00:10Z", 22.7, None, None, 1.2),
+    ], on_commit=lambda: acked.append(1))
+
+    assert acked == [1]
+    stats = writer.stats()
+    assert (stats['rows_written'], stats['rows_rejected'], stats['flush_errors']) == (2, 1, 0)
+    assert stats['duplicates_skipped'] == 0
+
+def test_batch_writer_reports_dropped_acks(mock_db):
+    """Without a spool a lost batch calls on_flush_failure so its messages can be redelivered."""
+    mock_db.mock_cursor.executemany.side_effect = mysql.connector.Error("boom")
+    on_flush_failure = MagicMock()
+    writer = BatchWriter(mock_db, max_batch_size=1, max_batch_age=60, on_flush_failure=on_flush_failure)
+
+    writer.add("dev-1", datetime.datetime.now())
+    on_flush_failure.assert_not_called()
+    writer.add("dev-1", datetime.datetime.now(), on_commit=MagicMock())
+    on_flush_failure.assert_called_once_with()
+
+def test_batch_writer_add_many_keeps_readings_together(mock_db):
+    """add_many buffers a whole envelope and runs its callback once."""
+    acked = []
+    writer = BatchWriter(mock_db, max_batch_size=100, max_batch_age=60)
+    writer.add_many([
+        ("dev-1", "2024-01-01T12:00:00Z", 22.5, None, None, 1.0),
+        ("dev-1", "2024-01-01T12:00:05Z", 22.6, None, None, 1.1),
+    ], on_commit=lambda: acked.append(1))
+    assert writer.pending() == 2
+
+    mock_db.mock_cursor.rowcount = 2
+    writer.flush()
+
+    [insert] = reading_inserts(mock_db)
+    _, rows = insert[0]
+    assert [row[1] for row in rows] == ["dev-1", "dev-1"]
+    assert acked == [1]
+
+def test_slow_queries_do_not_stall_the_eventlet_hub(mock_db):
+    """Concurrent slow queries run on real threads while the hub keeps serving heartbeats."""
+    eventlet = pytest.importorskip('eventlet')
+    mock_db.executor = BlockingExecutor(size=4)
+    # time.sleep is not monkey patched here, so it blocks the OS thread like a mysql.connector call
+    mock_db.mock_cursor.execute.side_effect = lambda *args: time.sleep(0.3)
+    mock_db.mock_cursor.fetchall.return_value = []
+    gaps = []
+
+    def heartbeat():
+        # Stands in for Engine.IO's ping loop, a green thread on the same hub
+        last = time.monotonic()
+        for _ in range(30):
+            eventlet.sleep(0.01)
+            now = time.monotonic()
+            gaps.append(now - last)
+            last = now
+
+    beat = eventlet.spawn(heartbeat)
+    queries = [eventlet.spawn(mock_db.get_hourly_trend, '24h') for _ in range(4)]
+
+    assert [query.wait() for query in queries] == [[]] * 4
+    beat.wait()
+    assert max(gaps) < 0.15
+    assert mock_db.executor.stats()['offloaded'] == 4
+
+def test_executor_calls_directly_from_other_threads(mock_db):
+    """Threads that are not the hub's (e.g. the batch writer) query directly."""
+    pytest.importorskip('eventlet')
+    mock_db.executor = BlockingExecutor(size=4)
+    writer = BatchWriter(mock_db, max_batch_size=100, max_batch_age=0.05)
+    writer.start()
+    writer.add("dev-1", datetime.datetime.now())
+
+    deadline = time.monotonic() + 2
+    while writer.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.close()
+
+    assert mock_db.executor.stats()['direct'] == 1
+    assert mock_db.executor.stats()['offloaded'] == 0
+
+def test_insert_readings_merges_rollup_deltas(mock_db):
+    """Fully written batches add their per-bucket deltas to the hourly and daily rollups."""
+    rows = [
+        (datetime.datetime(2024, 1, 1, 12, 59, 59), "dev-1", 20.0, None, None, 1.0),
+        (datetime.datetime(2024, 1, 1, 13, 0, 0), "dev-1", 22.0, None, None, 3.0),
+    ]
+    mock_db.mock_cursor.rowcount = 2
+    mock_db.insert_readings(rows, ignore_duplicates=True)
+
+    calls = mock_db.mock_cursor.executemany.call_args_list
+    assert [c[0][0] for c in calls[1:]] == [merge_query(HOURLY_TABLE), merge_query(DAILY_TABLE)]
+    hourly, daily = calls[1][0][1], calls[2][0][1]
+    assert [row[0] for row in hourly] == [datetime.datetime(2024, 1, 1, 12), datetime.datetime(2024, 1, 1, 13)]
+    assert len(daily) == 1 and daily[0][2] == 2
+    mock_db.mock_cursor.execute.assert_not_called()
+
+def test_insert_readings_rebuilds_buckets_when_duplicates_were_skipped(mock_db):
+    """With skipped duplicates the touched buckets are recomputed from power_readings."""
+    rows = [
+        (datetime.datetime(2024, 1, 1, 12, 0, 0), "dev-1", 20.0, None, None, 1.0),
+        (datetime.datetime(2024, 1, 1, 12, 0, 0), "dev-1", 20.0, None, None, 1.0),
+    ]
+    mock_db.mock_cursor.rowcount = 1
+    mock_db.insert_readings(rows, ignore_duplicates=True)
+
+    assert len(mock_db.mock_cursor.executemany.call_args_list) == 1
+    hourly_call, daily_call = mock_db.mock_cursor.execute.call_args_list
+    assert hourly_call[0] == (rebuild_hourly_query(by_device=True),
+                              (datetime.datetime(2024, 1, 1, 12), datetime.datetime(2024, 1, 1, 13), "dev-1"))
+    assert daily_call[0] == (rebuild_daily_query(by_device=True),
+                             (datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 2), "dev-1"))
+    mock_db.mock_connection.commit.assert_called_once()
+
+def test_insert_readings_skips_rollups_when_nothing_was_written(mock_db):
+    mock_db.mock_cursor.rowcount = 0
+    mock_db.insert_readings([(datetime.datetime(2024, 1, 1), "dev-1", None, None, None, 1.0)],
+                            ignore_duplicates=True)
+
+    assert len(mock_db.mock_cursor.executemany.call_args_list) == 1
+    mock_db.mock_cursor.execute.assert_not_called()
+
+def test_rebuild_rollups_covers_whole_days(mock_db):
+    mock_db.mock_cursor.rowcount = 24
+    result = mock_db.rebuild_rollups(datetime.datetime(2024, 1, 1, 7, 30), datetime.datetime(2024, 1, 1, 9))
+
+    hourly_call, daily_call = mock_db.mock_cursor.execute.call_args_list
+    assert hourly_call[0] == (rebuild_hourly_query(), (datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 2)))
+    assert daily_call[0][0] == rebuild_daily_query()
+    assert result == (24, 24)
+
+def test_get_trend_formats_epoch_buckets(mock_db):
+    mock_db.mock_cursor.fetchall.return_value = [
+        {'bucket_epoch': 1704067200 + 900, 'readings_count': 3, 'avg_temperature': 21.5, 'avg_humidity': None,
+         'avg_brightness': None, 'avg_electric': 2.0, 'total_electric': 6.0, 'min_electric': 1.0,
+         'max_electric': 3.0},
+    ]
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    [row] = mock_db.get_trend(start, start + datetime.timedelta(hours=1), '15m')
+
+    assert row['timestamp'] == '2024-01-01 00:15:00'
+    assert (row['electric_avg'], row['electric_min'], row['electric_max']) == (2.0, 1.0, 3.0)
+    params = mock_db.mock_cursor.execute.call_args[0][1]
+    assert params[0] == datetime.datetime(2024, 1, 1)
+
+def test_get_trend_limits_bucket_count(mock_db):
+    start = datetime.datetime(2024, 1, 1)
+    with pytest.raises(ValueError):
+        mock_db.get_trend(start, start + datetime.timedelta(days=30), '1m')
+    with pytest.raises(ValueError):
+        mock_db.get_trend(start, start + datetime.timedelta(days=1), '2h')
+    assert mock_db.get_trend(start, start, '1h') == []
+    mock_db.mock_cursor.execute.assert_not_called()
+
+def test_fetch_power_data_filters_and_continues_after_cursor(mock_db):
+    """Pages continue after the (timestamp, id) of the previous page's last row."""
+    last = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    mock_db.fetch_power_data(limit=50, device_code="dev-1", start=datetime.datetime(2024, 1, 1),
+                             before=(last, 4711, "dev-1"))
+
+    query, params = mock_db.mock_cursor.execute.call_args[0]
+    assert ("WHERE device_code = %s AND timestamp >= %s AND timestamp <= %s AND (timestamp < %s OR id < %s) "
+            "ORDER BY timestamp DESC, id DESC LIMIT %s") in query
+    assert 'OFFSET' not in query
+    assert params == ("dev-1", datetime.datetime(2024, 1, 1), last, last, 4711, 50)
+
+def test_offset_timestamps_are_stored_and_queried_as_utc(mock_db):
+    """A +09:00 reading is written as UTC, so UTC query bounds around it find it."""
+    kst = datetime.timezone(datetime.timedelta(hours=9))
+    BatchWriter(mock_db, max_batch_size=1, max_batch_age=60).add("dev-1", "2024-01-01T09:30:00+09:00", 1.0)
+    mock_db.insert_reading("dev-2", datetime.datetime(2024, 1, 1, 9, 45, tzinfo=kst))
+
+    [batch] = reading_inserts(mock_db)
+    stored = batch[0][1][0][0]
+    single = mock_db.mock_cursor.execute.call_args_list[0][0][1][0]
+    assert (stored, single) == (datetime.datetime(2024, 1, 1, 0, 30), datetime.datetime(2024, 1, 1, 0, 45))
+    hourly = [c for c in mock_db.mock_cursor.executemany.call_args_list if c[0][0] == merge_query(HOURLY_TABLE)]
+    assert hourly[0][0][1][0][0] == datetime.datetime(2024, 1, 1, 0, 0)
+
+    mock_db.fetch_power_data(start=datetime.datetime(2024, 1, 1, 9, 0, tzinfo=kst),
+                             end=datetime.datetime(2024, 1, 1, 1, 0, tzinfo=datetime.timezone.utc))
+    _, params = mock_db.mock_cursor.execute.call_args[0]
+    assert params[:2] == (datetime.datetime(2024, 1, 1, 0, 0), datetime.datetime(2024, 1, 1, 1, 0))
+    assert params[0] <= stored < params[1]
+
+def test_fetch_power_data_resolves_cursor_of_row_without_id(mock_db):
+    """Cursors of rows served from memory are completed with the id stored in MySQL."""
+    last = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    mock_db.mock_cursor.fetchone.return_value = {'id': 99}
+
+    mock_db.fetch_power_data(limit=10, before=(last, None, "dev-7"))
+
+    lookup, page = mock_db.mock_cursor.execute.call_args_list
+    assert lookup[0][1] == ("dev-7", last)
+    assert page[0][1] == (last, last, 99, 10)
+
+def test_fetch_power_data_continues_unstored_cursor_row_by_device(mock_db):
+    """Without an id, rows sharing the cursor timestamp are kept and continued by device_code."""
+    last = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    mock_db.mock_cursor.fetchone.return_value = None
+
+    mock_db.fetch_power_data(limit=10, before=(last, None, "dev-7"))
+
+    lookup, page = mock_db.mock_cursor.execute.call_args_list
+    assert "timestamp <= %s AND (timestamp < %s OR device_code < %s)" in page[0][0]
+    assert page[0][1] == (last, last, "dev-7", 10)
+
+def test_iter_readings_streams_chunks_from_an_unbuffered_cursor(mock_db):
+    rows = [(i, datetime.datetime(2024, 1, 1), "dev-1", None, None, None, 1.0) for i in range(5)]
+    # iter_readings holds the pooled connection and cursor itself, without context managers
+    conn = mock_db.cnx_pool.get_connection.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchmany.side_effect = [rows[:2], rows[2:4], rows[4:], []]
+
+    chunks = list(mock_db.iter_readings(device_code="dev-1", chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    conn.cursor.assert_called_once_with()
+    query, params = cursor.execute.call_args[0]
+    assert query.endswith("FROM power_readings WHERE device_code = %s ORDER BY timestamp, id")
+    assert params == ("dev-1",)
+    conn.close.assert_called_once()
+    conn.disconnect.assert_not_called()
+
+def test_abandoned_export_drops_the_connection(mock_db):
+    """An export closed early does not drain the rest of the result before the connection is reused."""
+    conn = mock_db.cnx_pool.get_connection.return_value
+    conn.cursor.return_value.fetchmany.return_value = [(1,)]
+
+    chunks = mock_db.iter_readings()
+    next(chunks)
+    chunks.close()
+
+    conn.disconnect.assert_called_once()
+    conn.close.assert_called_once()
+
+def test_get_data_version_reads_newest_row_by_primary_key(mock_db):
+    created = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    mock_db.mock_cursor.fetchone.return_value = (42, created)
+
+    assert mock_db.get_data_version() == (42, created)
+    query = mock_db.mock_cursor.execute.call_args[0][0]
+    assert query == "SELECT id, created_at FROM power_readings ORDER BY id DESC LIMIT 1"
+
+    mock_db.mock_cursor.fetchone.return_value = None
+    assert mock_db.get_data_version() == (0, None)
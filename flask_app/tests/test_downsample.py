@@ -0,0 +1,83 @@
+import datetime
+import math
+
+import numpy as np
+
+from modules.downsample import downsample_rows, lttb_indices
+
+
+def reference_lttb(points, threshold):
+    """Straightforward LTTB (Steinarsson 2013) to check the vectorized version against."""
+    n = len(points)
+    every = (n - 2) / (threshold - 2)
+    selected, a = [0], 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        following = points[end:next_end] if i < threshold - 3 else points[n - 1:]
+        avg_x = sum(p[0] for p in following) / len(following)
+        avg_y = sum(p[1] for p in following) / len(following)
+        best, best_area = start, -1
+        for j in range(start, end):
+            area = abs((points[a][0] - avg_x) * (points[j][1] - points[a][1])
+                       - (points[a][0] - points[j][0]) * (avg_y - points[a][1]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    return selected + [n - 1]
+
+
+def test_lttb_matches_reference_implementation():
+    rng = np.random.default_rng(7)
+    x = np.arange(1000, dtype=float)
+    y = np.cumsum(rng.normal(size=1000))
+
+    kept = lttb_indices(x, y, 100)
+
+    assert len(kept) == 100
+    assert list(kept) == reference_lttb(list(zip(x, y)), 100)
+
+
+def test_lttb_keeps_isolated_spikes():
+    x = np.arange(5000, dtype=float)
+    y = np.zeros(5000)
+    y[1234], y[4000] = 900.0, -50.0
+
+    kept = lttb_indices(x, y, 50)
+
+    assert 1234 in kept and 4000 in kept
+    assert kept[0] == 0 and kept[-1] == 4999
+
+
+def test_lttb_returns_everything_when_under_the_limit():
+    assert list(lttb_indices(np.arange(5.0), np.arange(5.0), 10)) == [0, 1, 2, 3, 4]
+
+
+def test_lttb_tolerates_missing_values():
+    y = np.array([1.0, math.nan, math.nan, 5.0, math.nan, math.nan, 2.0, 3.0])
+
+    kept = lttb_indices(np.arange(8.0), y, 4)
+
+    assert len(kept) == 4 and 3 in kept
+
+
+def test_downsample_rows_keeps_newest_first_order():
+    base = datetime.datetime(2024, 1, 1)
+    rows = [{'timestamp': base + datetime.timedelta(seconds=i), 'electric': 100.0 if i == 42 else 1.0}
+            for i in reversed(range(300))]
+
+    kept = downsample_rows(rows, 20)
+
+    assert len(kept) == 20
+    assert kept[0] is rows[0] and kept[-1] is rows[-1]
+    assert any(row['electric'] == 100.0 for row in kept)
+    assert [row['timestamp'] for row in kept] == sorted((row['timestamp'] for row in kept), reverse=True)
+
+
+def test_downsample_rows_reads_formatted_trend_timestamps():
+    rows = [{'timestamp': f'2024-01-01 {h:02d}:00:00', 'electric_avg': float(h % 5)} for h in range(24)]
+
+    kept = downsample_rows(rows, 6, y_key='electric_avg')
+
+    assert len(kept) == 6 and kept[0] is rows[0]
@@ -0,0 +1,52 @@
+import datetime
+import json
+from decimal import Decimal
+
+import pytest
+
+from modules import encoder
+
+FIELDS = ('id', 'timestamp', 'device_code', 'electric')
+ROWS = [
+    (1, datetime.datetime(2024, 1, 1, 0, 0, 0, 250000), 'dev-1', Decimal('1.50')),
+    (2, datetime.datetime(2024, 1, 1, 0, 0, 5), 'dev-2', None),
+]
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def backend(request, monkeypatch):
+    if request.param == 'stdlib':
+        monkeypatch.setattr(encoder, 'orjson', None)
+    elif encoder.orjson is None:
+        pytest.skip('orjson not installed')
+    return request.param
+
+
+def test_rows_encode_datetimes_and_decimals(backend):
+    data = json.loads(encoder.dumps(encoder.row_objects(FIELDS, ROWS)))
+
+    assert data[0] == {'id': 1, 'timestamp': '2024-01-01T00:00:00.250000', 'device_code': 'dev-1', 'electric': 1.5}
+    assert data[1]['electric'] is None
+
+
+def test_columns_use_epoch_milliseconds(backend):
+    data = json.loads(encoder.dumps(encoder.columns(FIELDS, ROWS)))
+
+    assert data['timestamp'] == [1704067200250, 1704067205000]
+    assert data['electric'] == [1.5, None]
+    assert encoder.columns(FIELDS, []) == {field: [] for field in FIELDS}
+
+
+def test_as_tuples_accepts_dict_rows():
+    dicts = [{'id': 1, 'timestamp': None, 'device_code': 'dev-1', 'electric': 2.0}, {'id': 2}]
+
+    assert encoder.as_tuples(dicts, FIELDS) == [(1, None, 'dev-1', 2.0), (2, None, None, None)]
+    assert encoder.as_tuples(ROWS, FIELDS) == ROWS
+
+
+def test_json_response_is_encoded_once():
+    response = encoder.json_response({'a': [1, 2]}, status=201)
+
+    assert response.status_code == 201
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.get_data()) == {'a': [1, 2]}
@@ -10,6 +10,7 @@ def mock_db():
         {"id": 1, "url": "/reports/r1.csv", "created_at": "2025-06-28T00:00:00"}
     ]
     db.create_esg_report.return_value = (2, "/reports/r2.csv")
+    db.get_report_version.return_value = ("1.1", None)
     return db
 
 @pytest.fixture
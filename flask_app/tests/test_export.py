@@ -0,0 +1,58 @@
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+from modules.export import check_format, export_chunks
+
+ROWS = [
+    (1, datetime.datetime(2024, 1, 1, 0, 0, 0), 'dev-1', 21.5, 40.0, 300, 1.25),
+    (2, datetime.datetime(2024, 1, 1, 0, 0, 5), 'dev-2', None, None, None, 2.5),
+    (3, datetime.datetime(2024, 1, 1, 0, 0, 10), 'dev-1', 21.75, 41.0, 310, 1.5),
+]
+
+
+def chunked(rows, size):
+    return (rows[i:i + size] for i in range(0, len(rows), size))
+
+
+def test_ndjson_yields_one_piece_per_chunk():
+    pieces = list(export_chunks('ndjson', chunked(ROWS, 2)))
+
+    assert len(pieces) == 2
+    lines = b''.join(pieces).decode().splitlines()
+    assert json.loads(lines[0]) == {'id': 1, 'timestamp': '2024-01-01T00:00:00', 'device_code': 'dev-1',
+                                    'temperature': 21.5, 'humidity': 40.0, 'brightness': 300, 'electric': 1.25}
+    assert json.loads(lines[1])['temperature'] is None
+
+
+def test_csv_has_header_and_iso_timestamps():
+    data = b''.join(export_chunks('csv', chunked(ROWS, 1))).decode()
+
+    rows = list(csv.DictReader(io.StringIO(data)))
+    assert [row['id'] for row in rows] == ['1', '2', '3']
+    assert rows[1]['timestamp'] == '2024-01-01T00:00:05'
+    assert rows[1]['temperature'] == ''
+
+
+def test_csv_of_nothing_is_just_the_header():
+    assert b''.join(export_chunks('csv', iter([]))) == b'id,timestamp,device_code,temperature,humidity,brightness,electric\r\n'
+
+
+def test_parquet_writes_a_row_group_per_chunk():
+    pq = pytest.importorskip('pyarrow.parquet')
+    data = b''.join(export_chunks('parquet', chunked(ROWS, 2)))
+
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.metadata.num_row_groups == 2
+    table = parquet.read()
+    assert table.column('device_code').to_pylist() == ['dev-1', 'dev-2', 'dev-1']
+    assert table.column('timestamp').to_pylist()[2] == datetime.datetime(2024, 1, 1, 0, 0, 10)
+
+
+def test_unknown_format_is_rejected_before_streaming():
+    with pytest.raises(ValueError):
+        export_chunks('xlsx', iter([]))
+    assert check_format('csv') == 'csv'
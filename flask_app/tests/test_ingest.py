@@ -0,0 +1,119 @@
+import pytest
+import threading
+import time
+from unittest.mock import MagicMock
+
+from modules.ingest import IngestPipeline
+from modules.mqtt_client import MQTTClient
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_workers_process_submitted_payloads():
+    """Payloads submitted to the pipeline reach the handler on worker threads."""
+    seen = []
+    pipeline = IngestPipeline(lambda payload, topic, ack: seen.append((payload, threading.current_thread().name)),
+                              maxsize=10, workers=2)
+    pipeline.start()
+    try:
+        for i in range(5):
+            assert pipeline.submit(f'{i}'.encode())
+        assert wait_until(lambda: len(seen) == 5)
+    finally:
+        pipeline.stop()
+
+    assert sorted(p for p, _ in seen) == [b'0', b'1', b'2', b'3', b'4']
+    assert all(name.startswith('ingest-worker') for _, name in seen)
+    stats = pipeline.stats()
+    assert stats['processed'] == 5
+    assert stats['wait_ms']['count'] == 5
+
+
+def test_drop_oldest_policy_discards_head_of_queue():
+    """With drop_oldest, a full queue sheds its oldest payload."""
+    seen = []
+    pipeline = IngestPipeline(lambda payload, topic, ack: seen.append(payload), maxsize=2, workers=1, policy='drop_oldest')
+    for i in range(4):
+        pipeline.submit(f'{i}'.encode())
+
+    assert pipeline.depth() == 2
+    assert pipeline.stats()['dropped'] == 2
+
+    pipeline.start()
+    pipeline.stop()
+    assert seen == [b'2', b'3']
+
+
+def test_spill_policy_overflows_to_file(tmp_path):
+    """With spill, overflow payloads go to disk and are processed after the queue."""
+    seen = []
+    pipeline = IngestPipeline(lambda payload, topic, ack: seen.append(payload), maxsize=1, workers=1, policy='spill',
+                              spill_path=str(tmp_path / 'spill.bin'))
+    for i in range(3):
+        pipeline.submit(f'{i}'.encode(), topic='power/measurement')
+
+    assert pipeline.depth() == 1
+    assert pipeline.spill_depth() == 2
+
+    pipeline.start()
+    pipeline.stop()
+    assert seen == [b'0', b'1', b'2']
+    assert pipeline.spill_depth() == 0
+
+
+def test_block_policy_waits_for_room():
+    """With block, submit() waits until a worker frees a slot."""
+    release = threading.Event()
+    pipeline = IngestPipeline(lambda payload, topic, ack: release.wait(), maxsize=1, workers=1, policy='block')
+    pipeline.start()
+    try:
+        pipeline.submit(b'first')  # taken by the worker, which then blocks
+        assert wait_until(lambda: pipeline.depth() == 0)
+        pipeline.submit(b'second')  # fills the queue
+
+        submitted = threading.Event()
+        threading.Thread(target=lambda: (pipeline.submit(b'third'), submitted.set()), daemon=True).start()
+        assert not submitted.wait(0.1)
+
+        release.set()
+        assert submitted.wait(2)
+    finally:
+        release.set()
+        pipeline.stop()
+
+
+def test_invalid_policy_is_rejected():
+    with pytest.raises(ValueError):
+        IngestPipeline(lambda payload, topic, ack: None, policy='unbounded')
+
+
+def test_mqtt_on_message_only_enqueues(mocker):
+    """With a pipeline, the paho callback enqueues raw bytes and never calls the handler."""
+    mocker.patch('paho.mqtt.client.Client')
+    handler = MagicMock()
+    pipeline = MagicMock()
+    client = MQTTClient(handler, topics=['power/measurement'], pipeline=pipeline)
+
+    msg = MagicMock(topic='power/measurement', payload=b'{"deviceCode": 1}')
+    client.on_message(None, None, msg)
+
+    pipeline.submit.assert_called_once_with(b'{"deviceCode": 1}', 'power/measurement', None)
+    handler.assert_not_called()
+
+
+def test_ack_is_passed_to_handler_including_spilled(tmp_path):
+    """Ack callbacks travel with their payload, also through the spill file."""
+    acked = []
+    pipeline = IngestPipeline(lambda payload, topic, ack: ack(), maxsize=1, workers=1, policy='spill',
+                              spill_path=str(tmp_path / 'spill.bin'))
+    for i in range(3):
+        pipeline.submit(f'{i}'.encode(), 'power/measurement', ack=lambda i=i: acked.append(i))
+
+    pipeline.start()
+    pipeline.stop()
+    assert acked == [0, 1, 2]
@@ -0,0 +1,66 @@
+import pytest
+
+from modules.readings import Reading, reading_from_message, readings_from_batch
+
+
+def test_reading_from_message():
+    data = {"deviceCode": "dev-1", "timestamp": "2024-01-01T12:00:00Z",
+            "temp": 22.5, "humidity": 55.0, "brightness": 700, "electric": 3.14}
+    assert reading_from_message(data) == Reading("dev-1", "2024-01-01T12:00:00Z", 22.5, 55.0, 700, 3.14)
+    assert reading_from_message({"deviceCode": "dev-1"}) is None
+    assert reading_from_message("not a dict") is None
+
+
+def test_metric_fields_are_coerced_to_numbers_or_null():
+    data = {"deviceCode": "dev-1", "timestamp": "2024-01-01T12:00:00Z",
+            "temp": "n/a", "humidity": "55.5", "brightness": 700.4, "electric": float("nan")}
+    assert reading_from_message(data) == Reading("dev-1", "2024-01-01T12:00:00Z", None, 55.5, 700, None)
+
+    columnar = {"deviceCode": "dev-1", "timestamp": ["2024-01-01T12:00:00Z"],
+                "temp": [True], "humidity": [{"v": 1}], "brightness": ["12"], "electric": ["1e999"]}
+    assert readings_from_batch(columnar) == [Reading("dev-1", "2024-01-01T12:00:00Z", None, None, 12, None)]
+
+
+def test_batch_as_list_of_messages():
+    data = [
+        {"deviceCode": "dev-1", "timestamp": "2024-01-01T12:00:00Z", "temp": 22.5},
+        {"deviceCode": "dev-2", "timestamp": "2024-01-01T12:00:01Z", "electric": 1.5},
+        {"deviceCode": "dev-3"},  # incomplete, dropped
+    ]
+    readings = readings_from_batch(data)
+    assert [r.device_code for r in readings] == ["dev-1", "dev-2"]
+    assert readings[1].electric == 1.5
+
+
+def test_batch_envelope_shares_device_code():
+    data = {"deviceCode": "gw-1", "readings": [
+        {"timestamp": "2024-01-01T12:00:00Z", "temp": 22.5},
+        {"deviceCode": "dev-9", "timestamp": "2024-01-01T12:00:01Z"},
+    ]}
+    readings = readings_from_batch(data)
+    assert [r.device_code for r in readings] == ["gw-1", "dev-9"]
+
+
+def test_columnar_batch():
+    data = {
+        "deviceCode": "dev-1",
+        "timestamp": ["2024-01-01T12:00:00Z", "2024-01-01T12:00:05Z", None],
+        "temp": [22.5, 22.6, 22.7],
+        "electric": [1.0, 1.1, 1.2],
+    }
+    readings = readings_from_batch(data)
+    assert readings == [
+        Reading("dev-1", "2024-01-01T12:00:00Z", 22.5, None, None, 1.0),
+        Reading("dev-1", "2024-01-01T12:00:05Z", 22.6, None, None, 1.1),
+    ]
+
+
+@pytest.mark.parametrize("data", [
+    {"deviceCode": "dev-1", "timestamp": ["2024-01-01T12:00:00Z"], "temp": [1.0, 2.0]},
+    {"timestamp": ["2024-01-01T12:00:00Z"]},
+    {"deviceCode": "dev-1", "timestamp": "2024-01-01T12:00:00Z"},
+    "nonsense",
+])
+def test_malformed_batches_are_rejected(data):
+    with pytest.raises(ValueError):
+        readings_from_batch(data)
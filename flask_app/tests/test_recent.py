@@ -0,0 +1,129 @@
+import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from modules.readings import Reading
+from modules.recent import RecentReadings
+
+
+def reading(device, second, electric=1.0):
+    return Reading(device, f"2024-01-01T12:00:{second:02d}Z", 22.5, None, 700, electric)
+
+
+def test_latest_returns_newest_first_in_fetch_power_data_shape():
+    store = RecentReadings(capacity=10)
+    store.add_many([reading('a', 1), reading('b', 2)])
+
+    rows = store.latest(5)
+
+    assert [r['device_code'] for r in rows] == ['b', 'a']
+    assert rows[0] == {'id': None, 'timestamp': datetime.datetime(2024, 1, 1, 12, 0, 2), 'device_code': 'b',
+                       'temperature': 22.5, 'humidity': None, 'brightness': 700, 'electric': 1.0}
+
+
+def test_ring_buffer_keeps_last_capacity_readings():
+    store = RecentReadings(capacity=3)
+    store.add_many(reading('a', i, electric=float(i)) for i in range(5))
+
+    assert len(store) == 3
+    assert [r['electric'] for r in store.latest(10)] == [4.0, 3.0, 2.0]
+    assert store.covers(3)
+    assert not store.covers(4)
+
+
+def test_latest_per_device_survives_ring_eviction():
+    store = RecentReadings(capacity=2)
+    store.add(*reading('quiet', 0))
+    store.add_many(reading('busy', i) for i in range(1, 4))
+
+    assert store.latest_for('quiet')['timestamp'] == datetime.datetime(2024, 1, 1, 12, 0, 0)
+    assert store.latest_for('busy')['timestamp'] == datetime.datetime(2024, 1, 1, 12, 0, 3)
+    assert store.latest_for('missing') is None
+
+
+def test_late_reading_does_not_replace_newer_latest():
+    store = RecentReadings()
+    store.add(*reading('a', 5))
+    store.add(*reading('a', 1))
+
+    assert store.latest_for('a')['timestamp'].second == 5
+    assert len(store) == 2
+
+
+def test_redelivered_and_unparseable_readings_are_skipped():
+    store = RecentReadings()
+
+    assert store.add(*reading('a', 1))
+    assert not store.add(*reading('a', 1))
+    assert not store.add('a', 'not a timestamp')
+    assert len(store) == 1
+
+
+def test_warm_loads_ring_and_quiet_devices_from_database():
+    db = MagicMock()
+    db.fetch_power_data.return_value = [
+        {'id': 2, 'timestamp': datetime.datetime(2024, 1, 1, 12, 0, 2), 'device_code': 'a',
+         'temperature': Decimal('25.5'), 'humidity': None, 'brightness': 1, 'electric': 2.0},
+        {'id': 1, 'timestamp': datetime.datetime(2024, 1, 1, 12, 0, 1), 'device_code': 'a',
+         'temperature': 24.0, 'humidity': None, 'brightness': 1, 'electric': 1.0},
+    ]
+    db.fetch_latest_per_device.return_value = [
+        {'id': 2, 'timestamp': datetime.datetime(2024, 1, 1, 12, 0, 2), 'device_code': 'a',
+         'temperature': 25.5, 'humidity': None, 'brightness': 1, 'electric': 2.0},
+        {'id': 0, 'timestamp': datetime.datetime(2023, 12, 31), 'device_code': 'old',
+         'temperature': None, 'humidity': None, 'brightness': None, 'electric': 0.5},
+    ]
+    store = RecentReadings(capacity=5)
+
+    assert store.warm(db) == 2
+
+    db.fetch_power_data.assert_called_once_with(limit=5)
+    assert [r['id'] for r in store.latest(5)] == [2, 1]
+    assert store.latest(1)[0]['temperature'] == 25.5
+    assert store.latest_for('old')['electric'] == 0.5
+    assert len(store) == 2
+
+
+def test_since_seq_replays_only_what_the_ring_still_holds():
+    store = RecentReadings(capacity=3)
+    seqs = [store.add(*reading('a' if i % 2 else 'b', i)) for i in range(5)]
+
+    assert seqs == [1, 2, 3, 4, 5]
+    assert [e['seq'] for e in store.since_seq(2)] == [3, 4, 5]
+    assert [e['seq'] for e in store.since_seq(2, devices={'a'})] == [4]
+    assert store.since_seq(5) == []
+    # Reading 2 was evicted, and seq 9 was never issued
+    assert store.since_seq(1) is None
+    assert store.since_seq(9) is None
+    # More matches than the limit
+    assert store.since_seq(2, limit=2) is None
+
+
+def test_since_timestamp_detects_evicted_history():
+    store = RecentReadings(capacity=3)
+    for i in range(5):
+        store.add(*reading('a', i))
+
+    assert [e['timestamp'] for e in store.since('2024-01-01T12:00:02Z')] == \
+        ['2024-01-01T12:00:03', '2024-01-01T12:00:04']
+    assert store.since('2024-01-01T12:00:00Z') is None
+    assert store.since('garbage') is None
+
+
+def test_snapshot_has_latest_reading_per_device():
+    store = RecentReadings()
+    store.add_many([reading('a', 1), reading('b', 2), reading('a', 3)])
+
+    snapshot = {e['device_code']: e['timestamp'] for e in store.snapshot()}
+
+    assert snapshot == {'a': '2024-01-01T12:00:03', 'b': '2024-01-01T12:00:02'}
+    assert [e['device_code'] for e in store.snapshot(devices={'b'})] == ['b']
+
+
+def test_offset_timestamps_are_kept_as_utc_like_the_database():
+    store = RecentReadings(capacity=10)
+    store.add_many([Reading('a', "2024-01-01T21:00:01+09:00", 22.5, None, 700, 1.0), reading('b', 2)])
+
+    assert [r['timestamp'] for r in store.latest(5)] == [datetime.datetime(2024, 1, 1, 12, 0, 2),
+                                                         datetime.datetime(2024, 1, 1, 12, 0, 1)]
+    assert [e['device_code'] for e in store.since("2024-01-01T21:00:00+09:00")] == ['a', 'b']
@@ -0,0 +1,95 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from modules.relay import LocalRelay, RedisRelay, create_relay
+
+
+class FakeRedis:
+    """In-process stand-in for a Redis server shared by several relays."""
+
+    def __init__(self):
+        self.subscribers = []
+
+    def publish(self, channel, data):
+        for relay in self.subscribers:
+            if relay.channel == channel:
+                relay.handle_message(data.encode())
+
+
+def event(device, electric):
+    return {'device_code': device, 'timestamp': '2024-01-01T00:00:00Z', 'temperature': None,
+            'humidity': None, 'brightness': None, 'electric': electric}
+
+
+def test_local_relay_delivers_to_every_handler():
+    relay = LocalRelay()
+    first, second = MagicMock(), MagicMock()
+    relay.subscribe(first)
+    relay.subscribe(second)
+
+    relay.publish([event('dev-1', 1.0)])
+    relay.publish([])
+
+    first.assert_called_once_with([event('dev-1', 1.0)])
+    second.assert_called_once_with([event('dev-1', 1.0)])
+    assert relay.stats()['published'] == 1
+
+
+def test_failing_handler_does_not_stop_the_others():
+    relay = LocalRelay()
+    handler = MagicMock()
+    relay.subscribe(MagicMock(side_effect=RuntimeError('boom')))
+    relay.subscribe(handler)
+
+    relay.publish([event('dev-1', 1.0)])
+
+    handler.assert_called_once()
+
+
+def test_redis_relay_reaches_every_worker_once():
+    """The publishing worker handles its readings locally and skips its own queue message."""
+    server = FakeRedis()
+    workers = [RedisRelay(channel='readings', client=server) for _ in range(3)]
+    received = {i: [] for i in range(3)}
+    for i, relay in enumerate(workers):
+        relay.subscribe(received[i].extend)
+        server.subscribers.append(relay)
+
+    workers[0].publish([event('dev-1', 1.0), event('dev-2', 2.0)])
+
+    assert all(len(events) == 2 for events in received.values())
+    assert received[2][1]['electric'] == 2.0
+    assert workers[0].stats()['received'] == 0
+    assert workers[1].stats()['received'] == 2
+
+
+def test_redis_relay_keeps_serving_locally_when_publish_fails():
+    client = MagicMock()
+    client.publish.side_effect = ConnectionError('redis down')
+    relay = RedisRelay(channel='readings', client=client)
+    handler = MagicMock()
+    relay.subscribe(handler)
+
+    relay.publish([event('dev-1', 1.0)])
+
+    handler.assert_called_once()
+    assert relay.stats()['publish_errors'] == 1
+
+
+def test_redis_relay_ignores_malformed_messages():
+    relay = RedisRelay(channel='readings', client=MagicMock())
+    handler = MagicMock()
+    relay.subscribe(handler)
+
+    relay.handle_message(b'not json')
+    relay.handle_message(json.dumps({'host_id': 'other', 'readings': [event('dev-1', 1.0)]}))
+
+    handler.assert_called_once_with([event('dev-1', 1.0)])
+
+
+def test_create_relay_picks_backend_from_url():
+    assert type(create_relay(None)) is LocalRelay
+    with pytest.raises(ValueError):
+        create_relay('amqp://guest@rabbit//')
@@ -0,0 +1,123 @@
+import datetime
+import os
+import re
+
+from modules.rollups import (COLUMNS, DAILY_TABLE, HOURLY_TABLE, TREND_BUCKETS, affected_buckets, epoch_seconds,
+                             from_epoch_seconds, merge_query, rollup_deltas, stored_timestamp, trend_query,
+                             trend_segments)
+
+
+def as_dict(row):
+    return dict(zip(COLUMNS, row))
+
+
+def test_rollup_deltas_group_rows_by_hour_day_and_device():
+    rows = [
+        (datetime.datetime(2024, 1, 1, 10, 15), 'dev-1', 20.0, 40.0, 100, 1.0),
+        (datetime.datetime(2024, 1, 1, 10, 45), 'dev-1', 22.0, None, 300, 3.0),
+        (datetime.datetime(2024, 1, 1, 11, 5), 'dev-1', 21.0, 50.0, 200, 2.0),
+        (datetime.datetime(2024, 1, 1, 10, 30), 'dev-2', None, None, None, 5.0),
+    ]
+    hourly, daily = rollup_deltas(rows)
+
+    hourly = {(row[0], row[1]): as_dict(row) for row in hourly}
+    assert len(hourly) == 3
+    ten = hourly[(datetime.datetime(2024, 1, 1, 10), 'dev-1')]
+    assert ten['readings'] == 2
+    assert ten['first_timestamp'] == datetime.datetime(2024, 1, 1, 10, 15)
+    assert ten['last_timestamp'] == datetime.datetime(2024, 1, 1, 10, 45)
+    assert (ten['temperature_count'], ten['temperature_sum']) == (2, 42.0)
+    assert (ten['humidity_count'], ten['humidity_min'], ten['humidity_max']) == (1, 40.0, 40.0)
+    assert (ten['brightness_min'], ten['brightness_max']) == (100, 300)
+
+    other = hourly[(datetime.datetime(2024, 1, 1, 10), 'dev-2')]
+    assert other['temperature_count'] == 0 and other['temperature_min'] is None
+
+    daily = {(row[0], row[1]): as_dict(row) for row in daily}
+    day = daily[(datetime.date(2024, 1, 1), 'dev-1')]
+    assert day['readings'] == 3
+    assert (day['electric_sum'], day['electric_max']) == (6.0, 3.0)
+
+
+def test_rollup_deltas_use_the_values_mysql_stores():
+    """Timestamps lose their fraction and FLOAT columns their double precision, as in power_readings."""
+    rows = [(datetime.datetime(2024, 1, 1, 10, 59, 59, 600000, tzinfo=datetime.timezone.utc),
+             'dev-1', 0.1, None, 99.6, None)]
+    [hourly], _ = rollup_deltas(rows)
+
+    hourly = as_dict(hourly)
+    assert hourly['bucket'] == datetime.datetime(2024, 1, 1, 11)
+    assert hourly['first_timestamp'] == datetime.datetime(2024, 1, 1, 11, 0, 0)
+    assert hourly['temperature_sum'] != 0.1 and abs(hourly['temperature_sum'] - 0.1) < 1e-7
+    assert hourly['brightness_sum'] == 100
+
+
+def test_stored_timestamp_rounds_half_up():
+    assert stored_timestamp(datetime.datetime(2024, 1, 1, 0, 0, 0, 499999)) == datetime.datetime(2024, 1, 1)
+    assert stored_timestamp(datetime.datetime(2024, 1, 1, 0, 0, 0, 500000)) == datetime.datetime(2024, 1, 1, 0, 0, 1)
+
+
+def test_affected_buckets():
+    hours, days = affected_buckets([
+        (datetime.datetime(2024, 1, 1, 23, 30), 'dev-1', None, None, None, None),
+        (datetime.datetime(2024, 1, 2, 0, 10), 1001, None, None, None, None),
+    ])
+
+    assert hours == {(datetime.datetime(2024, 1, 1, 23), 'dev-1'), (datetime.datetime(2024, 1, 2, 0), '1001')}
+    assert days == {(datetime.date(2024, 1, 1), 'dev-1'), (datetime.date(2024, 1, 2), '1001')}
+
+
+def test_merge_query_adds_counts_and_keeps_extremes():
+    query = merge_query(DAILY_TABLE)
+
+    assert query.startswith('INSERT INTO power_rollup_daily (bucket, device_code, readings')
+    assert 'readings = readings + VALUES(readings)' in query
+    assert 'electric_min = LEAST(COALESCE(electric_min, VALUES(electric_min))' in query
+
+
+def test_trend_segments_read_whole_hours_and_days_from_rollups():
+    start = datetime.datetime(2024, 1, 1, 22, 30)
+    end = datetime.datetime(2024, 1, 4, 1, 15)
+
+    assert trend_segments(start, end, TREND_BUCKETS['1d']) == [
+        (None, start, datetime.datetime(2024, 1, 1, 23)),
+        (HOURLY_TABLE, datetime.datetime(2024, 1, 1, 23), datetime.datetime(2024, 1, 2)),
+        (DAILY_TABLE, datetime.datetime(2024, 1, 2), datetime.datetime(2024, 1, 4)),
+        (HOURLY_TABLE, datetime.datetime(2024, 1, 4), datetime.datetime(2024, 1, 4, 1)),
+        (None, datetime.datetime(2024, 1, 4, 1), end),
+    ]
+    assert [table for table, *_ in trend_segments(start, end, TREND_BUCKETS['1h'])] == [None, HOURLY_TABLE, None]
+    # Sub-hour buckets cannot be built from hourly rollups
+    assert trend_segments(start, end, TREND_BUCKETS['15m']) == [(None, start, end)]
+
+
+def test_trend_segments_skip_rollups_for_partial_hours():
+    start = datetime.datetime(2024, 1, 1, 10, 0, 0, 500000)
+    end = datetime.datetime(2024, 1, 1, 11, 30)
+
+    assert trend_segments(start, end, 3600) == [(None, start, end)]
+
+
+def test_trend_query_buckets_by_epoch_seconds():
+    query, params = trend_query(datetime.datetime(2024, 1, 1, 10, 30), datetime.datetime(2024, 1, 1, 13), 3600,
+                                device_code='dev-1')
+
+    assert "TIMESTAMPDIFF(SECOND, '1970-01-01', timestamp) DIV 3600 * 3600 AS bucket_epoch" in query
+    assert 'DATE_FORMAT' not in query
+    assert query.count('UNION ALL') == 1
+    assert params == [datetime.datetime(2024, 1, 1, 10, 30), datetime.datetime(2024, 1, 1, 11), 'dev-1',
+                      datetime.datetime(2024, 1, 1, 11), datetime.datetime(2024, 1, 1, 13), 'dev-1']
+    assert epoch_seconds(from_epoch_seconds(86400)) == 86400
+
+
+def test_backfill_migration_writes_every_rollup_column():
+    """mysql/migrations/003 spells out the rebuild queries; keep it in step with COLUMNS."""
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'mysql', 'migrations', '003_backfill_rollups.sql')
+    with open(path) as f:
+        sql = f.read()
+    statements = re.findall(r'INSERT INTO (\w+) \((.*?)\)\nSELECT(.*?)ON DUPLICATE KEY UPDATE(.*?);', sql, re.S)
+
+    assert [table for table, *_ in statements] == [HOURLY_TABLE, DAILY_TABLE]
+    for _, columns, _, updates in statements:
+        assert [c.strip() for c in columns.split(',')] == list(COLUMNS)
+        assert re.findall(r'(\w+) = VALUES\(\1\)', updates) == list(COLUMNS[2:])
@@ -0,0 +1,178 @@
+import pytest
+from collections import defaultdict
+from unittest.mock import MagicMock
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
+
+from modules.mqtt_client import MQTTClient, shared_topic
+
+CONNACK_SUCCESS = ReasonCode(PacketTypes.CONNACK, 'Success')
+
+
+class FakeBroker:
+    """In-process stand-in for Mosquitto's shared subscription dispatch.
+
+    Plain subscribers receive every message; members of a ``$share/<group>/``
+    subscription receive messages round-robin, one member per message.
+    """
+
+    def __init__(self):
+        self.plain = defaultdict(list)
+        self.groups = defaultdict(list)
+        self._next = defaultdict(int)
+
+    def subscribe(self, client, subscription):
+        if subscription.startswith('$share/'):
+            _, group, topic = subscription.split('/', 2)
+            self.groups[(group, topic)].append(client)
+        else:
+            self.plain[subscription].append(client)
+
+    def publish(self, topic, payload):
+        for client in self.plain[topic]:
+            client.deliver(topic, payload)
+        for (group, group_topic), members in self.groups.items():
+            if group_topic == topic and members:
+                index = self._next[(group, topic)] % len(members)
+                self._next[(group, topic)] += 1
+                members[index].deliver(topic, payload)
+
+
+class FakePahoClient:
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_connect = None
+        self.on_message = None
+
+    def connect(self, host, port, keepalive):
+        self.on_connect(self, None, {}, CONNACK_SUCCESS, None)
+
+    def subscribe(self, subscription, qos=0):
+        self.broker.subscribe(self, subscription)
+
+    def deliver(self, topic, payload):
+        self.on_message(self, None, MagicMock(topic=topic, payload=payload, mid=1, qos=0))
+
+
+@pytest.fixture
+def broker(mocker):
+    broker = FakeBroker()
+    mocker.patch('paho.mqtt.client.Client', side_effect=lambda **kwargs: FakePahoClient(broker))
+    return broker
+
+
+def make_consumer(shared_group):
+    pipeline = MagicMock()
+    client = MQTTClient(MagicMock(), topics=['power/measurement'], pipeline=pipeline,
+                        shared_group=shared_group)
+    client.client.connect('broker', 1883, 60)
+    return client, pipeline
+
+
+def test_shared_topic_format():
+    assert shared_topic('power/measurement', 'ingest') == '$share/ingest/power/measurement'
+    assert shared_topic('power/measurement', None) == 'power/measurement'
+
+
+def test_shared_group_from_environment(broker, monkeypatch):
+    monkeypatch.setenv('MQTT_SHARED_GROUP', 'flask-ingest')
+    client = MQTTClient(MagicMock(), topics=['power/measurement'])
+    assert client.shared_group == 'flask-ingest'
+
+
+def test_replicas_in_a_group_split_messages(broker):
+    """Two replicas in one consumer group each get a share and no message twice."""
+    first, first_pipeline = make_consumer('ingest')
+    second, second_pipeline = make_consumer('ingest')
+
+    for i in range(10):
+        broker.publish('power/measurement', f'{i}'.encode())
+
+    first_payloads = [c.args[0] for c in first_pipeline.submit.call_args_list]
+    second_payloads = [c.args[0] for c in second_pipeline.submit.call_args_list]
+    assert first_payloads and second_payloads
+    assert sorted(first_payloads + second_payloads) == sorted(f'{i}'.encode() for i in range(10))
+    # The real topic is passed through, not the $share filter
+    assert first_pipeline.submit.call_args.args[1] == 'power/measurement'
+
+
+def test_replicas_without_group_each_get_everything(broker):
+    """Without a group every replica receives every message (the old behaviour)."""
+    _, first_pipeline = make_consumer(None)
+    _, second_pipeline = make_consumer(None)
+
+    for i in range(3):
+        broker.publish('power/measurement', f'{i}'.encode())
+
+    assert first_pipeline.submit.call_count == 3
+    assert second_pipeline.submit.call_count == 3
+
+
+def test_at_least_once_uses_qos1_persistent_session_and_manual_ack(mocker, monkeypatch):
+    """at_least_once subscribes with QoS 1 on a persistent session and defers PUBACK."""
+    monkeypatch.setenv('MQTT_CLIENT_ID', 'ingest-1')
+    paho_client = mocker.patch('paho.mqtt.client.Client')
+    pipeline = MagicMock()
+    client = MQTTClient(MagicMock(), topics=['power/measurement'], pipeline=pipeline,
+                        shared_group='ingest', delivery='at_least_once')
+
+    paho_client.assert_called_once_with(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                                        client_id='ingest-1', clean_session=False, manual_ack=True)
+    client.on_connect(client.client, None, {}, CONNACK_SUCCESS, None)
+    client.client.subscribe.assert_called_once_with('$share/ingest/power/measurement', qos=1)
+
+    client.on_message(None, None, MagicMock(topic='power/measurement', payload=b'{}', mid=7, qos=1))
+    ack = pipeline.submit.call_args.args[2]
+    client.client.ack.assert_not_called()
+    ack()
+    client.client.ack.assert_called_once_with(7, 1)
+
+
+def test_unknown_delivery_mode_is_rejected(mocker):
+    mocker.patch('paho.mqtt.client.Client')
+    with pytest.raises(ValueError):
+        MQTTClient(MagicMock(), delivery='exactly_once')
+
+
+def test_at_least_once_rejects_drop_oldest_backpressure(mocker):
+    """Dropped messages would never be acked and would fill the broker's in-flight window."""
+    mocker.patch('paho.mqtt.client.Client')
+    with pytest.raises(ValueError):
+        MQTTClient(MagicMock(), pipeline=MagicMock(policy='drop_oldest'), delivery='at_least_once')
+    MQTTClient(MagicMock(), pipeline=MagicMock(policy='drop_oldest'), delivery='at_most_once')
+
+
+def test_failed_messages_force_one_reconnect_for_redelivery(mocker, monkeypatch):
+    """Unacknowledged messages are only resent on a new connection, so the client reconnects once per delay."""
+    monkeypatch.setenv('MQTT_REDELIVERY_DELAY', '0')
+    mocker.patch('paho.mqtt.client.Client')
+    client = MQTTClient(MagicMock(side_effect=RuntimeError("boom")), delivery='at_least_once')
+
+    client.on_message(None, None, MagicMock(topic='power/measurement', payload=b'{}', mid=7, qos=1))
+    timer = client._redelivery_timer
+    client.request_redelivery()
+    assert client._redelivery_timer is timer
+    timer.join(timeout=1)
+
+    client.client.disconnect.assert_called_once_with()
+    client.client.ack.assert_not_called()
+    assert client.forced_reconnects == 1
+
+
+def test_at_most_once_never_forces_reconnects(mocker):
+    mocker.patch('paho.mqtt.client.Client')
+    client = MQTTClient(MagicMock(), delivery='at_most_once')
+    client.request_redelivery()
+    assert client._redelivery_timer is None
+
+
+def test_client_uses_callback_api_v2(recwarn):
+    """paho 2.x warns about the VERSION1 callback API; the client is built on VERSION2."""
+    client = MQTTClient(MagicMock(), topics=['power/measurement'])
+    assert not [w for w in recwarn if 'Callback API version 1' in str(w.message)]
+
+    client.client.subscribe = MagicMock()
+    client.on_connect(client.client, None, {}, ReasonCode(PacketTypes.CONNACK, 'Not authorized'), None)
+    client.client.subscribe.assert_not_called()
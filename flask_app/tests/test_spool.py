@@ -0,0 +1,187 @@
+import datetime
+import json
+import pytest
+from unittest.mock import MagicMock
+
+import mysql.connector
+
+from modules.database import BatchWriter, is_data_error
+from modules.spool import QUARANTINE_FILE, Spool, SpoolReplayer
+
+UTC = datetime.timezone.utc
+
+
+def rows(count, start=0):
+    return [
+        (datetime.datetime(2024, 1, 1, 12, 0, i, tzinfo=UTC), "dev-1", 25.0, 50.0, 500, 1.0 + i)
+        for i in range(start, start + count)
+    ]
+
+
+def rows_at(*timestamps):
+    return [(datetime.datetime.fromisoformat(ts.replace('Z', '+00:00')), "dev-1", None, None, None, None)
+            for ts in timestamps]
+
+
+def test_append_and_replay_round_trip(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(rows(3))
+    assert spool.stats()['pending_rows'] == 3
+
+    inserted = []
+    assert spool.replay(inserted.extend, chunk_size=2) == 3
+
+    assert inserted == rows(3)
+    assert spool.stats() == {'segments': 0, 'bytes': 0, 'pending_rows': 0,
+                             'rows_appended': 3, 'rows_replayed': 3, 'rows_quarantined': 0}
+
+
+def test_segments_rotate_and_survive_restart(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    for i in range(4):
+        spool.append(rows(2, start=2 * i))
+    spool.close()
+    assert spool.stats()['segments'] > 1
+
+    reopened = Spool(str(tmp_path))
+    assert reopened.pending_rows == 8
+    inserted = []
+    reopened.replay(inserted.extend)
+    assert inserted == rows(8)
+
+
+def test_failed_replay_keeps_segment(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(rows(2))
+
+    with pytest.raises(RuntimeError):
+        spool.replay(MagicMock(side_effect=RuntimeError("db down")))
+
+    assert spool.pending_rows == 2
+    assert spool.stats()['segments'] == 1
+
+
+def test_unstorable_row_is_quarantined_and_replay_continues(tmp_path):
+    spool = Spool(str(tmp_path))
+    bad = (datetime.datetime(2024, 1, 1, 12, 0, 9, tzinfo=UTC), "dev-1", "n/a", 50.0, 500, 1.0)
+    spool.append(rows(2) + [bad] + rows(1, start=2))
+
+    inserted = []
+
+    def insert(chunk):
+        if bad in chunk:
+            raise mysql.connector.DatabaseError(msg="Incorrect double value: 'n/a'", errno=1366)
+        inserted.extend(chunk)
+        return len(chunk)
+
+    assert spool.replay(insert, chunk_size=2, is_bad_row=is_data_error) == 3
+
+    assert inserted == rows(3)
+    stats = spool.stats()
+    assert (stats['segments'], stats['pending_rows'], stats['rows_quarantined']) == (0, 0, 1)
+    with open(tmp_path / QUARANTINE_FILE) as f:
+        assert [json.loads(line)[2] for line in f] == ["n/a"]
+
+
+def test_connection_error_during_row_retry_keeps_segment(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(rows(2))
+    insert = MagicMock(side_effect=[mysql.connector.DataError("bad"), mysql.connector.InterfaceError("gone")])
+
+    with pytest.raises(mysql.connector.InterfaceError):
+        spool.replay(insert, is_bad_row=is_data_error)
+
+    assert spool.pending_rows == 2
+    assert spool.stats()['segments'] == 1
+    assert not (tmp_path / QUARANTINE_FILE).exists()
+
+
+def test_torn_record_is_skipped(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(rows(1))
+    spool.close()
+    with open(next(tmp_path.iterdir()), 'ab') as f:
+        f.write(b'["2024-01-01T12:')
+
+    inserted = []
+    Spool(str(tmp_path)).replay(inserted.extend)
+    assert inserted == rows(1)
+
+
+def test_writer_spools_when_insert_fails_and_replayer_recovers(tmp_path):
+    db = MagicMock()
+    db.insert_readings.side_effect = RuntimeError("db down")
+    spool = Spool(str(tmp_path))
+    acked = []
+    writer = BatchWriter(db, max_batch_size=1, max_batch_age=60, spool=spool)
+
+    writer.add("dev-1", "2024-01-01T12:00:00Z", on_commit=lambda: acked.append(1))
+    assert writer.degraded
+    assert acked == [1]  # durable on disk, safe to acknowledge
+
+    writer.add("dev-1", "2024-01-01T12:00:01Z")
+    assert db.insert_readings.call_count == 1  # degraded: straight to the spool
+    assert spool.pending_rows == 2
+
+    db.insert_readings.side_effect = None
+    db.insert_readings.return_value = 2
+    db.ping.return_value = True
+    assert SpoolReplayer(spool, writer).replay_once() == 2
+
+    assert not writer.degraded
+    assert spool.pending_rows == 0
+    assert db.insert_readings.call_args.kwargs == {'ignore_duplicates': True}
+
+
+def test_writer_keeps_batch_when_spool_append_fails(tmp_path, mocker):
+    """A spool that cannot be written (disk full) must not lose the batch or its acks."""
+    db = MagicMock()
+    db.insert_readings.side_effect = RuntimeError("db down")
+    spool = Spool(str(tmp_path))
+    append = mocker.patch.object(spool, 'append', side_effect=OSError(28, "No space left on device"))
+    acked = []
+    writer = BatchWriter(db, max_batch_size=1, max_batch_age=60, spool=spool)
+
+    writer.add("dev-1", "2024-01-01T12:00:00Z", on_commit=lambda: acked.append(1))
+    writer.add("dev-1", "2024-01-01T12:00:01Z", on_commit=lambda: acked.append(2))
+
+    assert acked == []
+    assert writer.pending() == 2
+    assert writer.stats()['flush_errors'] == 3
+
+    append.side_effect = None
+    assert writer.flush() == 2
+    assert append.call_args.args[0] == rows_at("2024-01-01T12:00:00Z", "2024-01-01T12:00:01Z")
+    assert acked == [1, 2]
+    assert writer.pending() == 0
+
+
+def test_writer_spools_over_latency_budget(tmp_path, mocker):
+    db = MagicMock()
+    db.insert_readings.return_value = 1
+    clock = mocker.patch('modules.database.time.monotonic', side_effect=[0.0, 0.0, 0.5])
+    writer = BatchWriter(db, max_batch_size=1, max_batch_age=60, spool=Spool(str(tmp_path)),
+                         latency_budget_ms=100)
+
+    writer.add("dev-1", "2024-01-01T12:00:00Z")
+
+    assert clock.call_count == 3
+    assert writer.degraded
+
+
+def test_replayer_connects_when_db_was_down_at_startup(tmp_path):
+    spool = Spool(str(tmp_path))
+    writer = BatchWriter(None, max_batch_size=10, max_batch_age=60, spool=spool)
+    writer.add("dev-1", "2024-01-01T12:00:00Z")
+    writer.flush()
+    assert spool.pending_rows == 1
+
+    db = MagicMock()
+    db.ping.return_value = True
+    connect = MagicMock(side_effect=[RuntimeError("still down"), db])
+    replayer = SpoolReplayer(spool, writer, connect=connect)
+
+    assert replayer.replay_once() == 0
+    assert replayer.replay_once() == 1
+    assert writer.db is db
+    assert not writer.degraded
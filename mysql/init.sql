@@ -11,7 +11,61 @@ CREATE TABLE IF NOT EXISTS power_readings (
     electric FLOAT COMMENT 'mA',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     INDEX idx_timestamp (timestamp),
-    INDEX idx_device_code (device_code)
+    -- One row per device sample; makes redelivered MQTT messages a no-op
+    -- (the leftmost column also serves device_code lookups)
+    UNIQUE KEY uq_device_timestamp (device_code, timestamp)
+);
+
+-- Per-device hourly and daily aggregates of power_readings, kept up to date by the ingest
+-- path in the same transaction as the inserted rows. Averages are <metric>_sum / <metric>_count.
+CREATE TABLE IF NOT EXISTS power_rollup_hourly (
+    bucket DATETIME NOT NULL COMMENT 'Start of the hour',
+    device_code VARCHAR(25) NOT NULL,
+    readings INT NOT NULL,
+    first_timestamp DATETIME NOT NULL,
+    last_timestamp DATETIME NOT NULL,
+    temperature_count INT NOT NULL DEFAULT 0,
+    temperature_sum DOUBLE NOT NULL DEFAULT 0,
+    temperature_min FLOAT,
+    temperature_max FLOAT,
+    humidity_count INT NOT NULL DEFAULT 0,
+    humidity_sum DOUBLE NOT NULL DEFAULT 0,
+    humidity_min FLOAT,
+    humidity_max FLOAT,
+    brightness_count INT NOT NULL DEFAULT 0,
+    brightness_sum DOUBLE NOT NULL DEFAULT 0,
+    brightness_min INT,
+    brightness_max INT,
+    electric_count INT NOT NULL DEFAULT 0,
+    electric_sum DOUBLE NOT NULL DEFAULT 0,
+    electric_min FLOAT,
+    electric_max FLOAT,
+    PRIMARY KEY (bucket, device_code)
+);
+
+CREATE TABLE IF NOT EXISTS power_rollup_daily (
+    bucket DATE NOT NULL COMMENT 'Day',
+    device_code VARCHAR(25) NOT NULL,
+    readings INT NOT NULL,
+    first_timestamp DATETIME NOT NULL,
+    last_timestamp DATETIME NOT NULL,
+    temperature_count INT NOT NULL DEFAULT 0,
+    temperature_sum DOUBLE NOT NULL DEFAULT 0,
+    temperature_min FLOAT,
+    temperature_max FLOAT,
+    humidity_count INT NOT NULL DEFAULT 0,
+    humidity_sum DOUBLE NOT NULL DEFAULT 0,
+    humidity_min FLOAT,
+    humidity_max FLOAT,
+    brightness_count INT NOT NULL DEFAULT 0,
+    brightness_sum DOUBLE NOT NULL DEFAULT 0,
+    brightness_min INT,
+    brightness_max INT,
+    electric_count INT NOT NULL DEFAULT 0,
+    electric_sum DOUBLE NOT NULL DEFAULT 0,
+    electric_min FLOAT,
+    electric_max FLOAT,
+    PRIMARY KEY (bucket, device_code)
 );
 
 CREATE TABLE IF NOT EXISTS esg_reports (
@@ -0,0 +1,14 @@
+-- Adds the (device_code, timestamp) unique key used for idempotent ingest
+-- to databases created before it was part of init.sql.
+USE power_measurement;
+
+-- Keep the first copy of any reading that was stored more than once
+DELETE newer FROM power_readings newer
+JOIN power_readings older
+  ON newer.device_code = older.device_code
+ AND newer.timestamp = older.timestamp
+ AND newer.id > older.id;
+
+ALTER TABLE power_readings
+    DROP INDEX idx_device_code,
+    ADD UNIQUE KEY uq_device_timestamp (device_code, timestamp);
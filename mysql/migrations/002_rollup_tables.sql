@@ -0,0 +1,53 @@
+-- Adds the hourly and daily rollup tables to databases created before they were part of init.sql.
+-- 003_backfill_rollups.sql fills them from existing readings.
+USE power_measurement;
+
+CREATE TABLE IF NOT EXISTS power_rollup_hourly (
+    bucket DATETIME NOT NULL COMMENT 'Start of the hour',
+    device_code VARCHAR(25) NOT NULL,
+    readings INT NOT NULL,
+    first_timestamp DATETIME NOT NULL,
+    last_timestamp DATETIME NOT NULL,
+    temperature_count INT NOT NULL DEFAULT 0,
+    temperature_sum DOUBLE NOT NULL DEFAULT 0,
+    temperature_min FLOAT,
+    temperature_max FLOAT,
+    humidity_count INT NOT NULL DEFAULT 0,
+    humidity_sum DOUBLE NOT NULL DEFAULT 0,
+    humidity_min FLOAT,
+    humidity_max FLOAT,
+    brightness_count INT NOT NULL DEFAULT 0,
+    brightness_sum DOUBLE NOT NULL DEFAULT 0,
+    brightness_min INT,
+    brightness_max INT,
+    electric_count INT NOT NULL DEFAULT 0,
+    electric_sum DOUBLE NOT NULL DEFAULT 0,
+    electric_min FLOAT,
+    electric_max FLOAT,
+    PRIMARY KEY (bucket, device_code)
+);
+
+CREATE TABLE IF NOT EXISTS power_rollup_daily (
+    bucket DATE NOT NULL COMMENT 'Day',
+    device_code VARCHAR(25) NOT NULL,
+    readings INT NOT NULL,
+    first_timestamp DATETIME NOT NULL,
+    last_timestamp DATETIME NOT NULL,
+    temperature_count INT NOT NULL DEFAULT 0,
+    temperature_sum DOUBLE NOT NULL DEFAULT 0,
+    temperature_min FLOAT,
+    temperature_max FLOAT,
+    humidity_count INT NOT NULL DEFAULT 0,
+    humidity_sum DOUBLE NOT NULL DEFAULT 0,
+    humidity_min FLOAT,
+    humidity_max FLOAT,
+    brightness_count INT NOT NULL DEFAULT 0,
+    brightness_sum DOUBLE NOT NULL DEFAULT 0,
+    brightness_min INT,
+    brightness_max INT,
+    electric_count INT NOT NULL DEFAULT 0,
+    electric_sum DOUBLE NOT NULL DEFAULT 0,
+    electric_min FLOAT,
+    electric_max FLOAT,
+    PRIMARY KEY (bucket, device_code)
+);
@@ -0,0 +1,87 @@
+-- Fills the rollup tables added by 002_rollup_tables.sql from the readings stored before them,
+-- so summaries, trends and ESG statistics cover existing history without a manual backfill.
+-- Same statements as flask_app/modules/rollups.py rebuild_*_query() over the whole history:
+-- buckets are recomputed, so it is safe to apply after scripts/backfill_rollups.py.
+-- Ingest inserts wait while it runs; apply it with the spool enabled or during a quiet period.
+USE power_measurement;
+
+INSERT INTO power_rollup_hourly (
+    bucket, device_code, readings, first_timestamp, last_timestamp,
+    temperature_count, temperature_sum, temperature_min, temperature_max,
+    humidity_count, humidity_sum, humidity_min, humidity_max,
+    brightness_count, brightness_sum, brightness_min, brightness_max,
+    electric_count, electric_sum, electric_min, electric_max
+)
+SELECT
+    DATE(timestamp) + INTERVAL HOUR(timestamp) HOUR AS hour_start,
+    device_code,
+    COUNT(*),
+    MIN(timestamp),
+    MAX(timestamp),
+    COUNT(temperature), COALESCE(SUM(temperature), 0), MIN(temperature), MAX(temperature),
+    COUNT(humidity), COALESCE(SUM(humidity), 0), MIN(humidity), MAX(humidity),
+    COUNT(brightness), COALESCE(SUM(brightness), 0), MIN(brightness), MAX(brightness),
+    COUNT(electric), COALESCE(SUM(electric), 0), MIN(electric), MAX(electric)
+FROM power_readings
+GROUP BY hour_start, device_code
+ON DUPLICATE KEY UPDATE
+    readings = VALUES(readings),
+    first_timestamp = VALUES(first_timestamp),
+    last_timestamp = VALUES(last_timestamp),
+    temperature_count = VALUES(temperature_count),
+    temperature_sum = VALUES(temperature_sum),
+    temperature_min = VALUES(temperature_min),
+    temperature_max = VALUES(temperature_max),
+    humidity_count = VALUES(humidity_count),
+    humidity_sum = VALUES(humidity_sum),
+    humidity_min = VALUES(humidity_min),
+    humidity_max = VALUES(humidity_max),
+    brightness_count = VALUES(brightness_count),
+    brightness_sum = VALUES(brightness_sum),
+    brightness_min = VALUES(brightness_min),
+    brightness_max = VALUES(brightness_max),
+    electric_count = VALUES(electric_count),
+    electric_sum = VALUES(electric_sum),
+    electric_min = VALUES(electric_min),
+    electric_max = VALUES(electric_max);
+
+-- Days are summed from the hours, like Database.rebuild_rollups()
+INSERT INTO power_rollup_daily (
+    bucket, device_code, readings, first_timestamp, last_timestamp,
+    temperature_count, temperature_sum, temperature_min, temperature_max,
+    humidity_count, humidity_sum, humidity_min, humidity_max,
+    brightness_count, brightness_sum, brightness_min, brightness_max,
+    electric_count, electric_sum, electric_min, electric_max
+)
+SELECT
+    DATE(bucket) AS day,
+    device_code,
+    SUM(readings),
+    MIN(first_timestamp),
+    MAX(last_timestamp),
+    SUM(temperature_count), SUM(temperature_sum), MIN(temperature_min), MAX(temperature_max),
+    SUM(humidity_count), SUM(humidity_sum), MIN(humidity_min), MAX(humidity_max),
+    SUM(brightness_count), SUM(brightness_sum), MIN(brightness_min), MAX(brightness_max),
+    SUM(electric_count), SUM(electric_sum), MIN(electric_min), MAX(electric_max)
+FROM power_rollup_hourly
+GROUP BY day, device_code
+ON DUPLICATE KEY UPDATE
+    readings = VALUES(readings),
+    first_timestamp = VALUES(first_timestamp),
+    last_timestamp = VALUES(last_timestamp),
+    temperature_count = VALUES(temperature_count),
+    temperature_sum = VALUES(temperature_sum),
+    temperature_min = VALUES(temperature_min),
+    temperature_max = VALUES(temperature_max),
+    humidity_count = VALUES(humidity_count),
+    humidity_sum = VALUES(humidity_sum),
+    humidity_min = VALUES(humidity_min),
+    humidity_max = VALUES(humidity_max),
+    brightness_count = VALUES(brightness_count),
+    brightness_sum = VALUES(brightness_sum),
+    brightness_min = VALUES(brightness_min),
+    brightness_max = VALUES(brightness_max),
+    electric_count = VALUES(electric_count),
+    electric_sum = VALUES(electric_sum),
+    electric_min = VALUES(electric_min),
+    electric_max = VALUES(electric_max);
@@ -103,6 +103,17 @@ export async function getPowerData(params = {}) {
   }
 }
 
+// 과거 데이터 페이지 조회 (캐시 없음). params: { limit, device_code, start, end, cursor }
+// nextCursor 를 다음 호출의 cursor 로 넘기면 이어지는 페이지, null 이면 마지막 페이지
+export async function getPowerDataPage(params = {}) {
+  try {
+    const response = await apiClient.get('/power_data', { params });
+    return { data: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+  } catch (error) {
+    throw handleApiError(error, 'Power Data API');
+  }
+}
+
 export async function getSummary(timeRange = '24h') {
   const cacheKey = getCacheKey('summary', { timeRange });
   const cached = getFromCache(cacheKey);
@@ -219,8 +230,10 @@ export async function getLatestPowerData() {
 }
 
 // 트렌드 데이터 함수
-export async function getTrendData(timeRange = '24h') {
-  const cacheKey = getCacheKey('trend', { timeRange });
+// options: { bucket: '1m'|'5m'|'15m'|'1h'|'1d', start, end (ISO 8601), device_code }
+export async function getTrendData(timeRange = '24h', options = {}) {
+  const params = { timeRange, ...options };
+  const cacheKey = getCacheKey('trend', params);
   const cached = getFromCache(cacheKey);
   
   if (cached) {
@@ -230,9 +243,7 @@ export async function getTrendData(timeRange = '24h') {
   setLoading('trend', true);
   
   try {
-    const response = await apiClient.get('/trend', { 
-      params: { timeRange } 
-    });
+    const response = await apiClient.get('/trend', { params });
     const data = response.data;
     setToCache(cacheKey, data);
     return { data, fromCache: false };
@@ -268,6 +279,7 @@ export function getAllLoadingStates() {
 // 기본 export
 export default {
   getPowerData,
+  getPowerDataPage,
   getSummary,
   getESGReports,
   generateESGReport,
@@ -15,6 +15,16 @@ const serverStatus = ref({
   client_id: null
 });
 
+// 재접속 시 놓친 측정값을 이어받기 위한 커서 (서버 프로세스별 stream + 순번 seq)
+const resumeCursor = { stream: null, seq: null, since: null };
+
+function resumeAuth() {
+  if (resumeCursor.stream === null) {
+    return {};
+  }
+  return { stream: resumeCursor.stream, since_seq: resumeCursor.seq, since: resumeCursor.since };
+}
+
 // Socket 인스턴스 생성
 const socket = io('/', {
   path: '/socket.io',
@@ -24,7 +34,10 @@ const socket = io('/', {
   reconnectionAttempts: 5,
   reconnectionDelay: 1000,
   reconnectionDelayMax: 5000,
-  maxReconnectionAttempts: 5
+  maxReconnectionAttempts: 5,
+  // 서버가 실시간 측정값을 묶음(readings_batch) 프레임으로 전송하도록 요청하고,
+  // 재접속 때는 마지막으로 받은 위치를 보내 놓친 측정값을 한 번에 받음
+  auth: (cb) => cb({ batch: true, ...resumeAuth() })
 });
 
 // 연결 이벤트 핸들러
@@ -95,6 +108,41 @@ socket.on('reading', (data) => {
   console.log('Real-time data received:', data);
 });
 
+// 묶음 프레임을 개별 'reading' 리스너에 그대로 전달 (기존 컴포넌트 호환)
+function dispatchReadings(readings, skipSeen) {
+  const listeners = socket.listeners('reading');
+  for (const reading of readings || []) {
+    // 재접속 직후 resume 프레임과 겹친 측정값은 한 번만 전달
+    if (skipSeen && reading.seq != null && resumeCursor.seq != null && reading.seq <= resumeCursor.seq) {
+      continue;
+    }
+    listeners.forEach(listener => listener(reading));
+    if (reading.seq != null && (resumeCursor.seq == null || reading.seq > resumeCursor.seq)) {
+      resumeCursor.seq = reading.seq;
+    }
+    if (reading.timestamp) {
+      resumeCursor.since = reading.timestamp;
+    }
+  }
+}
+
+// 처리 후 ack 를 보내야 서버가 다음 프레임을 전송 (ack 가 밀리면 서버가 장치별 최신값만 남김)
+socket.on('readings_batch', (batch, ack) => {
+  dispatchReadings(batch.readings, true);
+  if (typeof ack === 'function') {
+    ack();
+  }
+});
+
+// 재접속 시 서버가 보낸 놓친 측정값(replay) 또는 장치별 최신값(snapshot)
+socket.on('resume', (frame) => {
+  console.log(`Resumed with ${frame.mode} of ${frame.count} readings`);
+  dispatchReadings(frame.readings, false);
+  // 서버가 재시작되면 순번이 새로 시작되므로 새 stream 기준으로 다시 맞춤
+  resumeCursor.seq = frame.stream === resumeCursor.stream ? Math.max(resumeCursor.seq ?? 0, frame.seq) : frame.seq;
+  resumeCursor.stream = frame.stream;
+});
+
 // 에러 핸들링
 socket.on('error', (error) => {
   console.error('Socket error:', error);
@@ -108,6 +156,11 @@ socket.on('error', (error) => {
 // 서버 이벤트 리스너들 추가
 socket.on('connection_status', (data) => {
   console.log('Connection status received:', data);
+  if (resumeCursor.stream === null) {
+    // 첫 접속: 이후 측정값부터 커서를 이어감
+    resumeCursor.stream = data.stream;
+    resumeCursor.seq = data.seq;
+  }
   serverStatus.value = {
     mqtt_connected: data.mqtt_connected,
     db_available: data.db_available,
@@ -138,6 +191,10 @@ socket.on('room_left', (data) => {
   console.log('Left room:', data.room);
 });
 
+socket.on('subscribed', (data) => {
+  console.log('Device subscription:', data);
+});
+
 socket.on('error', (error) => {
   console.error('Server error received:', error);
   lastError.value = {
@@ -279,6 +336,19 @@ function leaveRoom(roomName) {
   }
 }
 
+// 장치 구독: 지정한 장치/그룹의 측정값만 수신 ({ devices: [...], groups: [...], all: false })
+function subscribeDevices(subscription) {
+  if (socket.connected) {
+    socket.emit('subscribe', subscription);
+  }
+}
+
+function unsubscribeDevices(subscription) {
+  if (socket.connected) {
+    socket.emit('unsubscribe', subscription);
+  }
+}
+
 // 서버 상태 확인 함수
 function getServerStatus() {
   return {
@@ -344,6 +414,8 @@ export {
   sendPing,
   joinRoom,
   leaveRoom,
+  subscribeDevices,
+  unsubscribeDevices,
   getServerStatus,
   testConnectionQuality
 }; 
\ No newline at end of file